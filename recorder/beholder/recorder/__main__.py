@@ -13,10 +13,10 @@ from .utils import _log, setup_logging
 @click.option('--verbose/--silent', default=True, type=bool)
 @click.option('--log_backup', default=0, type=int)
 def main(config_path, credentials_path, log_level, verbose, log_backup):
-    log_rotator = setup_logging(log_level, "logs/log", log_backup)
+    log_shipper = setup_logging(log_level, "logs/log", log_backup)
     _log().info("config_path: %s", config_path)
     controller = Controller(config_path, credentials_path, verbose=verbose)
-    log_rotator.callback = controller.upload_logs
+    log_shipper.callback = controller.upload_logs
     controller.run()
 
 
@@ -1,93 +1,201 @@
 import cv2  # type: ignore
-import datetime
-import time
 import logging
+import logging.handlers
+import multiprocessing
+import signal
+import sys
+import threading
+import time
 
-from typing import List, Tuple
-
-import numpy as np  # type: ignore
+from typing import Dict, Optional
 
 from .configuration import Configuration
-from .utils import _log, BackcallerTimedRotatingFileHandler
-
-
-class MotionDetector():
-    def __init__(self, height: int, width: int, learning_rate: float = 0.2):
-        self.bgs = cv2.createBackgroundSubtractorMOG2()
-        self.fgmask = np.zeros((height, width), np.uint8)
-        self.learning_rate = learning_rate
-
-        self.height = height
-        self.widht = width
-        self.percent_area = height * width / 5000
-
-    def motion_bboxes(self, frame) -> List[Tuple[int, int, int, int]]:
-        self.fgmask = self.bgs.apply(frame, self.fgmask, 0.5)
-        _, absolute_difference = cv2.threshold(
-            self.fgmask,
-            100, 255,
-            cv2.THRESH_BINARY)
-        contours, hierarchy = cv2.findContours(
-            absolute_difference,
-            cv2.RETR_TREE,
-            cv2.CHAIN_APPROX_SIMPLE)[-2:]
-        areas = [cv2.contourArea(c) for c in contours]
-        return self.biggest_bounding_box(areas, contours)
-
-    def biggest_bounding_box(self, areas, contours) -> List[Tuple[int, int, int, int]]:
-        if len(areas) == 0: return []
-        num_boxes = min(len(areas), 3)
-        indices = np.argpartition(areas, -num_boxes)[-num_boxes:]
-        return [
-            cv2.boundingRect(contours[idx])
-            for idx in indices
-            if areas[idx] > self.percent_area
-        ]
-
-
-def computer_vision(config: Configuration, upload_detection_logs):
+from .detection_log import DetectionWriter
+from .frame_ring import Frame, FrameRing
+from .motion import TiledDetector
+from .work_queue import WorkQueue
+from .utils import _log
+
+FPS_WINDOW_SECONDS = 10
+# how long to wait on the frame ring before checking the pipeline is still there
+FRAME_TIMEOUT_SECONDS = 5
+
+
+# ------------------------------------------------------------------------------
+# Frame sources. Both only ever hand out the newest frame, whatever arrived in
+# between is skipped rather than queued up behind a slow detector.
+# ------------------------------------------------------------------------------
+class LoopbackSource():
+    """Reads the loopback device on its own thread and keeps only the last frame"""
+    def __init__(self, config: Configuration):
+        self.cap = cv2.VideoCapture(config.loopback_number)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.loopback_width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.loopback_height)
+        _log().info("successfully opened computer loopback camera")
+        self.frame: Optional[Frame] = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.read, name="cv-loopback", daemon=True)
+        self.thread.start()
+
+    def read(self):
+        seq = 0
+        while True:
+            ret, image = self.cap.read()
+            with self.condition:
+                if not ret:
+                    self.closed = True
+                else:
+                    seq += 1
+                    self.frame = Frame(seq, time.time(), image)
+                self.condition.notify_all()
+            if not ret:
+                return
+
+    def next(self, after: int, timeout: float) -> Optional[Frame]:
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.closed or (self.frame is not None and self.frame.seq > after),
+                timeout)
+            if self.frame is None or self.frame.seq <= after:
+                return None
+            return self.frame
+
+    def close(self):
+        self.cap.release()
+
+
+class RingSource():
+    """The newest frame in the shared memory frame ring the pipeline writes to"""
+    def __init__(self, name: str):
+        self.ring = FrameRing.attach(name)
+        # the ring outlives pipeline restarts, it only goes away with the controller
+        self.closed = False
+        _log().info("reading frames from shared memory %s", name)
+
+    def next(self, after: int, timeout: float) -> Optional[Frame]:
+        frame = self.ring.wait(after, timeout)
+        if frame is None:
+            return None
+        image = frame.image
+        if image.shape[2] == 4:
+            # BGRx from nvvidconv, the conversion doubles as the copy out of the ring
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        else:
+            image = image.copy()
+        if not self.ring.valid(frame):
+            # overwritten while we were reading it
+            return None
+        return Frame(frame.seq, frame.timestamp, image)
+
+    def close(self):
+        self.ring.close()
+
+
+# ------------------------------------------------------------------------------
+# Reporting back to the controller
+# ------------------------------------------------------------------------------
+class CvStats():
+    """Counters the detection process shares with the controller, which owns the metrics"""
+    FRAMES, SKIPPED, FPS, LAG, TILES_SKIPPED = range(5)
+
+    def __init__(self, context=multiprocessing):
+        self.values = context.Array("d", 5)
+
+    def frame(self, skipped: int, lag: float, tiles_skipped: int = 0):
+        with self.values.get_lock():
+            self.values[self.FRAMES] += 1
+            self.values[self.SKIPPED] += skipped
+            self.values[self.LAG] = lag
+            self.values[self.TILES_SKIPPED] += tiles_skipped
+
+    def fps(self, fps: float):
+        self.values[self.FPS] = fps
+
+    def read(self) -> Dict[str, float]:
+        with self.values.get_lock():
+            values = list(self.values)
+        return {
+            "frames": values[self.FRAMES], "skipped": values[self.SKIPPED],
+            "fps": values[self.FPS], "lag": values[self.LAG],
+            "tiles_skipped": values[self.TILES_SKIPPED]}
+
+
+def forward_logs(log_queue, level: int):
+    # a spawned process starts without handlers, send everything to the controller's
+    logger = _log()
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+# ------------------------------------------------------------------------------
+# Detection process
+# ------------------------------------------------------------------------------
+def computer_vision(config: Configuration, frame_ring_name: Optional[str], stats: CvStats,
+                    log_queue=None, log_level: int = logging.INFO):
+    """Entry point of the detection process, runs until its frame source goes away"""
+    if log_queue is not None:
+        forward_logs(log_queue, log_level)
     time.sleep(2)
-    if config.loopbackdevice is None:
+    if frame_ring_name is None and config.loopbackdevice is None:
         _log().info("No loopback device. Not running computer vision")
         return False
 
     # --------------------------------------------------------------------------
     # Setup Capture
     # --------------------------------------------------------------------------
-    motion_detector = MotionDetector(config.loopback_height, config.loopback_width)
-    cap = cv2.VideoCapture(config.loopback_number)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.loopback_width)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.loopback_height)
-    _log().info("successfully opened computer loopback camera")
+    if not config.cameras:
+        _log().info("No cameras. Not running computer vision")
+        return False
+    # the loopback frame is the whole compositor canvas, squeezed to the loopback size
+    motion_detector = TiledDetector(
+        config.motion_detector, config.layout(), [device.number for device in config.cameras],
+        config.loopback_height, config.loopback_width)
+    _log().info("motion detector %s on %d camera tiles",
+                config.motion_detector, len(motion_detector.tiles))
+    source = RingSource(frame_ring_name) if frame_ring_name else LoopbackSource(config)
     # --------------------------------------------------------------------------
     # Setup Outputter
     # --------------------------------------------------------------------------
     motion_detection_directory = (
         config.output_directory / config.observation_id / "detections" / "motion_capture")
-    motion_detection_directory.mkdir(exist_ok=True, parents=True)
-
-    _cv_logger = logging.getLogger("cv_motion_rolling_csv_outputter")
-    formatter = logging.Formatter(
-        "%(message)s"
-    )
-    handler = BackcallerTimedRotatingFileHandler(
-        motion_detection_directory / "log",
-        when="M", interval=config.segment_time_seconds / 60, backupCount=0
-    )
-    handler.setFormatter(formatter)
-    _cv_logger.addHandler(handler)
-    _cv_logger.propagate = False
-    _cv_logger.setLevel(logging.INFO)
-    handler.callback = upload_detection_logs
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        now = datetime.datetime.now().timestamp()
-        bboxes = motion_detector.motion_bboxes(frame)
-        for bbox in bboxes:
-            _cv_logger.info(
-                "%s,%s,%s,%s,%s",
-                now, bbox[0], bbox[1], bbox[2], bbox[3])
-        time.sleep(1 / 5)
+    # finished chunks are picked up by upload_all
+    # and the motion per window goes to the work queue, to rank segments for upload
+    work_queue = WorkQueue(config.work_queue_path)
+    writer = DetectionWriter(
+        motion_detection_directory, config.segment_time_seconds,
+        on_window=work_queue.record_activity)
+    # the controller stops us with SIGTERM, unwind so the last chunk gets written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+
+    interval = 1 / config.cv_fps
+    seq = 0
+    frames = 0
+    fps_start = next_tick = time.monotonic()
+    try:
+        while not source.closed:
+            frame = source.next(seq, FRAME_TIMEOUT_SECONDS)
+            if frame is None:
+                # the pipeline is restarting or gone, carry on with whatever comes next
+                writer.tick(time.time())
+                continue
+            skipped = frame.seq - seq - 1 if seq else 0
+            seq = frame.seq
+            tiles_skipped = motion_detector.skipped
+            bboxes = motion_detector.motion_bboxes(frame.image)
+            writer.add(frame.timestamp, bboxes)
+            stats.frame(
+                skipped, time.time() - frame.timestamp, motion_detector.skipped - tiles_skipped)
+            frames += 1
+            now = time.monotonic()
+            if now - fps_start >= FPS_WINDOW_SECONDS:
+                stats.fps(frames / (now - fps_start))
+                frames, fps_start = 0, now
+            # pace on a fixed schedule, when running behind just start again from now
+            next_tick = max(next_tick + interval, now)
+            time.sleep(next_tick - now)
+    finally:
+        writer.close()
+        source.close()
+    return True
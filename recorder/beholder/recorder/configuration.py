@@ -1,40 +1,16 @@
 import configparser
 import json
 import pathlib
-import re
 
-from dataclasses import dataclass
 from typing import Dict, List, Optional, Tuple, Union
 
-import v4l2ctl # type: ignore
-import sounddevice # type: ignore
-
+# the device classes used to live here
+from .devices import (  # noqa: F401
+    CameraDevice, DeviceComplex, DeviceRegistry, MicrophoneDevice, get_joined_devices)
+from .layout import Layout, compute_layout
+from .pipeline import cv_format_channels, get_profile
 from .utils import _log
 
-@dataclass
-class CameraDevice:
-    name: str
-    device: str
-    format: str
-
-@dataclass
-class MicrophoneDevice:
-    name: str
-    device: str
-    channels: int
-
-@dataclass
-class DeviceComplex:
-    camera: CameraDevice
-    microphone: Optional[MicrophoneDevice]
-    primary: bool
-    loopback: bool
-    number: int
-
-    @property
-    def path_friendly_name(self):
-        return self.camera.name.replace(" ", "_").replace(":", "") + f"_device_{self.number}"
-
 class Configuration():
     def __init__(self,
                  user_config: Dict[str, str],
@@ -54,11 +30,30 @@ class Configuration():
                  hls_list_size: int = 2,
                  hls_target_duration: int = 1,
                  loopback_enabled: bool = False,
+                 gstreamer_in_process: bool = False,
+                 pipeline_profile: str = "jetson",
+                 cv_transport: str = "loopback",
+                 cv_fps: float = 5,
+                 motion_detector: str = "mog2",
                  purgatory_hours: float = 0,
                  restart_seconds: int = 3600,
-                 spaces_root_key: str = "beholder"):
+                 restart_mode: str = "respawn",
+                 poll_seconds: float = 10,
+                 device_settle_seconds: float = 2,
+                 schedule_socket: pathlib.Path = pathlib.Path("/tmp/beholder/schedule.sock"),
+                 storage_high_watermark: float = 0.90,
+                 storage_low_watermark: float = 0.80,
+                 storage_eviction_policy: str = "oldest",
+                 upload_policy: str = "oldest",
+                 activity_threshold: float = 0.02,
+                 quiet_delay_hours: float = 24,
+                 metrics_path: Optional[pathlib.Path] = pathlib.Path("/tmp/beholder/metrics.prom"),
+                 metrics_interval_seconds: float = 15,
+                 spaces_root_key: str = "beholder",
+                 device_registry: Optional[DeviceRegistry] = None):
         self.primary_device_name = primary_device_name
         self.devices: List[DeviceComplex] = devices
+        self.device_registry = device_registry
         self.output_directory = output_directory
         self.observation_id = observation_id
         self.record_fps = record_fps
@@ -76,14 +71,44 @@ class Configuration():
         self.hls_target_duration = hls_target_duration
 
         self.loopback_enabled = loopback_enabled
+        self.gstreamer_in_process = gstreamer_in_process
+        self.pipeline_profile = pipeline_profile
+        self.cv_transport = cv_transport
+        self.cv_fps = cv_fps
+        self.motion_detector = motion_detector
 
         self.restart_seconds = restart_seconds
+        self.restart_mode = restart_mode
+        self.poll_seconds = poll_seconds
+        self.device_settle_seconds = device_settle_seconds
+        self.schedule_socket = schedule_socket
         self.purgatory_hours = purgatory_hours
 
+        self.storage_high_watermark = storage_high_watermark
+        self.storage_low_watermark = storage_low_watermark
+        self.storage_eviction_policy = storage_eviction_policy
+
+        self.upload_policy = upload_policy
+        self.activity_threshold = activity_threshold
+        self.quiet_delay_hours = quiet_delay_hours
+
+        self.metrics_path = metrics_path
+        self.metrics_interval_seconds = metrics_interval_seconds
+
         self.spaces_root_key = spaces_root_key
 
         self.verbose: Optional[bool] = None
 
+        self.mark_primary()
+
+    def __getstate__(self):
+        # computer vision gets a pickled copy, the registry (and its lock) stays with the
+        # controller that listens for udev events
+        state = self.__dict__.copy()
+        state["device_registry"] = None
+        return state
+
+    def mark_primary(self):
         if self.primary_device is not None:
             self.primary_device.primary = True
 
@@ -105,9 +130,18 @@ class Configuration():
     def loopback_number(self) -> Optional[int]:
         for device in self.devices:
             if device.loopback:
-                return int(str(device.camera.device)[-1])
+                return device.number
         return None
 
+    @property
+    def frame_ring_enabled(self) -> bool:
+        # frames can only be handed over in process, from an appsink
+        return self.loopback_enabled and self.cv_transport == "shm" and self.gstreamer_in_process
+
+    @property
+    def frame_channels(self) -> int:
+        return cv_format_channels(get_profile(self.pipeline_profile).cv_format)
+
     @property
     def write_paths(self) -> List[pathlib.Path]:
         paths: List[pathlib.Path] = []
@@ -152,91 +186,106 @@ class Configuration():
             self.verbose = flag
 
     def gstreamer_flags(self) -> List[str]:
-        stream = []
+        return ["gst-launch-1.0", "-e"] + self.gstreamer_pipeline().split(" ")
 
-        stream.append("gst-launch-1.0 -e ")
+    def gstreamer_pipeline(self) -> str:
+        profile = get_profile(self.pipeline_profile)
         out_time_ns = seconds2ns(self.segment_time_seconds)
+        cameras = self.cameras
+        layout = self.layout()
+        sinks = "".join(
+            f" sink_{tile.sink}::xpos={tile.x} sink_{tile.sink}::ypos={tile.y}"
+            f" sink_{tile.sink}::width={tile.width} sink_{tile.sink}::height={tile.height}"
+            for tile in layout.tiles)
+
+        stream = []
         compositor = (
-            "nvcompositor name=comp"
-            " sink_0::xpos=0    sink_0::ypos=0   sink_0::width=1280 sink_0::height=720"
-            " sink_1::xpos=1280 sink_1::ypos=0   sink_1::width=1280 sink_1::height=720"
-            " sink_2::xpos=0    sink_2::ypos=720 sink_2::width=1280 sink_2::height=720"
-            " ! nvvidconv"
-            f" ! video/x-raw(memory:NVMM),width=2560,height=1440,"
-            f"framerate={self.output_fps}/1,format=NV12"
+            f"{profile.compositor} name=comp{sinks}"
+            f" ! {profile.converter}"
+            " ! " + profile.raw_caps(
+                layout.width, layout.height, self.output_fps, profile.encode_format) +
             " ! tee name=u ! queue max-size-buffers=0 max-size-time=0"
-            " ! nvv4l2h264enc preset-level=1 insert-vui=1 iframeinterval=30"
+            f" ! {profile.encoder(self.output_fps)}"
             " ! h264parse ! tee name=t"
             f" t. ! splitmuxsink max-size-time={out_time_ns}"
-            f" location={str(self.out_location)} mux=qtmux name=mux sync=false")
+            f" location={str(self.out_location)} {profile.splitmux_options} name=mux")
         if self.hls_enabled:
             compositor += (
                 f" t. ! h264parse ! video/x-h264 "
                 f" ! hlssink2 max-files={self.hls_list_size}"
                 f" location={str(self.hls_location)} target-duration={self.hls_target_duration}"
                 f" playlist_location={str(self.hls_playlist_location)}") # noqa: E122
-        if self.loopback_enabled and self.loopbackdevice is not None:
+        if self.frame_ring_enabled:
+            # never let computer vision hold up the encoder, drop frames instead
+            compositor += (
+                " u. ! queue leaky=downstream max-size-buffers=2 max-size-time=0 max-size-bytes=0"
+                f" ! {profile.converter}"
+                " ! " + profile.raw_caps(
+                    self.loopback_width, self.loopback_height, self.record_fps,
+                    profile.cv_format, memory="") +
+                " ! appsink name=cv emit-signals=true max-buffers=1 drop=true sync=false")
+        elif self.loopback_enabled and self.loopbackdevice is not None:
             compositor += (
                 " u. ! queue max-size-buffers=0 max-size-time=0" # noqa: E122
-                " ! nvvidconv" # noqa: E122
-                f" ! video/x-raw,width={self.loopback_width},height={self.loopback_height},framerate={self.record_fps}/1,format=UYVY" # noqa: E122, E501
-                " ! identity drop-allocation=true !"                      # noqa: E122
-                f" v4l2sink device={self.loopbackdevice.camera.device}")  # noqa: E122
+                f" ! {profile.converter}" # noqa: E122
+                " ! " + profile.raw_caps( # noqa: E122
+                    self.loopback_width, self.loopback_height, self.record_fps, "UYVY", memory="") +
+                f" ! {profile.loopback_sink(self.loopbackdevice.camera.device)}")
 
         inputs = []
-        sink_idx = 1 # starts at 1 because the primary device is always 0
-        for device in self.devices:
-            if device.loopback: continue
-            if device.primary:
-                inputs.append(
-                    (f"v4l2src device={device.camera.device}"
-                     " ! image/jpeg,width=1280,height=720,framerate=30/1,pixel-aspect-ratio=1/1"
-                     " ! jpegdec ! nvvidconv"
-                     f" ! video/x-raw(memory:NVMM),width=1280,height=720,"
-                     f"framerate={self.record_fps}/1,format=RGBA"
-                     " ! queue max-size-buffers=0 max-size-time=0 max-size-bytes=0"
-                     " ! comp.sink_0 ")
-                )
-                if device.microphone is not None:
-                    inputs.append(
-                        (f"alsasrc device={device.microphone.device} latency-time=10000"
-                         " ! audioconvert ! audioresample ! audio/x-raw"
-                         " ! voaacenc ! queue max-size-buffers=0 max-size-time=0 max-size-bytes=0"
-                         " ! mux.audio_0 ")
-                    )
-            else:
+        for sink_idx, (device, tile) in enumerate(zip(cameras, layout.tiles)):
+            width, height = tile.width, tile.height
+            inputs.append(
+                (f"{profile.video_source(device.camera.device, device.number, width, height)}"
+                 " ! " + profile.raw_caps(
+                     width, height, self.record_fps, profile.composite_format) +
+                 " ! queue max-size-buffers=0 max-size-time=0 max-size-bytes=0"
+                 f" ! comp.sink_{sink_idx} ")
+            )
+            # the primary microphone is always recorded, the others only on request
+            if device.microphone is not None and (device.primary or self.multi_audio_stream):
                 inputs.append(
-                    (f"v4l2src device={device.camera.device}"
-                     " ! image/jpeg,width=1280,height=720,framerate=30/1,"
-                     "pixel-aspect-ratio=1/1"
-                     " ! jpegdec ! nvvidconv"
-                     f" ! video/x-raw(memory:NVMM),width=1280,height=720,"
-                     f"framerate={self.record_fps}/1,format=RGBA"
+                    (f"{profile.audio_source(device.microphone.device)}"
+                     " ! audioconvert ! audioresample ! audio/x-raw"
+                     f" ! {profile.audio_encoder}"
                      " ! queue max-size-buffers=0 max-size-time=0 max-size-bytes=0"
-                     f" ! comp.sink_{sink_idx} ")
+                     f" ! mux.audio_{sink_idx} ")
                 )
-                if device.microphone is not None and self.multi_audio_stream:
-                    inputs.append(
-                        (f"alsasrc device={device.microphone.device} latency-time=10000"
-                         " ! audioconvert ! audioresample ! audio/x-raw"
-                         " ! voaacenc ! queue max-size-buffers=0 max-size-time=0 max-size-bytes=0"
-                         f" ! mux.audio_{sink_idx} ")
-                    )
-                sink_idx += 1
         stream.append(compositor)
         stream.append("".join(inputs))
 
         s = " ".join(stream)
-        flags = [_s for _s in s.split(" ") if _s != ""]
-        return flags
+        return " ".join(_s for _s in s.split(" ") if _s != "")
+
+    @property
+    def cameras(self) -> List[DeviceComplex]:
+        """Recording cameras in compositor sink order, the primary device is always sink 0"""
+        return sorted(
+            (device for device in self.devices if not device.loopback),
+            key=lambda device: not device.primary)
+
+    def camera_resolution(self, device: DeviceComplex) -> Tuple[int, int]:
+        return parse_resolution(
+            self.primary_resolution if device.primary else self.secondary_resolution)
+
+    def layout(self) -> Layout:
+        return compute_layout([self.camera_resolution(device) for device in self.cameras])
 
     def refresh_devices(self):
-        self.devices = get_joined_devices()
+        if self.device_registry is not None:
+            self.devices = self.device_registry.devices()
+        else:
+            self.devices = get_joined_devices()
+        self.mark_primary()
 
     @property
     def observation_directory(self) -> pathlib.Path:
         return self.output_directory / self.observation_id
 
+    @property
+    def work_queue_path(self) -> pathlib.Path:
+        return self.observation_directory / "work_queue.sqlite3"
+
     @classmethod
     def from_file(cls, cfgpath: Union[str, pathlib.Path]):
         # ----------------------------------------------------------------------
@@ -262,11 +311,12 @@ class Configuration():
         #  Parse config and map devices
         # ----------------------------------------------------------------------
 
-        devices = get_joined_devices()
+        device_registry = DeviceRegistry()
+        devices = device_registry.devices()
         user_config_pth = pathlib.Path(parser.get("beholder", "user_config"))
         output_directory = user_config_pth / "beholder-data"
         user_config = parse_user_config(user_config_pth / "config.json")
-        return Configuration(
+        config = Configuration(
             user_config=user_config,
             primary_device_name=parser.get("beholder", "primary_device_name"),
             devices=devices,
@@ -285,10 +335,40 @@ class Configuration():
             hls_list_size=parser.getint("beholder", "hls_list_size", fallback=5),
             hls_target_duration=parser.getint("beholder", "hls_target_duration", fallback=1),
             loopback_enabled=parser.getboolean("beholder", "loopback_enabled", fallback=False),
+            gstreamer_in_process=parser.getboolean(
+                "beholder", "gstreamer_in_process", fallback=False),
+            pipeline_profile=parser.get("beholder", "pipeline_profile", fallback="jetson"),
+            cv_transport=parser.get("beholder", "cv_transport", fallback="loopback"),
+            cv_fps=parser.getfloat("beholder", "cv_fps", fallback=5),
+            motion_detector=parser.get("beholder", "motion_detector", fallback="mog2"),
             restart_seconds=parser.getint("beholder", "restart_seconds", fallback=0),
+            restart_mode=parser.get("beholder", "restart_mode", fallback="respawn"),
+            poll_seconds=parser.getfloat("beholder", "poll_seconds", fallback=10),
+            device_settle_seconds=parser.getfloat(
+                "beholder", "device_settle_seconds", fallback=2),
+            schedule_socket=pathlib.Path(parser.get(
+                "beholder", "schedule_socket", fallback="/tmp/beholder/schedule.sock")),
             purgatory_hours=parser.getfloat("beholder", "purgatory_hours", fallback=0),
-            spaces_root_key=parser.get("beholder", "spaces_root_key", fallback="beholder")
+            storage_high_watermark=parser.getfloat(
+                "beholder", "storage_high_watermark", fallback=0.90),
+            storage_low_watermark=parser.getfloat(
+                "beholder", "storage_low_watermark", fallback=0.80),
+            storage_eviction_policy=parser.get(
+                "beholder", "storage_eviction_policy", fallback="oldest"),
+            upload_policy=parser.get("beholder", "upload_policy", fallback="oldest"),
+            activity_threshold=parser.getfloat("beholder", "activity_threshold", fallback=0.02),
+            quiet_delay_hours=parser.getfloat("beholder", "quiet_delay_hours", fallback=24),
+            metrics_path=optional_path(parser.get(
+                "beholder", "metrics_path", fallback="/tmp/beholder/metrics.prom")),
+            metrics_interval_seconds=parser.getfloat(
+                "beholder", "metrics_interval_seconds", fallback=15),
+            spaces_root_key=parser.get("beholder", "spaces_root_key", fallback="beholder"),
+            device_registry=device_registry
         )
+        if config.restart_mode == "split" and not config.gstreamer_in_process:
+            _log().warning("restart_mode = split needs gstreamer_in_process,"
+                           " restarts will respawn gstreamer")
+        return config
 
     @property
     def device_paths(self) -> List[pathlib.Path]:
@@ -320,71 +400,9 @@ class Configuration():
         ))
 
 
-def get_cameras() -> Tuple[List[v4l2ctl.V4l2Device], List[v4l2ctl.V4l2Device]]:
-    video_devices_name = pathlib.Path("/dev").glob("./video*")
-    cameras = []
-    loopbacks = []
-    for video_device_name in video_devices_name:
-        video_device = v4l2ctl.V4l2Device(video_device_name)
-        if video_device.buffer_type == v4l2ctl.V4l2BufferType.VIDEO_CAPTURE:
-            cameras.append(video_device)
-        elif video_device.name == "LoopbackDevice":
-            loopbacks.append(video_device)
-    return cameras, loopbacks
-
-
-def preferred_format(camera: v4l2ctl.V4l2Device) -> str:
-    preferences = {
-        "H264": "h264",
-        "MJPEG": "mjpeg"
-    }
-
-    pref_format = None
-    for format in camera.formats:
-        if format.format.name in preferences:
-            pref_format = preferences[format.format.name]
-    assert pref_format is not None
-    return pref_format
-
-
-def get_microphones() -> List[Dict[str, Union[str, int]]]:
-    sound_devices = sounddevice.query_devices()
-    microphones = []
-    for sound_device in sound_devices:
-        if sound_device["max_input_channels"] > 0 and\
-           sound_device["hostapi"] == 0 and\
-           re.match(r".* \(hw:\d+,\d+\)", sound_device["name"]):
-            microphones.append(sound_device)
-    return microphones
-
-
-def get_joined_devices():
-    microphones = get_microphones()
-    cameras, loopbacks = get_cameras()
-
-    _joined_devices = []
-    for camera in cameras:
-        for (i, microphone) in enumerate(microphones):
-            if camera.name.split(":")[0] in microphone["name"].split(":")[0]:
-                cam = camera
-                mic = microphones.pop(i)
-                _joined_devices.append((cam, mic))
-                break
-
-    joined_devices = []
-    for idx, (camera, microphone) in enumerate(_joined_devices):
-        cam = CameraDevice(camera.name, camera.device, "")
-        mic_devices = re.findall(r"hw:\d+", microphone["name"])
-        assert len(mic_devices) == 1
-        mic_device = mic_devices[0]
-        mic = MicrophoneDevice(microphone["name"], mic_device, microphone["max_input_channels"])
-        joined_devices.append(DeviceComplex(cam, mic, False, False, idx))
-
-    for idx2, camera in enumerate(loopbacks):
-        cam = CameraDevice("loopback", camera.device, "")
-        joined_devices.append(DeviceComplex(cam, None, False, True, idx2))
-
-    return joined_devices
+def parse_resolution(resolution: str) -> Tuple[int, int]:
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
 
 
 NS_PER_SECOND = int(1e9)
@@ -392,6 +410,10 @@ def seconds2ns(seconds: int) -> int:
     return seconds * NS_PER_SECOND
 
 
+def optional_path(value: str) -> Optional[pathlib.Path]:
+    return pathlib.Path(value) if value else None
+
+
 def parse_user_config(config_path: pathlib.Path) -> Dict[str, str]:
     with config_path.open("r") as f:
         data: Dict[str, str] = json.load(f)
@@ -1,29 +1,44 @@
 import configparser
 
 import datetime
+import logging.handlers
+import multiprocessing
 import os
 import pathlib
 import signal
 import sqlite3
-import subprocess
+import threading
 import time
 
-from concurrent.futures import ThreadPoolExecutor as Pool
-from concurrent.futures import Future
-from typing import Optional, Union
+from typing import List, Optional, Set, Tuple, Union
 
 import psutil # type: ignore
 import pyudev # type: ignore
 import requests # type: ignore
 
 from .configuration import Configuration
-from .interval import IntervalCollection, RecordTime
-from .computer_vision import computer_vision
+from .devices import SUBSYSTEM_SOUND, SUBSYSTEM_VIDEO
+from .frame_ring import FrameRing
+from .gst_pipeline import EVENT_FRAGMENT_CLOSED, EVENT_FRAGMENT_OPENED, GstPipeline, PipelineEvent
+from .inotify import watch_segments
+from .metrics import (
+    CV_FPS, CV_FRAMES, CV_LAG, CV_SKIPPED, CV_TILES_SKIPPED, GSTREAMER_EXITS, GSTREAMER_STARTS,
+    QUEUE_BYTES, QUEUE_DEPTH, REGISTRY, REPLUG_RECOVERY, REPLUGS, RESTART_GAP, RESTARTS,
+    STORAGE_HEADROOM, start_writer)
+from .interval import IntervalCollection, RecordTime, data_version
+from .computer_vision import CvStats, computer_vision
 from .process_recordings import process_all
-from .record import record
+from .notify import BLACKOUT_TABLE, RECORDTIME_TABLE, ScheduleListener
+from .record import RecordProcess, record
+from .schedule import (
+    Schedule, Wakeup, WAKE_CHILD_EXIT, WAKE_DEVICES_CHANGED, WAKE_SCHEDULE_CHANGED,
+    WAKE_SHUTDOWN, seconds_until)
 from .spaces import Spaces
-from .upload_recordings import upload_all
+from .storage import StorageManager
+from .supervisor import Supervisor
+from .upload_recordings import check_upload_policy, upload_all
 from .utils import _log
+from .work_queue import STAGE_RECORDED, WorkQueue
 
 class Credentials:
     def __init__(self, conn: Optional[sqlite3.Connection], spaces_client: Optional[Spaces]):
@@ -72,6 +87,42 @@ S_HAS_SPACE = "has_space"
 S_RECORD = "record"
 S_ERROR = "error"
 S_RESTART = "restart"
+
+# ------------------------------------------------------------------------------
+# Periodic restart modes
+#   respawn -> stop gstreamer (EOS) and launch a new one, every source and the
+#              encoder are torn down so a few seconds go unrecorded
+#   split   -> ask splitmuxsink to start a new segment at the next keyframe,
+#              capture never stops. Needs the in process pipeline.
+# the next pipeline can't be built before the old one stops: v4l2 devices only
+# ever have one reader
+# ------------------------------------------------------------------------------
+RESTART_RESPAWN = "respawn"
+RESTART_SPLIT = "split"
+
+# background jobs, see supervisor.py
+JOB_PROCESS = "process"
+JOB_UPLOAD = "upload"
+JOB_COMPUTER_VISION = "computer_vision"
+
+# ------------------------------------------------------------------------------
+# Hot replug: udev events for cameras are collected until they stop coming for
+# device_settle_seconds, then only the changed nodes are probed again and the
+# pipeline is rebuilt with whatever cameras are left, or back
+# ------------------------------------------------------------------------------
+REPLUG_REMOVE = "remove"
+REPLUG_ADD = "add"
+# a pipeline that lost a camera may never finish its EOS
+REPLUG_KILL_SECONDS = 5
+
+# ------------------------------------------------------------------------------
+# A pipeline that dies right after it started (a broken pipeline string, a
+# camera that is busy) is not launched again right away: the relaunch waits a
+# backoff that doubles with every quick exit in a row
+# ------------------------------------------------------------------------------
+RESPAWN_QUICK_SECONDS = 30
+RESPAWN_MIN_BACKOFF_SECONDS = 1
+RESPAWN_MAX_BACKOFF_SECONDS = 300
 class ControllerState:
     def __init__(self, initstate=S_STARTUP):
         self.state = initstate
@@ -80,30 +131,86 @@ class ControllerState:
 class Controller:
     def __init__(self, config_path: pathlib.Path, credentials_path: pathlib.Path, verbose=None):
         self.verbose = verbose
-        self.record_pool = Pool(max_workers=1)
-        self.process_pool = Pool(max_workers=1)
-        self.computer_vision_pool = Pool(max_workers=1)
-        self.upload_pool = Pool(max_workers=1)
+        self.supervisor = Supervisor()
+        self.supervisor.add(JOB_PROCESS, self.process, self.process_done)
+        self.supervisor.add(JOB_UPLOAD, self.upload, self.upload_done)
+        self.computer_vision_job = self.supervisor.add(
+            JOB_COMPUTER_VISION, self.run_computer_vision, self.computer_vision_done)
         self.config_path = config_path
-        self.config = Configuration.from_file(self.config_path)
+        self.config = self.load_configuration(self.config_path)
+        # like the storage settings, refuse to start rather than fail every upload
+        check_upload_policy(self.config.upload_policy)
         if self.config.verbose is None:
             self.config.set_verbose(self.verbose)
-        self.credentials: Credentials = Credentials.from_file(credentials_path)
-        self.interval_collection: Optional[IntervalCollection] = self.refresh_interval_collection()
-        self.record_times: Optional[RecordTime] = self.refresh_record_times()
-
-        self.record_process: Optional[subprocess.Popen] = None
-        self.process_future: Optional[Future] = None
-        self.computer_vision_future: Optional[Future] = None
-        self.upload_future: Optional[Future] = None
+        self.credentials: Credentials = self.load_credentials(credentials_path)
+        self.interval_collection: Optional[IntervalCollection] = None
+        self.record_times: Optional[RecordTime] = None
+        self.schedule_version: Optional[int] = None
+        self.schedule: Schedule = self.refresh_schedule()
+        self.wakeup = Wakeup()
+        self.changed_tables: Set[str] = set()
+        self.changed_tables_lock = threading.Lock()
+        self.schedule_listener = self.config_schedule_listener()
+        self.config.observation_directory.mkdir(exist_ok=True, parents=True)
+        self.work_queue = WorkQueue(self.config.work_queue_path)
+        self.work_queue.recover(self.config.observation_directory)
+        self.storage = StorageManager(
+            self.work_queue, self.config.observation_directory, pathlib.Path("logs"),
+            high_watermark=self.config.storage_high_watermark,
+            low_watermark=self.config.storage_low_watermark,
+            policy=self.config.storage_eviction_policy)
+        self.has_space = True
+        REGISTRY.add_collector(self.collect_metrics)
+        self.metrics_writer = start_writer(
+            self.config.metrics_path, self.config.metrics_interval_seconds)
+
+        self.record_process: Optional[RecordProcess] = None
+        self.record_stopping = False
+        # (mode, time.monotonic()) of the last periodic restart, until the next segment opens
+        self.restart_requested: Optional[Tuple[str, float]] = None
+        # unexpected exits in a row of pipelines that died within RESPAWN_QUICK_SECONDS,
+        # and the time.monotonic() before which no new one is launched
+        self.quick_exits = 0
+        self.respawn_at: Optional[float] = None
+        # motion detection gets a process of its own, away from the upload threads' GIL.
+        # spawned, the pipeline's glib threads do not survive a fork
+        self.computer_vision_context = multiprocessing.get_context("spawn")
+        self.computer_vision_process: Optional[multiprocessing.process.BaseProcess] = None
+        # set while the process is stopped to start over on new cameras, not a failure
+        self.computer_vision_restarting = False
+        self.computer_vision_stats = CvStats(self.computer_vision_context)
+        self.computer_vision_logs = self.computer_vision_context.Queue()
+        self.computer_vision_log_listener = logging.handlers.QueueListener(
+            self.computer_vision_logs, *_log().handlers, respect_handler_level=True)
+        self.computer_vision_log_listener.start()
+        self.frame_ring: Optional[FrameRing] = None
+        if self.config.frame_ring_enabled:
+            self.frame_ring = FrameRing.create(
+                self.config.loopback_height, self.config.loopback_width,
+                self.config.frame_channels)
+        self.config.out_path.mkdir(exist_ok=True, parents=True)
+        self.segment_watcher = watch_segments(self.config.out_path, self.segment_closed)
         self.config_signals()
-        self.context = pyudev.Context()
-        self.handling_usb = False
+        # (action, device node) of the udev events since the devices last settled
+        self.device_events: List[Tuple[str, str]] = []
+        self.device_events_lock = threading.Lock()
+        # time.monotonic() of the first and last event of the burst
+        self.device_events_since: Optional[float] = None
+        self.devices_settle_at: Optional[float] = None
+        # (action, time.monotonic() of its first udev event), until recording resumes
+        self.replug_requested: Optional[Tuple[str, float]] = None
+        self.replug_kill_at: Optional[float] = None
         self.config_usb_listener()
 
         self.controller_state = ControllerState()
         self.last_restart = datetime.datetime.now()
 
+    def load_configuration(self, config_path: pathlib.Path) -> Configuration:
+        return Configuration.from_file(config_path)
+
+    def load_credentials(self, credentials_path: pathlib.Path) -> Credentials:
+        return Credentials.from_file(credentials_path)
+
     # --------------------------------------------------------------------------
     # State Machine Stuff
     # --------------------------------------------------------------------------
@@ -123,11 +230,11 @@ class Controller:
             # else:
             #     self.controller_state.state = S_ERROR
         elif self.controller_state.state == S_HAS_WIFI:
-            if self.check_space():
-                self.controller_state.state = S_HAS_SPACE
-                self.run()
-            else:
-                self.controller_state.state = S_ERROR
+            # a full disk is not fatal: uploads and eviction free it up again,
+            # apply_schedule holds off recording until they do
+            self.check_space()
+            self.controller_state.state = S_HAS_SPACE
+            self.run()
         elif self.controller_state.state == S_HAS_SPACE:
             if self.check_devices():
                 self.controller_state.state = S_RECORD
@@ -135,32 +242,104 @@ class Controller:
             else:
                 self.controller_state.state = S_ERROR
         elif self.controller_state.state == S_RECORD:
-            self.record()
+            self.apply_schedule(datetime.datetime.now())
             self.start_process()
             self.start_upload()
             self.start_computer_vision()
+            next_poll = time.monotonic() + self.config.poll_seconds
             while True:
-                time.sleep(10)
-                self.interval_collection = self.refresh_interval_collection()
-                self.record_times = self.refresh_record_times()
+                # sleep until the schedule flips, a restart is due, the child
+                # exits, or it is time to kick the background workers again
+                now = datetime.datetime.now()
+                timeouts = [
+                    next_poll - time.monotonic(),
+                    seconds_until(now, self.schedule.next_transition(now)),
+                    seconds_until(now, self.restart_deadline()),
+                    self.seconds_until_devices_settle(),
+                    self.seconds_until_replug_kill(),
+                    self.seconds_until_respawn()]
+                reasons = self.wakeup.wait(max(0.0, min(t for t in timeouts if t is not None)))
+                if WAKE_SHUTDOWN in reasons:
+                    break
+                if self.devices_settled():
+                    self.replug()
+                self.kill_stuck_record()
+                polling = time.monotonic() >= next_poll
+                if polling:
+                    next_poll = time.monotonic() + self.config.poll_seconds
+                    self.check_space()
+                    # notifications are best effort datagrams, this cheap version
+                    # check picks up whatever got lost
+                    self.schedule = self.refresh_schedule()
+                if WAKE_SCHEDULE_CHANGED in reasons:
+                    self.schedule = self.reload_schedule(self.pop_changed_tables())
                 now = datetime.datetime.now()
-                if self.is_blackout_datetime(now) or not self.is_record_time(now):
-                    self.stop_record()
-                else:
-                    time_running = datetime.datetime.now() - self.last_restart
-                    if time_running.total_seconds() > self.config.restart_seconds:
-                        self.stop_record()
-                    if self.record_process is None or self.record_process.poll() is not None:
-                        self.config.refresh_devices()
-                        self.record()
-                    if self.process_future is None or self.process_future.done:
-                        self.start_process()
-                    if self.upload_future is None or self.upload_future.done:
-                        self.start_upload()
-                    if self.computer_vision_future is None or self.computer_vision_future.done:
-                        self.start_computer_vision()
+                recording = self.apply_schedule(now)
+                # uploads are what frees the disk, keep them going while paused for space
+                if polling and (recording or not self.has_space):
+                    # no-ops for jobs that are already running or queued
+                    self.start_process()
+                    self.start_upload()
+                    self.start_computer_vision()
         return True
 
+    def apply_schedule(self, now: datetime.datetime) -> bool:
+        if not self.schedule.should_record(now) or not self.has_space:
+            if self.is_recording():
+                self.stop_record()
+            return False
+        restart = self.restart_deadline()
+        if restart is not None and now >= restart and self.is_recording():
+            self.restart_record()
+            return True
+        if not self.is_recording():
+            if self.seconds_until_devices_settle() is not None:
+                # cameras are still coming or going, replug() rebuilds once they settle
+                return True
+            if self.seconds_until_respawn() is not None:
+                # the last pipeline died right after it started, give it a moment
+                return True
+            self.config.refresh_devices()
+            self.record()
+        return True
+
+    def restart_deadline(self) -> Optional[datetime.datetime]:
+        if self.config.restart_seconds <= 0 or self.record_stopping or not self.is_recording():
+            return None
+        return self.last_restart + datetime.timedelta(seconds=self.config.restart_seconds)
+
+    def restart_record(self):
+        if self.config.restart_mode == RESTART_SPLIT and \
+           isinstance(self.record_process, GstPipeline):
+            self.restart_requested = (RESTART_SPLIT, time.monotonic())
+            if self.record_process.split():
+                RESTARTS.inc(mode=RESTART_SPLIT)
+                self.last_restart = datetime.datetime.now()
+                return
+            _log().warning("no splitmuxsink to split, respawning instead")
+        elif self.config.restart_mode == RESTART_SPLIT:
+            # warned about once, when the configuration was read
+            _log().debug("split restarts need gstreamer_in_process, respawning instead")
+        self.restart_requested = (RESTART_RESPAWN, time.monotonic())
+        RESTARTS.inc(mode=RESTART_RESPAWN)
+        self.stop_record()
+        # wait for gstreamer to finish the segment, its exit wakes us up
+
+    def restart_done(self):
+        if self.restart_requested is not None:
+            mode, requested = self.restart_requested
+            self.restart_requested = None
+            gap = time.monotonic() - requested
+            RESTART_GAP.observe(gap, mode=mode)
+            _log().info("%s restart took %.2f seconds", mode, gap)
+        if self.replug_requested is not None:
+            action, requested = self.replug_requested
+            self.replug_requested = None
+            recovery = time.monotonic() - requested
+            REPLUG_RECOVERY.observe(recovery, action=action)
+            _log().info("recording again %.2f seconds after the camera %s", recovery,
+                        "was unplugged" if action == REPLUG_REMOVE else "came back")
+
     def check_wifi(self) -> bool:
         try:
             requests.get("http://digitalocean.com", timeout=10)
@@ -170,7 +349,16 @@ class Controller:
             return False
 
     def check_space(self) -> bool:
-        return True
+        headroom = self.storage.enforce(self.interval_collection)
+        has_space = headroom > 0
+        if has_space != self.has_space:
+            if has_space:
+                _log().info("%.2f GB free below the high watermark, recording again",
+                            headroom / 2**30)
+            else:
+                _log().error("disk is full (%s), pausing recording", self.storage.describe())
+        self.has_space = has_space
+        return has_space
 
     def check_devices(self) -> bool:
         has_devices = len(self.config.devices) > 0
@@ -191,129 +379,304 @@ class Controller:
 
     def stop_record(self):
         _log().info("Program has decided to stop recording")
-        if self.record_process is not None:
+        if self.record_process is not None and not self.record_stopping:
+            self.record_stopping = True
             self.record_process.send_signal(signal.SIGINT)
             _log().info("shutdown")
 
     def shutdown(self):
         _log().info("trying to shut down gstreamer")
         self.stop_record()
-        self.process_pool.shutdown(wait=False)
-        self.upload_pool.shutdown(wait=False)
-        self.computer_vision_pool.shutdown(wait=False)
-        self.computer_vision_pool.shutdown(wait=False)
+        self.supervisor.stop()
+        self.stop_computer_vision()
+        if self.frame_ring is not None:
+            self.frame_ring.close()
         _log().info("shut down sucessfully")
         time.sleep(1)
         pid = os.getpid()
         os.kill(pid, signal.SIGKILL)
 
     def config_usb_listener(self):
+        self.context = pyudev.Context()
         monitor = pyudev.Monitor.from_netlink(self.context)
-        monitor.filter_by(subsystem='video4linux')
+        monitor.filter_by(subsystem=SUBSYSTEM_VIDEO)
+        # microphones show up as sound cards
+        monitor.filter_by(subsystem=SUBSYSTEM_SOUND)
         observer = pyudev.MonitorObserver(monitor, callback=self.handle_usb, name='usb-observer')
         observer.start()
 
     def handle_usb(self, device):
-        _log().warn("USB: %s -> %s", device.action, device.device_path)
-        if not self.handling_usb and self.record_process is not None and\
-           (device.action == "remove" or device.action == "add"):
-            try:
-                subprocess.call(["reboot"])
-            except Exception:
-                pass
-            self.handling_usb = True
+        _log().warning("USB: %s -> %s", device.action, device.device_path)
+        if self.config.device_registry is not None:
+            self.config.device_registry.handle_event(device)
+        if device.subsystem != SUBSYSTEM_VIDEO or device.action not in (REPLUG_REMOVE, REPLUG_ADD):
+            return
+        now = time.monotonic()
+        with self.device_events_lock:
+            self.device_events.append((device.action, device.device_node))
+            if self.device_events_since is None:
+                self.device_events_since = now
+            self.devices_settle_at = now + self.config.device_settle_seconds
+        self.wakeup.set(WAKE_DEVICES_CHANGED)
+
+    def seconds_until_devices_settle(self) -> Optional[float]:
+        with self.device_events_lock:
+            if self.devices_settle_at is None:
+                return None
+            return max(0.0, self.devices_settle_at - time.monotonic())
+
+    def devices_settled(self) -> bool:
+        return self.seconds_until_devices_settle() == 0
+
+    def pop_device_events(self) -> Tuple[List[Tuple[str, str]], float]:
+        with self.device_events_lock:
+            events, self.device_events = self.device_events, []
+            since = self.device_events_since or time.monotonic()
+            self.device_events_since = self.devices_settle_at = None
+        return events, since
+
+    def replug(self):
+        events, since = self.pop_device_events()
+        before = {device.camera.device for device in self.config.cameras}
+        # only the nodes the events named are probed again
+        self.config.refresh_devices()
+        after = {device.camera.device for device in self.config.cameras}
+        removed, added = sorted(before - after), sorted(after - before)
+        if not removed and not added:
+            _log().info("%d udev events, the cameras did not change", len(events))
+            return
+        action = REPLUG_REMOVE if removed else REPLUG_ADD
+        _log().warning("cameras unplugged %s, plugged in %s, rebuilding the pipeline with %d",
+                       removed, added, len(after))
+        REPLUGS.inc(action=action)
+        self.replug_requested = (action, since)
+        self.restart_computer_vision()
+        if self.is_recording():
+            self.stop_record()
+            self.replug_kill_at = time.monotonic() + REPLUG_KILL_SECONDS
+        # otherwise the next apply_schedule starts the pipeline on the cameras there are
+
+    def seconds_until_replug_kill(self) -> Optional[float]:
+        if self.replug_kill_at is None:
+            return None
+        return max(0.0, self.replug_kill_at - time.monotonic())
+
+    def kill_stuck_record(self):
+        if self.replug_kill_at is None or time.monotonic() < self.replug_kill_at:
+            return
+        self.replug_kill_at = None
+        if self.is_recording() and self.record_process is not None:
+            _log().warning("gstreamer did not stop after the replug, killing it")
             self.record_process.kill()
-            self.sleep(5)
-            self.config.refresh_devices()
-            self.record_process = None
-            self.handling_usb = False
 
     # --------------------------------------------------------------------------
     # User Preferences
     # --------------------------------------------------------------------------
 
+    def config_schedule_listener(self) -> Optional[ScheduleListener]:
+        listener = ScheduleListener(self.config.schedule_socket, self.schedule_changed)
+        try:
+            listener.start()
+            return listener
+        except OSError:
+            _log().error("could not listen on %s, polling the schedule instead",
+                         self.config.schedule_socket, exc_info=True)
+            return None
+
+    def schedule_changed(self, table: str):
+        with self.changed_tables_lock:
+            self.changed_tables.add(table)
+        self.wakeup.set(WAKE_SCHEDULE_CHANGED)
+
+    def pop_changed_tables(self) -> Set[str]:
+        with self.changed_tables_lock:
+            tables, self.changed_tables = self.changed_tables, set()
+        return tables
+
+    def reload_schedule(self, tables: Set[str]) -> Schedule:
+        # leaves schedule_version alone: a table nobody notified about may have changed
+        # too, and only a full refresh_schedule may claim to be up to date
+        if BLACKOUT_TABLE in tables:
+            self.interval_collection = self.refresh_interval_collection()
+        if RECORDTIME_TABLE in tables:
+            self.record_times = self.refresh_record_times()
+        return Schedule(self.interval_collection, self.record_times)
+
+    def refresh_schedule(self) -> Schedule:
+        # only query (and re-index) when the webapp has committed something since
+        if self.credentials.conn is not None:
+            version = data_version(self.credentials.conn)
+            if version == self.schedule_version:
+                return self.schedule
+            self.schedule_version = version
+        self.interval_collection = self.refresh_interval_collection()
+        self.record_times = self.refresh_record_times()
+        return Schedule(self.interval_collection, self.record_times)
+
     def refresh_interval_collection(self):
         icol = None
         if self.credentials.conn is not None:
-            icol = IntervalCollection.from_sql(self.credentials.conn.cursor())
+            icol = IntervalCollection.from_sql(
+                self.credentials.conn.cursor(), self.interval_collection)
         return icol
 
     def refresh_record_times(self):
         icol = None
         if self.credentials.conn is not None:
-            icol = RecordTime.from_sql(self.credentials.conn.cursor())
+            icol = RecordTime.from_sql(self.credentials.conn.cursor(), self.record_times)
         return icol
 
     def is_blackout_datetime(self, dt: datetime.datetime):
-        if self.interval_collection is not None:
-            return self.interval_collection.point_overlaps(dt)
+        return self.schedule.is_blackout(dt)
 
     def is_record_time(self, dt: datetime.datetime):
-        if self.record_times is not None:
-            if len(self.record_times.intervals) == 0:
-                return True
-            return self.record_times.point_overlaps(dt.time())
+        return self.schedule.is_record_time(dt)
 
     # --------------------------------------------------------------------------
     # Main Controller Code: record, process, upload
     # --------------------------------------------------------------------------
     def record(self):
         self.last_restart = datetime.datetime.now()
-        self.record_process = record(self.config)
+        self.record_stopping = False
+        self.replug_kill_at = None
+        self.respawn_at = None
+        started = time.monotonic()
+        self.record_process = self.spawn_record()
+        if self.record_process is not None:
+            GSTREAMER_STARTS.inc()
+            if not isinstance(self.record_process, GstPipeline):
+                # nothing to tell when gst-launch opens its first segment
+                self.restart_done()
+            threading.Thread(
+                target=self.watch_record_process, args=(self.record_process, started),
+                name="record-watcher", daemon=True).start()
+
+    def spawn_record(self) -> Optional[RecordProcess]:
+        return record(
+            self.config, self.pipeline_event,
+            self.frame_ring.write if self.frame_ring is not None else None)
+
+    def is_recording(self) -> bool:
+        return self.record_process is not None and self.record_process.poll() is None
+
+    def watch_record_process(self, process: RecordProcess, started: float):
+        returncode = process.wait()
+        ran = time.monotonic() - started
+        _log().info("gstreamer exited with %s after %.1f seconds", returncode, ran)
+        GSTREAMER_EXITS.inc(reason="requested" if self.record_stopping else "unexpected")
+        if not self.record_stopping:
+            if ran < RESPAWN_QUICK_SECONDS:
+                self.quick_exits += 1
+                backoff = min(RESPAWN_MAX_BACKOFF_SECONDS,
+                              RESPAWN_MIN_BACKOFF_SECONDS * 2**(self.quick_exits - 1))
+                self.respawn_at = time.monotonic() + backoff
+                _log().error("gstreamer died right after starting %d times in a row,"
+                             " launching it again in %.0f seconds", self.quick_exits, backoff)
+            else:
+                self.quick_exits = 0
+        self.wakeup.set(WAKE_CHILD_EXIT)
+
+    def seconds_until_respawn(self) -> Optional[float]:
+        if self.respawn_at is None:
+            return None
+        wait = self.respawn_at - time.monotonic()
+        return wait if wait > 0 else None
+
+    def pipeline_event(self, event: PipelineEvent):
+        # only posted by an in process pipeline, saves waiting on inotify
+        if event.kind == EVENT_FRAGMENT_CLOSED and event.location is not None:
+            self.segment_closed(event.location)
+        elif event.kind == EVENT_FRAGMENT_OPENED:
+            self.restart_done()
 
     def start_computer_vision(self):
-        if self.config.loopback_enabled:
-            self.computer_vision_future = self.computer_vision_pool.submit(self.computer_vision)
-            self.computer_vision_future.add_done_callback(self.computer_vision_done)
-
-    def computer_vision(self):
-        return computer_vision(self.config, self.upload_detection_logs)
-
-    def computer_vision_done(self, future):
-        if future.exception() is not None:
-            _log().error("uncaught computer_vision exception %s", future.exception(), exc_info=True)
-        else:
-            _log().info("computer vision result %s", future.result())
+        if not self.config.loopback_enabled:
+            return
+        # the job lasts as long as the process, a kick while it runs would stay queued
+        if self.computer_vision_job.depth() == 0:
+            self.supervisor.kick(JOB_COMPUTER_VISION)
+
+    def run_computer_vision(self) -> Optional[int]:
+        process = self.computer_vision_context.Process(
+            target=computer_vision, name="computer-vision", daemon=True, args=(
+                self.config, self.frame_ring.name if self.frame_ring is not None else None,
+                self.computer_vision_stats, self.computer_vision_logs,
+                _log().getEffectiveLevel()))
+        self.computer_vision_process = process
+        process.start()
+        process.join()
+        restarting, self.computer_vision_restarting = self.computer_vision_restarting, False
+        if process.exitcode != 0 and not restarting and not self.computer_vision_job.stopped:
+            # restarted after a backoff
+            raise ChildProcessError(f"computer vision exited with {process.exitcode}")
+        return process.exitcode
+
+    def restart_computer_vision(self):
+        """The detector's tiles come from the cameras at spawn, start over with the new ones"""
+        process = self.computer_vision_process
+        if process is None or not process.is_alive():
+            return
+        _log().info("restarting computer vision for the new cameras")
+        self.computer_vision_restarting = True
+        process.terminate()
+        # queued behind the run that is ending, and spawned with the refreshed config
+        self.supervisor.kick(JOB_COMPUTER_VISION)
+
+    def computer_vision_done(self, exitcode: Optional[int]):
+        _log().info("computer vision finished with %s", exitcode)
+
+    def stop_computer_vision(self):
+        process = self.computer_vision_process
+        if process is not None and process.is_alive():
+            process.terminate()
+            process.join(1)
+        self.computer_vision_log_listener.stop()
 
     def start_process(self):
-        self.process_future = self.process_pool.submit(self.process)
-        self.process_future.add_done_callback(self.process_done)
+        self.supervisor.kick(JOB_PROCESS)
 
     def process(self):
-        return process_all(self.config, self.interval_collection)
+        return process_all(self.config, self.work_queue, self.interval_collection,
+                           finalized=self.segment_watcher is not None)
 
-    def process_done(self, future):
-        if future.exception() is not None:
-            _log().error("uncaught processing exception %s", future.exception(), exc_info=True)
-        else:
-            _log().info("processed %d videos", future.result())
+    def segment_closed(self, path: pathlib.Path):
+        # the muxer just finalized this segment, hand it over right away
+        if self.work_queue.add(path, STAGE_RECORDED):
+            _log().debug("segment closed %s", path)
+        self.start_process()
+
+    def process_done(self, count: int):
+        _log().info("processed %d videos", count)
 
     def start_upload(self):
-        self.upload_future = self.upload_pool.submit(self.upload)
-        self.upload_future.add_done_callback(self.upload_done)
+        self.supervisor.kick(JOB_UPLOAD)
 
     def upload(self):
-        return upload_all(self.config, self.credentials.spaces_client, self.interval_collection)
+        return upload_all(self.config, self.credentials.spaces_client, self.work_queue,
+                          self.interval_collection)
 
-    def upload_done(self, future):
-        if future.exception() is not None:
-            _log().error("uncaught processing exception %s", future.exception(), exc_info=True)
-        else:
-            _log().info("uploaded %s videos", future.result())
+    def upload_done(self, uploads):
+        _log().info("uploaded %s videos", uploads)
 
     # --------------------------------------------------------------------------
     # Logging Stuff
     # --------------------------------------------------------------------------
+    def collect_metrics(self):
+        for stage, depth in self.work_queue.depth().items():
+            QUEUE_DEPTH.set(depth, stage=stage)
+        for stage, nbytes in self.work_queue.stage_bytes().items():
+            QUEUE_BYTES.set(nbytes, stage=stage)
+        STORAGE_HEADROOM.set(self.storage.headroom())
+        self.supervisor.collect_metrics()
+        stats = self.computer_vision_stats.read()
+        # the detection process only keeps running totals, catch the counters up
+        CV_FRAMES.inc(max(0, stats["frames"] - CV_FRAMES.value()))
+        CV_SKIPPED.inc(max(0, stats["skipped"] - CV_SKIPPED.value()))
+        CV_TILES_SKIPPED.inc(max(0, stats["tiles_skipped"] - CV_TILES_SKIPPED.value()))
+        CV_FPS.set(stats["fps"])
+        CV_LAG.set(stats["lag"])
+
     def upload_logs(self):
+        # called by the log shipper with a freshly compressed log, upload_all sends logs/log.*
         if self.credentials.spaces_client is None: return
-        log_path = pathlib.Path("logs")
-        for log in log_path.glob("log.*"):
-            key = (
-                f"{self.config.spaces_root_key}/"
-                f"{self.config.user_config['participant_id']}/"
-                f"logs/{log.name}")
-            self.credentials.spaces_client.upload(log, key)
-            log.unlink()
-
-    def upload_detection_logs(self):
-        pass
+        self.start_upload()
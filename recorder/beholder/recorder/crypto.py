@@ -1,4 +1,21 @@
+import hashlib
+import io
+import os
+import pathlib
 import subprocess
+import time
+
+from typing import Tuple, Union
+
+from cryptography.hazmat.primitives import padding  # type: ignore
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes  # type: ignore
+
+# `openssl enc -salt` output starts with this magic followed by an 8 byte salt
+SALT_MAGIC = b"Salted__"
+SALT_SIZE = 8
+KEY_SIZE = 32
+IV_SIZE = 16
+CHUNK_SIZE = 2**20
 
 
 def generate_random_key(key_path) -> int:
@@ -8,7 +25,7 @@ def generate_random_key(key_path) -> int:
 
 def encrypt_file(input_file_path, key_path, output_file_path) -> int:
     return subprocess.call([
-        "openssl", "enc", "-aes-256-cbc", "-salt",
+        "openssl", "enc", "-aes-256-cbc", "-salt", "-md", "sha256",
         "-in", str(input_file_path),
         "-out", str(output_file_path),
         "--pass", f"file:{key_path}"
@@ -16,8 +33,85 @@ def encrypt_file(input_file_path, key_path, output_file_path) -> int:
 
 def decrypt_file(input_file_path, key_path, output_file_path) -> int:
     return subprocess.call([
-        "openssl", "enc", "-aes-256-cbc", "-d",
+        "openssl", "enc", "-aes-256-cbc", "-d", "-md", "sha256",
         "-in", str(input_file_path),
         "-out", str(output_file_path),
         "--pass", f"file:{key_path}"
     ])
+
+
+def read_passphrase(key_path: Union[str, pathlib.Path]) -> bytes:
+    # same as openssl's `-pass file:`, the passphrase is the first line
+    with open(key_path, "rb") as f:
+        return f.readline().rstrip(b"\r\n")
+
+
+def derive_key_iv(passphrase: bytes, salt: bytes) -> Tuple[bytes, bytes]:
+    # EVP_BytesToKey with sha256 and a single iteration, what `openssl enc -md sha256` uses
+    derived = b""
+    block = b""
+    while len(derived) < KEY_SIZE + IV_SIZE:
+        block = hashlib.sha256(block + passphrase + salt).digest()
+        derived += block
+    return derived[:KEY_SIZE], derived[KEY_SIZE:KEY_SIZE + IV_SIZE]
+
+
+class EncryptingReader(io.RawIOBase):
+    """Read-only file object producing `openssl enc -aes-256-cbc -salt -md sha256` ciphertext.
+
+    The plaintext is read and encrypted a chunk at a time, so it can be handed
+    straight to a (multipart) upload without writing an encrypted copy to disk.
+    """
+    def __init__(self, input_file_path: Union[str, pathlib.Path],
+                 key_path: Union[str, pathlib.Path], chunk_size: int = CHUNK_SIZE):
+        super().__init__()
+        salt = os.urandom(SALT_SIZE)
+        key, iv = derive_key_iv(read_passphrase(key_path), salt)
+        self.encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+        self.padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        self.source = open(input_file_path, "rb")
+        self.chunk_size = chunk_size
+        self.buffer = bytearray(SALT_MAGIC + salt)
+        self.finished = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def fill(self, size: int):
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            plaintext = self.source.read(self.chunk_size)
+            start = time.perf_counter()
+            if plaintext:
+                self.bytes_in += len(plaintext)
+                self.buffer += self.encryptor.update(self.padder.update(plaintext))
+            else:
+                self.buffer += self.encryptor.update(self.padder.finalize())
+                self.buffer += self.encryptor.finalize()
+                self.finished = True
+            self.seconds += time.perf_counter() - start
+
+    def read(self, size: int = -1) -> bytes:
+        # always return exactly `size` bytes until the end, multipart parts
+        # smaller than the chunk size are rejected by s3
+        self.fill(size)
+        if size < 0 or size > len(self.buffer):
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.bytes_out += len(data)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.source.close()
+        super().close()
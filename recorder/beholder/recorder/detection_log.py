@@ -0,0 +1,162 @@
+import math
+import os
+import pathlib
+import time
+
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np  # type: ignore
+
+from .utils import _log, pathify
+
+# ------------------------------------------------------------------------------
+# Detection log: motion boxes buffered in a preallocated structured array and
+# written out as one compressed .npz chunk per recording segment's worth of
+# time, a column per field. A chunk covers [window, window + segment seconds)
+# with windows aligned to multiples of the segment length since the epoch, and
+# is named after the window start, so segments find their detections by time,
+# and after the writer: uploaded chunks are deleted, so a restarted process
+# can't tell it already wrote that window and must not reuse the object key.
+# Every window, with or without detections, is also reported to `on_window` as
+# (window, seconds, frames analysed, frames with motion), the activity index.
+# ------------------------------------------------------------------------------
+DETECTION_DTYPE = np.dtype([
+    ("timestamp", np.float64),
+    ("camera", np.uint16),
+    ("x", np.uint16),
+    ("y", np.uint16),
+    ("w", np.uint16),
+    ("h", np.uint16),
+])
+CHUNK_SUFFIX = ".npz"
+# 3 boxes x 3 cameras x 5 fps for a minute, doubled when it overflows
+DEFAULT_CAPACITY = 4096
+
+Box = Tuple[int, int, int, int]
+WindowCallback = Callable[[float, float, int, int], None]
+
+
+class DetectionWriter():
+    def __init__(self, directory: pathlib.Path, segment_seconds: float,
+                 capacity: int = DEFAULT_CAPACITY, on_window: Optional[WindowCallback] = None,
+                 writer: Optional[str] = None):
+        self.directory = directory
+        # start time and pid, one per process
+        self.writer = f"{int(time.time())}_{os.getpid()}" if writer is None else writer
+        self.directory.mkdir(exist_ok=True, parents=True)
+        self.segment_seconds = segment_seconds
+        self.rows = np.zeros(capacity, DETECTION_DTYPE)
+        self.count = 0
+        self.window: Optional[int] = None
+        self.frames = 0
+        self.motion_frames = 0
+        self.on_window = on_window
+
+    def window_of(self, timestamp: float) -> int:
+        return int(math.floor(timestamp / self.segment_seconds) * self.segment_seconds)
+
+    def tick(self, timestamp: float):
+        """Close the current window once `timestamp` is past it"""
+        window = self.window_of(timestamp)
+        if self.window is not None and window != self.window:
+            self.flush()
+        self.window = window
+
+    def add(self, timestamp: float, detections: Sequence[Tuple[int, Box]]):
+        """Record one analysed frame's (camera, (x, y, w, h)) boxes"""
+        self.tick(timestamp)
+        self.frames += 1
+        if not detections:
+            return
+        self.motion_frames += 1
+        if self.count + len(detections) > len(self.rows):
+            self.rows = np.resize(self.rows, max(2 * len(self.rows), self.count + len(detections)))
+        rows = self.rows[self.count:self.count + len(detections)]
+        rows["timestamp"] = timestamp
+        rows["camera"] = [camera for camera, _ in detections]
+        boxes = np.array([box for _, box in detections]).reshape(-1, 4)
+        rows["x"], rows["y"], rows["w"], rows["h"] = boxes.T
+        self.count += len(detections)
+
+    def flush(self) -> Optional[pathlib.Path]:
+        """Write out the current window, if it saw any detections"""
+        if self.window is None:
+            return None
+        if self.on_window is not None and self.frames:
+            self.on_window(self.window, self.segment_seconds, self.frames, self.motion_frames)
+        self.frames = self.motion_frames = 0
+        if self.count == 0:
+            return None
+        rows = self.rows[:self.count]
+        path = self.chunk_path(self.window)
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("wb") as f:
+            np.savez_compressed(f, **{name: rows[name] for name in DETECTION_DTYPE.names})
+        # the uploader only picks up finished chunks
+        os.replace(tmp_path, path)
+        self.count = 0
+        return path
+
+    def chunk_path(self, window: int) -> pathlib.Path:
+        name = f"{window:010d}.{self.writer}"
+        path = self.directory / f"{name}{CHUNK_SUFFIX}"
+        part = 1
+        # the same window twice from one writer, if the clock went back
+        while path.exists():
+            path = self.directory / f"{name}.{part}{CHUNK_SUFFIX}"
+            part += 1
+        return path
+
+    def close(self):
+        try:
+            self.flush()
+        except OSError:
+            _log().error("could not write the last detections", exc_info=True)
+
+
+# ------------------------------------------------------------------------------
+# Reading
+# ------------------------------------------------------------------------------
+def chunk_window(path: pathlib.Path) -> int:
+    return int(path.name.split(".")[0])
+
+
+def detection_chunks(directory: Union[str, pathlib.Path], start: Optional[float] = None,
+                     end: Optional[float] = None) -> List[pathlib.Path]:
+    """Chunks that may hold detections in [start, end), oldest first"""
+    directory = pathify(directory)
+    chunks = sorted(directory.glob(f"*{CHUNK_SUFFIX}"), key=lambda path: (
+        chunk_window(path), path.name))
+    if start is not None:
+        # start falls in the last window to begin at or before it
+        earlier = [chunk_window(path) for path in chunks if chunk_window(path) <= start]
+        if earlier:
+            chunks = [path for path in chunks if chunk_window(path) >= max(earlier)]
+    if end is not None:
+        chunks = [path for path in chunks if chunk_window(path) < end]
+    return chunks
+
+
+def load_chunk(path: Union[str, pathlib.Path]) -> np.ndarray:
+    with np.load(pathify(path)) as columns:
+        rows = np.zeros(len(columns["timestamp"]), DETECTION_DTYPE)
+        for name in DETECTION_DTYPE.names:
+            rows[name] = columns[name]
+    return rows
+
+
+def read_detections(chunks: Iterable[Union[str, pathlib.Path]], start: Optional[float] = None,
+                    end: Optional[float] = None,
+                    camera: Optional[int] = None) -> np.ndarray:
+    """Every detection in the chunks, optionally in [start, end) and for one camera"""
+    loaded = [load_chunk(path) for path in chunks]
+    rows = np.concatenate(loaded) if loaded else np.zeros(0, DETECTION_DTYPE)
+    keep = np.ones(len(rows), bool)
+    if start is not None:
+        keep &= rows["timestamp"] >= start
+    if end is not None:
+        keep &= rows["timestamp"] < end
+    if camera is not None:
+        keep &= rows["camera"] == camera
+    rows = rows[keep]
+    return rows[np.argsort(rows["timestamp"], kind="stable")]
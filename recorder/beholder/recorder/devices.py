@@ -0,0 +1,208 @@
+import pathlib
+import re
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+import v4l2ctl # type: ignore
+import sounddevice # type: ignore
+
+from .utils import _log
+
+@dataclass
+class CameraDevice:
+    name: str
+    device: str
+    format: str
+
+@dataclass
+class MicrophoneDevice:
+    name: str
+    device: str
+    channels: int
+
+@dataclass
+class DeviceComplex:
+    camera: CameraDevice
+    microphone: Optional[MicrophoneDevice]
+    primary: bool
+    loopback: bool
+    number: int
+
+    @property
+    def path_friendly_name(self):
+        return self.camera.name.replace(" ", "_").replace(":", "") + f"_device_{self.number}"
+
+
+# ------------------------------------------------------------------------------
+# Probing: opens every /dev/video node and asks portaudio for its inputs, slow
+# ------------------------------------------------------------------------------
+KIND_CAMERA = "camera"
+KIND_LOOPBACK = "loopback"
+
+# what a /dev/video node turned out to be, None for metadata nodes and the like
+ProbedNode = Optional[Tuple[str, CameraDevice]]
+Microphone = Dict[str, Union[str, int]]
+
+SUBSYSTEM_VIDEO = "video4linux"
+SUBSYSTEM_SOUND = "sound"
+
+
+def video_nodes() -> List[str]:
+    # in number order, so devices keep their numbers from one probe to the next
+    return sorted((str(path) for path in pathlib.Path("/dev").glob("./video*")),
+                  key=lambda node: (len(node), node))
+
+
+def probe_node(node: str) -> ProbedNode:
+    video_device = v4l2ctl.V4l2Device(node)
+    if video_device.buffer_type == v4l2ctl.V4l2BufferType.VIDEO_CAPTURE:
+        return KIND_CAMERA, CameraDevice(video_device.name, video_device.device, "")
+    elif video_device.name == "LoopbackDevice":
+        return KIND_LOOPBACK, CameraDevice("loopback", video_device.device, "")
+    return None
+
+
+def preferred_format(camera: v4l2ctl.V4l2Device) -> str:
+    preferences = {
+        "H264": "h264",
+        "MJPEG": "mjpeg"
+    }
+
+    pref_format = None
+    for format in camera.formats:
+        if format.format.name in preferences:
+            pref_format = preferences[format.format.name]
+    assert pref_format is not None
+    return pref_format
+
+
+def get_microphones() -> List[Microphone]:
+    sound_devices = sounddevice.query_devices()
+    microphones = []
+    for sound_device in sound_devices:
+        if sound_device["max_input_channels"] > 0 and\
+           sound_device["hostapi"] == 0 and\
+           re.match(r".* \(hw:\d+,\d+\)", sound_device["name"]):
+            microphones.append(sound_device)
+    return microphones
+
+
+# ------------------------------------------------------------------------------
+# Joining: a camera is recorded with the microphone of the same usb device
+# ------------------------------------------------------------------------------
+def card_name(name: str) -> str:
+    return name.split(":")[0]
+
+
+def pair_microphones(cameras: List[CameraDevice],
+                     microphones: List[Microphone]) -> List[Tuple[CameraDevice, Microphone]]:
+    """Each camera with the first unclaimed microphone of its card, or left out without one"""
+    by_card: Dict[str, List[Microphone]] = {}
+    for microphone in microphones:
+        by_card.setdefault(card_name(str(microphone["name"])), []).append(microphone)
+    pairs = []
+    for camera in cameras:
+        card = card_name(camera.name)
+        candidates = by_card.get(card)
+        if not candidates:
+            # the camera may only know part of the card's name
+            card = next((other for other, mics in by_card.items() if mics and card in other), "")
+            candidates = by_card.get(card)
+        if candidates:
+            pairs.append((camera, candidates.pop(0)))
+    return pairs
+
+
+def node_number(node: str) -> int:
+    """7 for /dev/video7"""
+    match = re.search(r"\d+$", node)
+    assert match is not None
+    return int(match.group())
+
+
+def join_devices(cameras: List[CameraDevice], loopbacks: List[CameraDevice],
+                 microphones: List[Microphone]) -> List[DeviceComplex]:
+    # numbered after their nodes, so the other cameras keep theirs (and their detection
+    # camera ids and directories) when one is unplugged
+    joined_devices = []
+    for camera, microphone in pair_microphones(cameras, microphones):
+        mic_devices = re.findall(r"hw:\d+", str(microphone["name"]))
+        assert len(mic_devices) == 1
+        mic = MicrophoneDevice(
+            str(microphone["name"]), mic_devices[0], int(microphone["max_input_channels"]))
+        joined_devices.append(
+            DeviceComplex(camera, mic, False, False, node_number(camera.device)))
+
+    for camera in loopbacks:
+        joined_devices.append(DeviceComplex(camera, None, False, True, node_number(camera.device)))
+
+    return joined_devices
+
+
+def get_joined_devices() -> List[DeviceComplex]:
+    return DeviceRegistry().devices()
+
+
+class DeviceRegistry():
+    """The joined devices, probed once and then only again where udev says something changed
+
+    `handle_event` takes pyudev devices from a monitor on the video4linux and
+    sound subsystems: a video node event forgets what that one node was, a
+    sound event forgets the microphones. Everything else stays cached.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # /dev/video node -> what it is
+        self.nodes: Dict[str, ProbedNode] = {}
+        self.microphones: Optional[List[Microphone]] = None
+        self.joined: Optional[List[DeviceComplex]] = None
+        # nodes may have come or gone, list /dev again
+        self.rescan = True
+
+    def devices(self) -> List[DeviceComplex]:
+        with self.lock:
+            if self.joined is None:
+                self.joined = self.join()
+            return list(self.joined)
+
+    def join(self) -> List[DeviceComplex]:
+        start = time.monotonic()
+        probed = 0
+        if self.rescan:
+            nodes = video_nodes()
+            for node in nodes:
+                if node not in self.nodes:
+                    self.nodes[node] = probe_node(node)
+                    probed += 1
+            self.nodes = {node: self.nodes[node] for node in nodes}
+            self.rescan = False
+        if self.microphones is None:
+            self.microphones = get_microphones()
+        cameras = [camera for kind, camera in filter(None, self.nodes.values())
+                   if kind == KIND_CAMERA]
+        loopbacks = [camera for kind, camera in filter(None, self.nodes.values())
+                     if kind == KIND_LOOPBACK]
+        joined = join_devices(cameras, loopbacks, self.microphones)
+        _log().info("found %d devices, probed %d of %d video nodes in %.2f seconds",
+                    len(joined), probed, len(self.nodes), time.monotonic() - start)
+        return joined
+
+    def invalidate(self, subsystem: str, node: Optional[str] = None):
+        with self.lock:
+            if subsystem == SUBSYSTEM_SOUND:
+                self.microphones = None
+            elif subsystem == SUBSYSTEM_VIDEO:
+                if node is not None:
+                    self.nodes.pop(node, None)
+                self.rescan = True
+            else:
+                return
+            self.joined = None
+
+    def handle_event(self, device):
+        """pyudev monitor callback"""
+        if device.action in ("add", "remove", "change"):
+            self.invalidate(device.subsystem, device.device_node)
@@ -0,0 +1,156 @@
+import sys
+import time
+
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np  # type: ignore
+
+# ------------------------------------------------------------------------------
+# Frame ring: one writer (the pipeline's appsink) and any number of readers
+# sharing fixed size frames through shared memory.
+#
+#   header  8 x uint64  magic, slots, height, width, channels, latest
+#   seqs    slots x uint64    2n once frame n is complete, odd while writing
+#   stamps  slots x float64   wall clock time of frame n
+#   frames  slots x height x width x channels uint8
+#
+# Frame n lives in slot n % slots. The writer never waits: readers that fall
+# behind skip straight to the newest frame, and a reader can tell a frame was
+# overwritten under it because its slot's sequence number changed (a seqlock).
+# ------------------------------------------------------------------------------
+MAGIC = int.from_bytes(b"BHFRAME1", "little")
+HEADER_WORDS = 8
+H_MAGIC, H_SLOTS, H_HEIGHT, H_WIDTH, H_CHANNELS, H_LATEST = range(6)
+FRAME_RING_NAME = "beholder_frames"
+DEFAULT_SLOTS = 8
+ALIGN = 64
+
+
+@dataclass
+class Frame:
+    seq: int
+    timestamp: float
+    image: np.ndarray
+
+
+def align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+class FrameRing:
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((HEADER_WORDS,), np.uint64, shm.buf, 0)
+        if int(self.header[H_MAGIC]) != MAGIC:
+            raise ValueError(f"{shm.name} is not a frame ring")
+        self.slots = int(self.header[H_SLOTS])
+        self.shape = (
+            int(self.header[H_HEIGHT]), int(self.header[H_WIDTH]), int(self.header[H_CHANNELS]))
+        offset = align(HEADER_WORDS * 8)
+        self.seqs = np.ndarray((self.slots,), np.uint64, shm.buf, offset)
+        offset = align(offset + self.slots * 8)
+        self.stamps = np.ndarray((self.slots,), np.float64, shm.buf, offset)
+        offset = align(offset + self.slots * 8)
+        self.frames = np.ndarray((self.slots,) + self.shape, np.uint8, shm.buf, offset)
+
+    @staticmethod
+    def size(slots: int, height: int, width: int, channels: int) -> int:
+        return align(align(align(HEADER_WORDS * 8) + slots * 8) + slots * 8) + \
+            slots * height * width * channels
+
+    @classmethod
+    def create(cls, height: int, width: int, channels: int, slots: int = DEFAULT_SLOTS,
+               name: str = FRAME_RING_NAME) -> "FrameRing":
+        size = cls.size(slots, height, width, channels)
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a crash
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=size)
+        header = np.ndarray((HEADER_WORDS,), np.uint64, shm.buf, 0)
+        header[:] = [MAGIC, slots, height, width, channels, 0, 0, 0]
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str = FRAME_RING_NAME) -> "FrameRing":
+        # readers must not be tracked, or the ring is unlinked when one of them exits
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name, track=False)  # type: ignore
+        else:
+            # unregistering afterwards is no good either: a spawned reader shares the
+            # writer's tracker and would drop the writer's own registration
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args: None
+            try:
+                shm = shared_memory.SharedMemory(name)
+            finally:
+                resource_tracker.register = register
+        return cls(shm, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def latest_seq(self) -> int:
+        return int(self.header[H_LATEST])
+
+    # --------------------------------------------------------------------------
+    # Writer
+    # --------------------------------------------------------------------------
+    def write(self, data, timestamp: Optional[float] = None) -> int:
+        """Copy one frame in (anything exposing the buffer protocol), returns its sequence"""
+        seq = self.latest_seq + 1
+        slot = seq % self.slots
+        self.seqs[slot] = 2 * seq - 1
+        self.frames[slot].reshape(-1)[:] = np.frombuffer(data, np.uint8)
+        self.stamps[slot] = time.time() if timestamp is None else timestamp
+        self.seqs[slot] = 2 * seq
+        self.header[H_LATEST] = seq
+        return seq
+
+    # --------------------------------------------------------------------------
+    # Readers
+    # --------------------------------------------------------------------------
+    def latest(self) -> Optional[Frame]:
+        """The newest complete frame, as a view into the ring (no copy)"""
+        for _ in range(self.slots):
+            seq = self.latest_seq
+            if seq == 0:
+                return None
+            slot = seq % self.slots
+            if int(self.seqs[slot]) == 2 * seq:
+                frame = Frame(seq, float(self.stamps[slot]), self.frames[slot])
+                if self.valid(frame):
+                    return frame
+        return None
+
+    def valid(self, frame: Frame) -> bool:
+        """False once the writer has started overwriting the frame's slot"""
+        return int(self.seqs[frame.seq % self.slots]) == 2 * frame.seq
+
+    def wait(self, after: int, timeout: float, poll: float = 0.002) -> Optional[Frame]:
+        """The newest frame with a sequence number above `after`, waiting up to `timeout`"""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.latest_seq > after:
+                frame = self.latest()
+                if frame is not None and frame.seq > after:
+                    return frame
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def close(self):
+        # views must go before the mapping can be closed
+        del self.header, self.seqs, self.stamps, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,201 @@
+import datetime
+import pathlib
+import signal
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import GST_DROPPED, GST_ERRORS, GST_FRAGMENTS
+from .utils import _log
+
+# the python bindings are an optional (system) dependency, python3-gi on debian
+try:
+    import gi  # type: ignore
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst  # type: ignore
+except (ImportError, ValueError):
+    Gst = None
+
+# ------------------------------------------------------------------------------
+# Pipeline events, posted on the bus and handed to the controller
+# ------------------------------------------------------------------------------
+EVENT_QOS = "qos"
+EVENT_FRAGMENT_OPENED = "fragment_opened"
+EVENT_FRAGMENT_CLOSED = "fragment_closed"
+EVENT_EOS = "eos"
+EVENT_ERROR = "error"
+EVENT_WARNING = "warning"
+
+BUS_POLL_SECONDS = 0.5
+
+
+@dataclass
+class PipelineEvent:
+    kind: str
+    source: str
+    time: datetime.datetime = field(default_factory=datetime.datetime.now)
+    location: Optional[pathlib.Path] = None
+    details: Dict[str, Any] = field(default_factory=dict)
+
+
+def available() -> bool:
+    return Gst is not None
+
+
+class GstPipeline:
+    """A gstreamer pipeline run in this process, with the bits of Popen the controller uses
+
+    SIGINT sends EOS, like `gst-launch-1.0 -e`, so the muxer can finish the
+    current segment. The return code is 0 after EOS and 1 after an error.
+    """
+    def __init__(self, description: str,
+                 on_event: Optional[Callable[[PipelineEvent], None]] = None):
+        if Gst is None:
+            raise RuntimeError("gstreamer python bindings are not installed")
+        if not Gst.is_initialized():
+            Gst.init(None)
+        self.description = description
+        self.on_event = on_event
+        self.pipeline = Gst.parse_launch(description)
+        self.returncode: Optional[int] = None
+        self.finished = threading.Event()
+        self.dropped: Dict[str, int] = {}
+        self.thread = threading.Thread(target=self.watch_bus, name="gst-bus", daemon=True)
+
+    def start(self) -> "GstPipeline":
+        self.thread.start()
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            self.finish(1)
+            raise RuntimeError("could not start the gstreamer pipeline")
+        return self
+
+    # --------------------------------------------------------------------------
+    # Popen
+    # --------------------------------------------------------------------------
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        self.finished.wait(timeout)
+        return self.returncode
+
+    def send_signal(self, signum: int):
+        if signum == signal.SIGINT:
+            _log().info("sending eos to the pipeline")
+            self.pipeline.send_event(Gst.Event.new_eos())
+        else:
+            self.kill()
+
+    def terminate(self):
+        self.kill()
+
+    def kill(self):
+        self.finish(-signal.SIGKILL)
+
+    def split(self, name: str = "mux") -> bool:
+        """Close the current segment at the next keyframe and start a new one"""
+        mux = self.pipeline.get_by_name(name)
+        if mux is None:
+            return False
+        mux.emit("split-now")
+        return True
+
+    def connect_appsink(self, name: str, callback: Callable[[Any, float], None]) -> bool:
+        """Call back with the mapped data and arrival time of every sample from an appsink"""
+        sink = self.pipeline.get_by_name(name)
+        if sink is None:
+            return False
+
+        def new_sample(appsink):
+            sample = appsink.emit("pull-sample")
+            if sample is None:
+                return Gst.FlowReturn.EOS
+            buffer = sample.get_buffer()
+            ok, info = buffer.map(Gst.MapFlags.READ)
+            if ok:
+                try:
+                    callback(info.data, time.time())
+                except Exception:
+                    _log().error("%s callback failed", name, exc_info=True)
+                finally:
+                    buffer.unmap(info)
+            return Gst.FlowReturn.OK
+        sink.connect("new-sample", new_sample)
+        return True
+
+    # --------------------------------------------------------------------------
+    # Bus
+    # --------------------------------------------------------------------------
+    def watch_bus(self):
+        bus = self.pipeline.get_bus()
+        types = (
+            Gst.MessageType.EOS | Gst.MessageType.ERROR | Gst.MessageType.WARNING |
+            Gst.MessageType.QOS | Gst.MessageType.ELEMENT)
+        while not self.finished.is_set():
+            message = bus.timed_pop_filtered(int(BUS_POLL_SECONDS * Gst.SECOND), types)
+            if message is None:
+                continue
+            event = self.to_event(message)
+            if event is None:
+                continue
+            self.emit(event)
+            if event.kind == EVENT_EOS:
+                self.finish(0)
+            elif event.kind == EVENT_ERROR:
+                self.finish(1)
+
+    def to_event(self, message) -> Optional[PipelineEvent]:
+        source = message.src.get_name() if message.src is not None else ""
+        if message.type == Gst.MessageType.EOS:
+            return PipelineEvent(EVENT_EOS, source)
+        if message.type in (Gst.MessageType.ERROR, Gst.MessageType.WARNING):
+            if message.type == Gst.MessageType.ERROR:
+                kind, (error, debug) = EVENT_ERROR, message.parse_error()
+            else:
+                kind, (error, debug) = EVENT_WARNING, message.parse_warning()
+            GST_ERRORS.inc(kind=kind)
+            return PipelineEvent(kind, source, details={"message": error.message, "debug": debug})
+        if message.type == Gst.MessageType.QOS:
+            _format, processed, dropped = message.parse_qos_stats()
+            # the stats are running totals per element
+            new = dropped - self.dropped.get(source, 0)
+            self.dropped[source] = dropped
+            if new > 0:
+                GST_DROPPED.inc(new, element=source)
+            return PipelineEvent(EVENT_QOS, source,
+                                 details={"processed": processed, "dropped": dropped})
+        structure = message.get_structure()
+        name = structure.get_name() if structure is not None else ""
+        if name in ("splitmuxsink-fragment-opened", "splitmuxsink-fragment-closed"):
+            kind = EVENT_FRAGMENT_OPENED if name.endswith("opened") else EVENT_FRAGMENT_CLOSED
+            if kind == EVENT_FRAGMENT_CLOSED:
+                GST_FRAGMENTS.inc()
+            return PipelineEvent(
+                kind, source, location=pathlib.Path(structure.get_string("location")),
+                details={"running_time": structure.get_value("running-time")})
+        return None
+
+    def emit(self, event: PipelineEvent):
+        if event.kind in (EVENT_ERROR, EVENT_WARNING):
+            _log().error("gstreamer %s from %s: %s", event.kind, event.source, event.details)
+        elif event.kind == EVENT_QOS:
+            _log().debug("qos %s: %s", event.source, event.details)
+        else:
+            _log().info("gstreamer %s %s %s", event.kind, event.source, event.location or "")
+        if self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception:
+                _log().error("pipeline event callback failed for %s", event, exc_info=True)
+
+    def finish(self, returncode: int):
+        if self.finished.is_set():
+            return
+        start = time.monotonic()
+        self.pipeline.set_state(Gst.State.NULL)
+        _log().info("pipeline stopped with %d in %.2f seconds",
+                    returncode, time.monotonic() - start)
+        self.returncode = returncode
+        self.finished.set()
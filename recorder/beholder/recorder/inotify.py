@@ -0,0 +1,121 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import pathlib
+import struct
+import threading
+
+from typing import Callable, List, Optional
+
+from .utils import _log
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_IGNORED = 0x00008000
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+READ_SIZE = 64 * (EVENT_HEADER.size + 256)
+
+
+class SegmentWatcher:
+    """Calls back with every file in a directory as soon as its writer closes it
+
+    Uses inotify through libc, so it only works on linux. When the kernel's
+    event queue overflows, the directory is scanned instead: every file but the
+    newest, which the writer may still have open, and that one as soon as an
+    event shows the writer has moved on.
+    """
+    def __init__(self, directory: pathlib.Path, callback: Callable[[pathlib.Path], None],
+                 pattern: str = "*.mp4"):
+        self.directory = directory
+        self.callback = callback
+        self.pattern = pattern
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wd = self.libc.inotify_add_watch(
+            self.fd, str(directory).encode(), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if self.wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch {directory} failed")
+        # the newest file at the last overflow, until it is known to be closed
+        self.maybe_open: Optional[pathlib.Path] = None
+        self.thread = threading.Thread(target=self.watch, name="segment-watcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        _log().info("watching %s for finished segments", self.directory)
+
+    def stop(self):
+        # the kernel answers with IN_IGNORED, which ends the read loop
+        self.libc.inotify_rm_watch(self.fd, self.wd)
+
+    def watch(self):
+        try:
+            while True:
+                data = os.read(self.fd, READ_SIZE)
+                offset = 0
+                while offset < len(data):
+                    _wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                    offset += EVENT_HEADER.size
+                    name = data[offset:offset + length].rstrip(b"\0").decode()
+                    offset += length
+                    if mask & IN_IGNORED:
+                        return
+                    self.handle(mask, name)
+        finally:
+            os.close(self.fd)
+
+    def handle(self, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            _log().warning("inotify queue overflowed, scanning %s", self.directory)
+            self.rescan()
+        elif fnmatch.fnmatch(name, self.pattern):
+            path = self.directory / name
+            if self.maybe_open is not None:
+                # files are written one after the other, so it is closed by now
+                if self.maybe_open != path:
+                    self.notify(self.maybe_open)
+                self.maybe_open = None
+            self.notify(path)
+
+    def rescan(self):
+        paths = self.newest_last()
+        if not paths:
+            return
+        *closed, self.maybe_open = paths
+        for path in closed:
+            self.notify(path)
+
+    def newest_last(self) -> List[pathlib.Path]:
+        modified = []
+        for path in self.directory.glob(self.pattern):
+            try:
+                modified.append((path.stat().st_mtime, path))
+            except OSError:
+                # processed meanwhile
+                continue
+        return [path for _, path in sorted(modified)]
+
+    def notify(self, path: pathlib.Path):
+        try:
+            self.callback(path)
+        except Exception:
+            _log().error("segment callback failed for %s", path, exc_info=True)
+
+
+def watch_segments(directory: pathlib.Path,
+                   callback: Callable[[pathlib.Path], None]) -> Optional[SegmentWatcher]:
+    try:
+        watcher = SegmentWatcher(directory, callback)
+    except (OSError, AttributeError):
+        _log().warning("inotify unavailable, polling %s instead", directory, exc_info=True)
+        return None
+    watcher.start()
+    return watcher
@@ -1,44 +1,127 @@
+import bisect
 import sqlite3
 
-from datetime import datetime, time
-from typing import List, Union
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Generic, List, Optional, Sequence, Tuple, TypeVar, Union
+
+# intervals are closed, so the state only flips just after an interval's end
+EPSILON = timedelta(microseconds=1)
+END_OF_DAY = time.max
+
+T = TypeVar("T", datetime, time)
+Row = Tuple[str, str]
+
 
 class Interval:
     def __init__(self, start: Union[str, datetime], end: Union[str, datetime]):
         if isinstance(start, str):
-            self.start = datetime.strptime(start, "%Y-%m-%d %H:%M:%S.%f")
+            self.start = datetime.fromisoformat(start)
         else:
             self.start = start
         if isinstance(end, str):
-            self.end = datetime.strptime(end, "%Y-%m-%d %H:%M:%S.%f")
+            self.end = datetime.fromisoformat(end)
         else:
             self.end = end
 
     def point_overlaps(self, date: datetime):
         return self.start <= date and date <= self.end
 
+
+class Index(Generic[T]):
+    """Disjoint, sorted, closed intervals answering point and range queries with bisection"""
+    def __init__(self, intervals: Sequence[Tuple[T, T]], adjacent: timedelta = EPSILON):
+        self.starts: List[T] = []
+        self.ends: List[T] = []
+        for start, end in sorted(intervals):
+            if end < start:
+                continue
+            if self.ends and start <= self.shift(self.ends[-1], adjacent):
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    @staticmethod
+    def shift(point: T, delta: timedelta) -> T:
+        if isinstance(point, time):
+            if point == END_OF_DAY:
+                return point
+            return (datetime.combine(date.min, point) + delta).time()
+        return point + delta
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def find(self, point: T) -> int:
+        """Index of the last interval starting at or before point, -1 if none"""
+        return bisect.bisect_right(self.starts, point) - 1
+
+    def point_overlaps(self, point: T) -> bool:
+        i = self.find(point)
+        return i >= 0 and point <= self.ends[i]
+
+    def range_overlaps(self, start: T, end: T) -> bool:
+        i = self.find(end)
+        return i >= 0 and start <= self.ends[i]
+
+    def points_overlap(self, points: Sequence[T]) -> List[bool]:
+        """point_overlaps for a whole batch, one sweep over the sorted points"""
+        result = [False] * len(points)
+        i = 0
+        for idx in sorted(range(len(points)), key=points.__getitem__):
+            point = points[idx]
+            while i < len(self.ends) and self.ends[i] < point:
+                i += 1
+            if i == len(self.ends):
+                break
+            result[idx] = self.starts[i] <= point
+        return result
+
+
 class IntervalCollection:
-    """This could be an interval tree, but that'd be premature"""
     def __init__(self, intervals: List[Interval]):
         self.intervals = intervals
+        self.parsed: Dict[Row, object] = {}
+        self.index: Index[datetime] = Index([(i.start, i.end) for i in intervals])
 
-    def point_overlaps(self, date: datetime):
-        return any(interval.point_overlaps(date) for interval in self.intervals)
+    def point_overlaps(self, date: datetime) -> bool:
+        return self.index.point_overlaps(date)
+
+    def range_overlaps(self, start: datetime, end: datetime) -> bool:
+        return self.index.range_overlaps(start, end)
+
+    def points_overlap(self, dates: Sequence[datetime]) -> List[bool]:
+        return self.index.points_overlap(dates)
+
+    def next_boundary(self, dt: datetime) -> Optional[datetime]:
+        """The first time after dt at which point_overlaps might change"""
+        i = self.index.find(dt)
+        if i >= 0 and dt <= self.index.ends[i]:
+            return self.index.ends[i] + EPSILON
+        if i + 1 < len(self.index):
+            return self.index.starts[i + 1]
+        return None
 
     @staticmethod
-    def from_sql(cur: sqlite3.Cursor):
+    def from_sql(cur: sqlite3.Cursor,
+                 previous: Optional["IntervalCollection"] = None) -> "IntervalCollection":
         query = "SELECT start, end FROM blackout_interval"
-        return IntervalCollection([Interval(row[0], row[1]) for row in cur.execute(query)])
+        intervals, parsed = parse_rows(cur.execute(query), previous, Interval)
+        if previous is not None and previous.intervals == intervals:
+            return previous
+        collection = IntervalCollection(intervals)
+        collection.parsed = parsed
+        return collection
 
 
 class TimeInterval:
     def __init__(self, start: Union[str, datetime], end: Union[str, datetime]):
         if isinstance(start, str):
-            self.start = datetime.strptime(start, "%H:%M:%S.%f").time()
+            self.start = time.fromisoformat(start)
         else:
             self.start = start.time()
         if isinstance(end, str):
-            self.end = datetime.strptime(end, "%H:%M:%S.%f").time()
+            self.end = time.fromisoformat(end)
         else:
             self.end = end.time()
 
@@ -47,16 +130,71 @@ class TimeInterval:
             return self.start <= t <= self.end
         return self.start <= t or t <= self.end
 
+    def pieces(self) -> List[Tuple[time, time]]:
+        """Split an interval wrapping around midnight in two"""
+        if self.start <= self.end:
+            return [(self.start, self.end)]
+        return [(self.start, END_OF_DAY), (time.min, self.end)]
+
 
 class RecordTime:
-    """This could be an interval tree, but that'd be premature"""
     def __init__(self, intervals: List[TimeInterval]):
         self.intervals = intervals
+        self.parsed: Dict[Row, object] = {}
+        self.index: Index[time] = Index(
+            [piece for interval in intervals for piece in interval.pieces()])
 
-    def point_overlaps(self, t: time):
-        return any(interval.point_overlaps(t) for interval in self.intervals)
+    def point_overlaps(self, t: time) -> bool:
+        return self.index.point_overlaps(t)
+
+    def points_overlap(self, times: Sequence[time]) -> List[bool]:
+        return self.index.points_overlap(times)
+
+    def next_boundary(self, dt: datetime) -> Optional[datetime]:
+        """The first time after dt at which point_overlaps might change"""
+        if len(self.index) == 0:
+            return None
+        t = dt.time()
+        i = self.index.find(t)
+        if i >= 0 and t <= self.index.ends[i]:
+            wraps = self.index.ends[i] == END_OF_DAY and self.index.starts[0] == time.min
+            if wraps and len(self.index) == 1:
+                return None
+            if wraps:
+                # carries on past midnight into tomorrow's first interval
+                tomorrow = dt.date() + timedelta(days=1)
+                return datetime.combine(tomorrow, self.index.ends[0]) + EPSILON
+            return datetime.combine(dt.date(), self.index.ends[i]) + EPSILON
+        if i + 1 < len(self.index):
+            return datetime.combine(dt.date(), self.index.starts[i + 1])
+        return datetime.combine(dt.date() + timedelta(days=1), self.index.starts[0])
 
     @staticmethod
-    def from_sql(cur: sqlite3.Cursor):
+    def from_sql(cur: sqlite3.Cursor, previous: Optional["RecordTime"] = None) -> "RecordTime":
         query = "SELECT start, end FROM recordtime WHERE activated"
-        return RecordTime([TimeInterval(row[0], row[1]) for row in cur.execute(query)])
+        intervals, parsed = parse_rows(cur.execute(query), previous, TimeInterval)
+        if previous is not None and previous.intervals == intervals:
+            return previous
+        record_time = RecordTime(intervals)
+        record_time.parsed = parsed
+        return record_time
+
+
+def parse_rows(rows, previous, parse) -> Tuple[List, Dict[Row, object]]:
+    """Parse rows, reusing the intervals of a previous load for rows that did not change"""
+    cache: Dict[Row, object] = previous.parsed if previous is not None else {}
+    parsed: Dict[Row, object] = {}
+    intervals = []
+    for row in rows:
+        key = (row[0], row[1])
+        interval = cache.get(key)
+        if interval is None:
+            interval = parse(row[0], row[1])
+        parsed[key] = interval
+        intervals.append(interval)
+    return intervals, parsed
+
+
+def data_version(conn: sqlite3.Connection) -> int:
+    """Changes whenever another connection commits to the database"""
+    return conn.execute("PRAGMA data_version").fetchone()[0]
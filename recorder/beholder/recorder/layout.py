@@ -0,0 +1,103 @@
+import itertools
+
+from dataclasses import dataclass
+from typing import Iterator, List, Sequence, Tuple
+
+# nvv4l2h264enc (and most h264 levels) top out at 4096 pixels a side
+MAX_CANVAS_SIZE = 4096
+
+Size = Tuple[int, int]
+
+
+@dataclass
+class Tile:
+    sink: int
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+@dataclass
+class Layout:
+    width: int
+    height: int
+    tiles: List[Tile]
+
+    @property
+    def area(self) -> int:
+        return self.width * self.height
+
+    @property
+    def unused(self) -> float:
+        """Fraction of the canvas no camera is drawn on"""
+        used = sum(tile.width * tile.height for tile in self.tiles)
+        return 1 - used / self.area if self.area else 0
+
+
+def compute_layout(sizes: Sequence[Size], max_size: int = MAX_CANVAS_SIZE) -> Layout:
+    """The smallest canvas that fits every camera at its own resolution
+
+    `sizes[i]` is drawn on compositor sink i. Tries every way of cutting the
+    cameras into rows (shelves) or columns, in the given order and tallest
+    first, and keeps the smallest area, then the squarest.
+    """
+    if not sizes:
+        raise ValueError("no cameras to lay out")
+    candidates = [
+        layout for layout in candidate_layouts(sizes)
+        if layout.width <= max_size and layout.height <= max_size]
+    if not candidates:
+        raise ValueError(f"cameras {list(sizes)} do not fit in {max_size}x{max_size}")
+    return min(candidates, key=lambda layout: (layout.area, max(layout.width, layout.height)))
+
+
+def candidate_layouts(sizes: Sequence[Size]) -> Iterator[Layout]:
+    orders = [list(range(len(sizes)))]
+    tallest = sorted(orders[0], key=lambda sink: (-sizes[sink][1], -sizes[sink][0]))
+    if tallest != orders[0]:
+        orders.append(tallest)
+    for order in orders:
+        for groups in partitions(order):
+            yield shelves(sizes, groups)
+            yield transpose(shelves([(h, w) for w, h in sizes], groups))
+
+
+def partitions(order: List[int]) -> Iterator[List[List[int]]]:
+    """Every way to cut `order` into consecutive, non empty groups"""
+    n = len(order)
+    for cuts in itertools.product([False, True], repeat=n - 1):
+        groups, group = [], [order[0]]
+        for sink, cut in zip(order[1:], cuts):
+            if cut:
+                groups.append(group)
+                group = []
+            group.append(sink)
+        groups.append(group)
+        yield groups
+
+
+def shelves(sizes: Sequence[Size], rows: List[List[int]]) -> Layout:
+    tiles = []
+    y = 0
+    width = 0
+    for row in rows:
+        x = 0
+        for sink in row:
+            w, h = sizes[sink]
+            tiles.append(Tile(sink, x, y, w, h))
+            x += w
+        width = max(width, x)
+        y += max(sizes[sink][1] for sink in row)
+    tiles.sort(key=lambda tile: tile.sink)
+    # encoders want even dimensions
+    return Layout(even(width), even(y), tiles)
+
+
+def transpose(layout: Layout) -> Layout:
+    return Layout(layout.height, layout.width, [
+        Tile(tile.sink, tile.y, tile.x, tile.height, tile.width) for tile in layout.tiles])
+
+
+def even(n: int) -> int:
+    return n + n % 2
@@ -0,0 +1,309 @@
+import abc
+import bisect
+import contextlib
+import math
+import os
+import pathlib
+import threading
+import time
+
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .utils import _log
+
+# ------------------------------------------------------------------------------
+# A small in-process metrics registry, rendered in the prometheus text format
+# and written out periodically for node_exporter's textfile collector (or
+# anything else that wants to scrape a file). Every metric is safe to update
+# from any thread.
+# ------------------------------------------------------------------------------
+LabelValues = Tuple[str, ...]
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300)
+
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def format_labels(self, values: LabelValues, extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """(sample name, formatted labels, value) of every line to render"""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {format_value(value)}")
+        return lines
+
+
+class SingleValueMetric(Metric):
+    """One number per label set, the base of counters and gauges"""
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+        if not self.labels:
+            self.values[()] = 0
+
+    def add(self, amount: float, labels: Dict[str, str]):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, value in values:
+            yield self.name, self.format_labels(key), value
+
+
+class Counter(SingleValueMetric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        if amount < 0:
+            raise ValueError("counters only go up")
+        self.add(amount, labels)
+
+
+class Gauge(SingleValueMetric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels: str):
+        self.add(amount, labels)
+
+    def set(self, value: float, **labels: str):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = SECONDS_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = sorted(buckets)
+        # per label set: count per bucket (the last one is +Inf), sum
+        self.values: Dict[LabelValues, Tuple[List[int], float]] = {}
+        if not self.labels:
+            self.values[()] = ([0] * (len(self.buckets) + 1), 0.0)
+
+    def observe(self, value: float, **labels: str):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        with self.lock:
+            counts, _total = self.values.get(self.key(labels), ([0], 0.0))
+            return sum(counts)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self.lock:
+            values = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self.values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + [math.inf], counts):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       self.format_labels(key, [("le", format_value(bound))]), cumulative)
+            yield f"{self.name}_sum", self.format_labels(key), total
+            yield f"{self.name}_count", self.format_labels(key), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"metric {metric.name} already registered")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))  # type: ignore
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))  # type: ignore
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = SECONDS_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))  # type: ignore
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Called right before every render, to sample gauges that are cheaper to pull"""
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self) -> str:
+        with self.lock:
+            collectors = list(self.collectors)
+            metrics = list(self.metrics.values())
+        for collector in collectors:
+            try:
+                collector()
+            except Exception:
+                _log().error("metrics collector failed", exc_info=True)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsWriter:
+    """Writes the registry to a file every `interval` seconds, atomically"""
+    def __init__(self, registry: Registry, path: pathlib.Path, interval: float):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics-writer", daemon=True)
+
+    def start(self):
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.thread.start()
+        _log().info("writing metrics to %s every %.0f seconds", self.path, self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        try:
+            tmp.write_text(self.registry.render())
+            # a scraper never sees a half written file
+            os.replace(tmp, self.path)
+        except OSError:
+            _log().error("could not write metrics to %s", self.path, exc_info=True)
+
+
+REGISTRY = Registry()
+
+# ------------------------------------------------------------------------------
+# Recorder pipeline metrics
+# ------------------------------------------------------------------------------
+SEGMENTS_PROCESSED = REGISTRY.counter(
+    "beholder_segments_processed_total", "Segments moved out of the recording directory")
+PROBE_SECONDS = REGISTRY.histogram(
+    "beholder_probe_seconds", "Time to read a segment's creation time", ["method"])
+ENCRYPT_SECONDS = REGISTRY.histogram(
+    "beholder_encrypt_seconds", "Time spent encrypting one segment")
+ENCRYPT_BYTES = REGISTRY.counter(
+    "beholder_encrypt_bytes_total", "Plaintext bytes encrypted")
+UPLOAD_SECONDS = REGISTRY.histogram(
+    "beholder_upload_seconds", "Wall time of a single upload", ["kind"])
+UPLOAD_BYTES = REGISTRY.counter(
+    "beholder_upload_bytes_total", "Bytes uploaded", ["kind"])
+UPLOAD_FAILURES = REGISTRY.counter(
+    "beholder_upload_failures_total", "Uploads that raised", ["kind"])
+QUEUE_DEPTH = REGISTRY.gauge(
+    "beholder_queue_depth", "Segments waiting in each stage of the work queue", ["stage"])
+QUEUE_BYTES = REGISTRY.gauge(
+    "beholder_queue_bytes", "Bytes held by each stage of the work queue", ["stage"])
+STORAGE_HEADROOM = REGISTRY.gauge(
+    "beholder_storage_headroom_bytes", "Bytes left before the high storage watermark")
+EVICTED_BYTES = REGISTRY.counter(
+    "beholder_evicted_bytes_total", "Bytes of local video evicted to free disk space")
+GSTREAMER_STARTS = REGISTRY.counter(
+    "beholder_gstreamer_starts_total", "Times the gstreamer pipeline was started")
+GSTREAMER_EXITS = REGISTRY.counter(
+    "beholder_gstreamer_exits_total",
+    "Times the gstreamer pipeline exited, requested or not", ["reason"])
+GST_DROPPED = REGISTRY.counter(
+    "beholder_gst_dropped_buffers_total", "Buffers dropped according to qos messages", ["element"])
+GST_FRAGMENTS = REGISTRY.counter(
+    "beholder_gst_fragments_total", "Segments closed by splitmuxsink")
+GST_ERRORS = REGISTRY.counter(
+    "beholder_gst_messages_total", "Error and warning messages on the pipeline bus", ["kind"])
+RESTARTS = REGISTRY.counter(
+    "beholder_restarts_total", "Periodic pipeline restarts", ["mode"])
+RESTART_GAP = REGISTRY.histogram(
+    "beholder_restart_gap_seconds",
+    "From a periodic restart until the next segment opens (respawn: until gst-launch is"
+    " relaunched, gstreamer itself is not visible)", ["mode"])
+JOB_SECONDS = REGISTRY.histogram(
+    "beholder_job_seconds", "Wall time of one run of a background job", ["job"])
+JOB_FAILURES = REGISTRY.counter(
+    "beholder_job_failures_total", "Background job runs that raised", ["job"])
+JOB_QUEUE_DEPTH = REGISTRY.gauge(
+    "beholder_job_queue_depth", "Runs of a background job in flight or queued, at most 2",
+    ["job"])
+REPLUGS = REGISTRY.counter(
+    "beholder_replugs_total", "Pipeline rebuilds after cameras were unplugged or plugged in",
+    ["action"])
+REPLUG_RECOVERY = REGISTRY.histogram(
+    "beholder_replug_recovery_seconds",
+    "From the first udev event of a replug until recording resumed (in process: until the next"
+    " segment opens)", ["action"])
+CV_FRAMES = REGISTRY.counter(
+    "beholder_cv_frames_total", "Frames run through motion detection")
+CV_FPS = REGISTRY.gauge(
+    "beholder_cv_fps", "Frames per second run through motion detection, recently")
+CV_SKIPPED = REGISTRY.counter(
+    "beholder_cv_skipped_frames_total", "Frames passed over to analyze a newer one")
+CV_TILES_SKIPPED = REGISTRY.counter(
+    "beholder_cv_tiles_skipped_total", "Camera tiles not analysed, static or black")
+CV_LAG = REGISTRY.gauge(
+    "beholder_cv_lag_seconds", "From a frame's arrival until motion detection finished with it")
+
+
+def start_writer(path: Optional[pathlib.Path], interval: float) -> Optional[MetricsWriter]:
+    if path is None or interval <= 0:
+        return None
+    writer = MetricsWriter(REGISTRY, path, interval)
+    writer.start()
+    return writer
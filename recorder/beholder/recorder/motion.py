@@ -0,0 +1,245 @@
+import abc
+
+import cv2  # type: ignore
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Type
+
+import numpy as np  # type: ignore
+
+from .layout import Layout
+
+# ------------------------------------------------------------------------------
+# Motion detector backends. Each takes BGR frames of a fixed size and returns up
+# to MAX_BOXES (x, y, width, height) boxes in that frame's coordinates.
+#   mog2        -> MOG2 on the full frame, the reference
+#   mog2_small  -> MOG2 on a quarter size frame
+#   diff        -> difference against the previous quarter size grey frame
+#   grid        -> mean difference per block of the quarter size frame
+# benchmarks/motion_benchmark.py replays recordings through them to compare
+# speed and agreement with mog2.
+# ------------------------------------------------------------------------------
+BBox = Tuple[int, int, int, int]
+
+MAX_BOXES = 3
+# blobs smaller than this fraction of the frame are noise
+MIN_AREA_FRACTION = 1 / 5000
+DOWNSCALE = 0.25
+# a tile is static when no cell of its thumbnail changed by more grey levels than this
+STATIC_THRESHOLD = 3
+# and its camera is missing when the compositor left it black
+BLACK_THRESHOLD = 8
+THUMBNAIL_SIZE = (32, 24)
+
+
+class MotionDetector(abc.ABC):
+    name = ""
+
+    def __init__(self, height: int, width: int):
+        self.height = height
+        self.width = width
+        self.percent_area = height * width * MIN_AREA_FRACTION
+
+    @abc.abstractmethod
+    def motion_bboxes(self, frame) -> List[BBox]:
+        """Up to MAX_BOXES boxes around what moved since the previous frames"""
+
+
+class Mog2Detector(MotionDetector):
+    name = "mog2"
+
+    def __init__(self, height: int, width: int, learning_rate: float = 0.2):
+        super().__init__(height, width)
+        self.bgs = cv2.createBackgroundSubtractorMOG2()
+        self.fgmask = np.zeros((height, width), np.uint8)
+        self.learning_rate = learning_rate
+
+    def motion_bboxes(self, frame) -> List[BBox]:
+        self.fgmask = self.bgs.apply(frame, self.fgmask, 0.5)
+        _, absolute_difference = cv2.threshold(
+            self.fgmask,
+            100, 255,
+            cv2.THRESH_BINARY)
+        contours, hierarchy = cv2.findContours(
+            absolute_difference,
+            cv2.RETR_TREE,
+            cv2.CHAIN_APPROX_SIMPLE)[-2:]
+        areas = [cv2.contourArea(c) for c in contours]
+        return self.biggest_bounding_box(areas, contours)
+
+    def biggest_bounding_box(self, areas, contours) -> List[BBox]:
+        if len(areas) == 0: return []
+        num_boxes = min(len(areas), MAX_BOXES)
+        indices = np.argpartition(areas, -num_boxes)[-num_boxes:]
+        return [
+            cv2.boundingRect(contours[idx])
+            for idx in indices
+            if areas[idx] > self.percent_area
+        ]
+
+
+class DownscaledDetector(MotionDetector):
+    """Works on a small copy of the frame and scales its boxes back up"""
+    scale = DOWNSCALE
+
+    def __init__(self, height: int, width: int):
+        super().__init__(height, width)
+        self.small_size = (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+        self.min_area = self.percent_area * self.scale ** 2
+
+    def shrink(self, frame, grey: bool = False):
+        small = cv2.resize(frame, self.small_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if grey else small
+
+
+class SmallMog2Detector(DownscaledDetector):
+    name = "mog2_small"
+
+    def __init__(self, height: int, width: int):
+        super().__init__(height, width)
+        self.bgs = cv2.createBackgroundSubtractorMOG2()
+
+    def motion_bboxes(self, frame) -> List[BBox]:
+        fgmask = self.bgs.apply(self.shrink(frame), None, 0.5)
+        _, mask = cv2.threshold(fgmask, 100, 255, cv2.THRESH_BINARY)
+        return component_bboxes(mask, self.min_area, 1 / self.scale)
+
+
+class DiffDetector(DownscaledDetector):
+    name = "diff"
+    threshold = 25
+    kernel = np.ones((3, 3), np.uint8)
+
+    def __init__(self, height: int, width: int):
+        super().__init__(height, width)
+        self.previous: Optional[np.ndarray] = None
+
+    def motion_bboxes(self, frame) -> List[BBox]:
+        grey = self.shrink(frame, grey=True).astype(np.int16)
+        previous, self.previous = self.previous, grey
+        if previous is None:
+            return []
+        mask = (np.abs(grey - previous) > self.threshold).astype(np.uint8)
+        # join the edges of a moving object back into one blob
+        mask = cv2.dilate(mask, self.kernel)
+        return component_bboxes(mask, self.min_area, 1 / self.scale)
+
+
+class GridDetector(DownscaledDetector):
+    name = "grid"
+    block = 8
+    # mean absolute grey level change over a block
+    threshold = 8
+
+    def __init__(self, height: int, width: int):
+        super().__init__(height, width)
+        width, height = self.small_size
+        self.rows, self.columns = height // self.block, width // self.block
+        self.previous: Optional[np.ndarray] = None
+
+    def motion_bboxes(self, frame) -> List[BBox]:
+        grey = self.shrink(frame, grey=True)
+        grey = grey[:self.rows * self.block, :self.columns * self.block].astype(np.int16)
+        previous, self.previous = self.previous, grey
+        if previous is None:
+            return []
+        energy = np.abs(grey - previous).reshape(
+            self.rows, self.block, self.columns, self.block).mean(axis=(1, 3))
+        mask = (energy > self.threshold).astype(np.uint8)
+        # every block is already far bigger than the smallest blob worth reporting
+        return component_bboxes(mask, 0, self.block / self.scale)
+
+
+def component_bboxes(mask: np.ndarray, min_area: float, scale: float) -> List[BBox]:
+    """The biggest blobs of a binary mask, as boxes scaled up to the frame"""
+    _count, _labels, stats, _centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    # label 0 is the background
+    stats = stats[1:]
+    stats = stats[stats[:, cv2.CC_STAT_AREA] > min_area]
+    if len(stats) > MAX_BOXES:
+        stats = stats[np.argpartition(stats[:, cv2.CC_STAT_AREA], -MAX_BOXES)[-MAX_BOXES:]]
+    boxes = np.rint(stats[:, :4] * scale).astype(int)
+    return [tuple(box) for box in boxes.tolist()]
+
+
+DETECTORS: Dict[str, Type[MotionDetector]] = {
+    Mog2Detector.name: Mog2Detector,
+    SmallMog2Detector.name: SmallMog2Detector,
+    DiffDetector.name: DiffDetector,
+    GridDetector.name: GridDetector,
+}
+
+
+def get_detector(name: str, height: int, width: int) -> MotionDetector:
+    try:
+        detector = DETECTORS[name]
+    except KeyError:
+        raise ValueError(f"unknown motion detector {name}, expected one of {list(DETECTORS)}")
+    return detector(height, width)
+
+
+# ------------------------------------------------------------------------------
+# Per camera detection on the composited frame
+# ------------------------------------------------------------------------------
+@dataclass
+class CameraTile:
+    camera: int
+    # where the camera is in the analysed frame
+    x: int
+    y: int
+    width: int
+    height: int
+    # analysed frame pixels to camera pixels
+    scale_x: float
+    scale_y: float
+    detector: MotionDetector
+    thumbnail: Optional[np.ndarray] = None
+
+    def crop(self, frame: np.ndarray) -> np.ndarray:
+        return frame[self.y:self.y + self.height, self.x:self.x + self.width]
+
+    def to_camera(self, box: BBox) -> BBox:
+        x, y, w, h = box
+        return (round(x * self.scale_x), round(y * self.scale_y),
+                round(w * self.scale_x), round(h * self.scale_y))
+
+
+class TiledDetector():
+    """One detector per compositor tile, reporting boxes in each camera's own pixels
+
+    `cameras[i]` is the camera drawn on compositor sink i of `layout`, and the
+    analysed frames are the whole canvas scaled to `height` x `width`.
+    """
+    def __init__(self, name: str, layout: Layout, cameras: Sequence[int], height: int,
+                 width: int):
+        scale_x, scale_y = width / layout.width, height / layout.height
+        self.tiles: List[CameraTile] = []
+        for tile in layout.tiles:
+            x, y = round(tile.x * scale_x), round(tile.y * scale_y)
+            tile_width = max(1, min(width, round((tile.x + tile.width) * scale_x)) - x)
+            tile_height = max(1, min(height, round((tile.y + tile.height) * scale_y)) - y)
+            self.tiles.append(CameraTile(
+                cameras[tile.sink], x, y, tile_width, tile_height,
+                tile.width / tile_width, tile.height / tile_height,
+                get_detector(name, tile_height, tile_width)))
+        self.skipped = 0
+
+    def motion_bboxes(self, frame: np.ndarray) -> List[Tuple[int, BBox]]:
+        crops = [tile.crop(frame) for tile in self.tiles]
+        # every tile's thumbnail at once, to find the ones worth running a detector on
+        thumbnails = np.stack([
+            cv2.resize(crop, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA) for crop in crops
+        ]).astype(np.int16)
+        previous = [tile.thumbnail for tile in self.tiles]
+        black = thumbnails.max(axis=(1, 2, 3)) < BLACK_THRESHOLD
+        boxes: List[Tuple[int, BBox]] = []
+        for tile, crop, thumbnail, before, missing in zip(
+                self.tiles, crops, thumbnails, previous, black):
+            tile.thumbnail = thumbnail
+            static = before is not None and np.abs(thumbnail - before).max() < STATIC_THRESHOLD
+            if missing or static:
+                self.skipped += 1
+                continue
+            boxes.extend(
+                (tile.camera, tile.to_camera(box)) for box in tile.detector.motion_bboxes(crop))
+        return boxes
@@ -0,0 +1,146 @@
+import datetime
+import pathlib
+import struct
+
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+# mp4 timestamps count seconds from 1904, in utc
+MP4_EPOCH = datetime.datetime(1904, 1, 1, tzinfo=datetime.timezone.utc)
+# never read more than this much header into memory
+MAX_MOOV_SIZE = 64 * 2**20
+
+class Mp4Error(Exception):
+    pass
+
+
+@dataclass
+class Track:
+    track_id: int
+    handler: str = ""
+    width: float = 0
+    height: float = 0
+    timescale: int = 0
+    duration: float = 0
+
+
+@dataclass
+class Mp4Info:
+    creation_time: Optional[datetime.datetime]
+    modification_time: Optional[datetime.datetime]
+    timescale: int
+    duration: float
+    tracks: List[Track] = field(default_factory=list)
+
+
+def read_info(path: Union[str, pathlib.Path]) -> Mp4Info:
+    """Read the movie header of an mp4 without decoding (or spawning) anything"""
+    with open(path, "rb") as f:
+        moov = find_moov(f)
+    return parse_moov(moov)
+
+
+def find_moov(f: BinaryIO) -> bytes:
+    # moov is usually after mdat, hop over the top level boxes to find it
+    offset = 0
+    while True:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            raise Mp4Error("no moov box")
+        size, box_type = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise Mp4Error("truncated box header")
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            # box runs to the end of the file, an unfinished recording
+            if box_type != b"moov":
+                raise Mp4Error("no moov box")
+            size = MAX_MOOV_SIZE
+        if size < header_size:
+            raise Mp4Error(f"invalid {box_type!r} box size {size}")
+        if box_type == b"moov":
+            if size > MAX_MOOV_SIZE:
+                raise Mp4Error(f"moov box too big {size}")
+            f.seek(offset + header_size)
+            return f.read(size - header_size)
+        offset += size
+
+
+def iter_boxes(data: bytes) -> Iterator[Tuple[bytes, bytes]]:
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size or offset + size > len(data):
+            raise Mp4Error(f"invalid {box_type!r} box size {size}")
+        yield box_type, data[offset + header_size:offset + size]
+        offset += size
+
+
+def mp4_time(seconds: int) -> Optional[datetime.datetime]:
+    if seconds == 0:
+        return None
+    return MP4_EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def parse_moov(moov: bytes) -> Mp4Info:
+    info: Optional[Mp4Info] = None
+    tracks = []
+    try:
+        for box_type, body in iter_boxes(moov):
+            if box_type == b"mvhd":
+                info = parse_mvhd(body)
+            elif box_type == b"trak":
+                tracks.append(parse_trak(body))
+    except (struct.error, IndexError) as e:
+        # too short for its fields, down to an empty body without even a version
+        raise Mp4Error(f"truncated box: {e}")
+    if info is None:
+        raise Mp4Error("no mvhd box")
+    info.tracks = tracks
+    return info
+
+
+def parse_mvhd(body: bytes) -> Mp4Info:
+    version = body[0]
+    if version == 1:
+        creation, modification, timescale, duration = struct.unpack_from(">QQIQ", body, 4)
+    else:
+        creation, modification, timescale, duration = struct.unpack_from(">IIII", body, 4)
+    return Mp4Info(
+        creation_time=mp4_time(creation),
+        modification_time=mp4_time(modification),
+        timescale=timescale,
+        duration=duration / timescale if timescale else 0)
+
+
+def parse_trak(trak: bytes) -> Track:
+    track = Track(track_id=0)
+    for box_type, body in iter_boxes(trak):
+        if box_type == b"tkhd":
+            version = body[0]
+            track.track_id = struct.unpack_from(">I", body, 20 if version == 1 else 12)[0]
+            # width and height are 16.16 fixed point at the very end
+            width, height = struct.unpack_from(">II", body, len(body) - 8)
+            track.width, track.height = width / 65536, height / 65536
+        elif box_type == b"mdia":
+            for mdia_type, mdia_body in iter_boxes(body):
+                if mdia_type == b"mdhd":
+                    if mdia_body[0] == 1:
+                        timescale, duration = struct.unpack_from(">IQ", mdia_body, 20)
+                    else:
+                        timescale, duration = struct.unpack_from(">II", mdia_body, 12)
+                    track.timescale = timescale
+                    track.duration = duration / timescale if timescale else 0
+                elif mdia_type == b"hdlr":
+                    track.handler = mdia_body[8:12].decode("ascii", errors="replace")
+    return track
@@ -0,0 +1,44 @@
+import os
+import pathlib
+import socket
+import threading
+
+from typing import Callable
+
+from .utils import _log
+
+# the webapp sends the name of the table it just committed to
+BLACKOUT_TABLE = "blackout_interval"
+RECORDTIME_TABLE = "recordtime"
+SCHEDULE_TABLES = {BLACKOUT_TABLE, RECORDTIME_TABLE}
+
+
+class ScheduleListener:
+    """Receives schedule change notifications from the webapp on a unix datagram socket"""
+    def __init__(self, path: pathlib.Path, callback: Callable[[str], None]):
+        self.path = path
+        self.callback = callback
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.thread = threading.Thread(target=self.listen, name="schedule-listener", daemon=True)
+
+    def start(self):
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.path.unlink(missing_ok=True)
+        self.sock.bind(str(self.path))
+        # the webapp runs as a different user
+        os.chmod(self.path, 0o666)
+        self.thread.start()
+        _log().info("listening for schedule changes on %s", self.path)
+
+    def listen(self):
+        while True:
+            try:
+                message = self.sock.recv(256).decode(errors="replace").strip()
+            except OSError:
+                _log().error("schedule listener stopped", exc_info=True)
+                return
+            if message not in SCHEDULE_TABLES:
+                _log().warning("ignoring schedule notification %r", message)
+                continue
+            _log().info("schedule changed: %s", message)
+            self.callback(message)
@@ -0,0 +1,132 @@
+import abc
+
+from typing import Dict, Optional, Type
+
+# ------------------------------------------------------------------------------
+# Pipeline profiles: the hardware specific elements of the recording pipeline.
+# Configuration.gstreamer_pipeline lays out the same graph with either
+#   jetson   -> v4l2 mjpeg cameras, nvcompositor, nvvidconv, nvv4l2h264enc
+#   software -> videotestsrc/audiotestsrc, compositor, videoconvert, x264enc,
+#               runs on any linux box with the stock gstreamer plugins
+# ------------------------------------------------------------------------------
+
+
+class PipelineProfile(abc.ABC):
+    name = ""
+    compositor = ""
+    converter = ""
+    # caps feature of the buffers between converter, compositor and encoder
+    memory = ""
+    # format the compositor blends in and the one the encoder wants
+    composite_format = ""
+    encode_format = ""
+    audio_encoder = ""
+    splitmux_options = ""
+    # what computer vision gets handed through the frame ring, opencv channel order
+    cv_format = "BGR"
+    capture_fps = 30
+
+    def raw_caps(self, width: int, height: int, fps: int, format: Optional[str] = None,
+                 memory: Optional[str] = None) -> str:
+        memory = self.memory if memory is None else memory
+        caps = f"video/x-raw{memory},width={width},height={height},framerate={fps}/1"
+        if format:
+            caps += f",format={format}"
+        return caps
+
+    @abc.abstractmethod
+    def video_source(self, device: str, number: int, width: int, height: int) -> str:
+        """Elements from camera `device` up to raw frames of width x height"""
+
+    @abc.abstractmethod
+    def audio_source(self, device: str) -> str:
+        """Element reading alsa `device`"""
+
+    @abc.abstractmethod
+    def encoder(self, fps: int) -> str:
+        """The h264 encoder element"""
+
+    def loopback_sink(self, device: str) -> str:
+        return f"identity drop-allocation=true ! v4l2sink device={device}"
+
+
+class JetsonProfile(PipelineProfile):
+    name = "jetson"
+    compositor = "nvcompositor"
+    converter = "nvvidconv"
+    memory = "(memory:NVMM)"
+    composite_format = "RGBA"
+    encode_format = "NV12"
+    audio_encoder = "voaacenc"
+    splitmux_options = "mux=qtmux sync=false"
+    # nvvidconv has no packed 3 channel output
+    cv_format = "BGRx"
+
+    def video_source(self, device: str, number: int, width: int, height: int) -> str:
+        return (
+            f"v4l2src device={device}"
+            f" ! image/jpeg,width={width},height={height},framerate={self.capture_fps}/1,"
+            "pixel-aspect-ratio=1/1"
+            f" ! jpegdec ! {self.converter}")
+
+    def audio_source(self, device: str) -> str:
+        return f"alsasrc device={device} latency-time=10000"
+
+    def encoder(self, fps: int) -> str:
+        return "nvv4l2h264enc name=enc preset-level=1 insert-vui=1 iframeinterval=30"
+
+
+class SoftwareProfile(PipelineProfile):
+    name = "software"
+    compositor = "compositor"
+    converter = "videoconvert ! videoscale"
+    composite_format = "I420"
+    encode_format = "I420"
+    audio_encoder = "avenc_aac"
+    splitmux_options = "muxer-factory=qtmux"
+    # videotestsrc patterns, so every camera looks different
+    patterns = ["ball", "smpte", "snow", "pinwheel", "spokes", "gradient"]
+
+    def video_source(self, device: str, number: int, width: int, height: int) -> str:
+        pattern = self.patterns[number % len(self.patterns)]
+        return (
+            f"videotestsrc is-live=true pattern={pattern}"
+            f" ! video/x-raw,width={width},height={height},framerate={self.capture_fps}/1"
+            f" ! {self.converter}")
+
+    def audio_source(self, device: str) -> str:
+        return "audiotestsrc is-live=true wave=pink-noise"
+
+    def encoder(self, fps: int) -> str:
+        return (
+            "x264enc name=enc tune=zerolatency speed-preset=ultrafast"
+            f" key-int-max={fps} bitrate=4096")
+
+
+# computer vision formats and their channels per pixel, all in opencv (BGR) order
+CV_FORMAT_CHANNELS: Dict[str, int] = {
+    "BGR": 3,
+    "BGRx": 4,
+    "BGRA": 4,
+}
+
+
+def cv_format_channels(cv_format: str) -> int:
+    try:
+        return CV_FORMAT_CHANNELS[cv_format]
+    except KeyError:
+        raise ValueError(f"unsupported computer vision format {cv_format},"
+                         f" expected one of {list(CV_FORMAT_CHANNELS)}")
+
+
+PROFILES: Dict[str, Type[PipelineProfile]] = {
+    JetsonProfile.name: JetsonProfile,
+    SoftwareProfile.name: SoftwareProfile,
+}
+
+
+def get_profile(name: str) -> PipelineProfile:
+    try:
+        return PROFILES[name]()
+    except KeyError:
+        raise ValueError(f"unknown pipeline profile {name}, expected one of {list(PROFILES)}")
@@ -8,6 +8,11 @@ from dateutil import parser  # type: ignore
 
 from .configuration import Configuration
 from .interval import IntervalCollection
+from .metrics import PROBE_SECONDS, SEGMENTS_PROCESSED
+from .mp4 import Mp4Error, read_info
+from .utils import _log
+from .work_queue import (
+    STAGE_PROCESSED, STAGE_RECORDED, Segment, WorkQueue, to_timestamp, to_utc, utcnow)
 
 def get_raw_video_path_parts(raw_video_path: pathlib.Path) -> Dict[str, str]:
     parts = raw_video_path.parts
@@ -18,21 +23,44 @@ def get_raw_video_path_parts(raw_video_path: pathlib.Path) -> Dict[str, str]:
     }
 
 
-def process_all(config: Configuration, interval_collection: Optional[IntervalCollection] = None):
+def process_all(config: Configuration, work_queue: WorkQueue,
+                interval_collection: Optional[IntervalCollection] = None,
+                finalized: bool = False):
+    """finalized: recordings are only queued once gstreamer closed them (see inotify)"""
+    if not finalized:
+        # new segments only ever show up in the (flat) recording directory
+        for video_path in config.out_path.glob("*.mp4"):
+            work_queue.add(video_path, STAGE_RECORDED)
+
     cnt = 0
-    for video_path in config.observation_directory.glob("**/recording/*.mp4"):
-        cnt += process_video(config, interval_collection, video_path)
+    segment = work_queue.take(STAGE_RECORDED)
+    while segment is not None:
+        try:
+            cnt += process_video(config, interval_collection, work_queue, segment, finalized)
+        except Exception:
+            # give it back, it would stay claimed until the next start otherwise
+            _log().error("failed to process %s", segment.path, exc_info=True)
+            work_queue.retry_later(segment)
+        segment = work_queue.take(STAGE_RECORDED)
     return cnt
 
 
 def process_video(config: Configuration,
                   interval_collection: Optional[IntervalCollection],
-                  raw_video_path: pathlib.Path) -> int:
-    create_time = get_create_time(raw_video_path)
+                  work_queue: WorkQueue,
+                  segment: Segment,
+                  finalized: bool = False) -> int:
+    raw_video_path = segment.path
+    if not raw_video_path.exists():
+        work_queue.finish(segment)
+        return 0
+    # segments are kept in naive UTC, like the mp4 creation times
+    create_time = to_utc(get_create_time(raw_video_path))
 
-    now = datetime.datetime.now()
-    create_elapsed = now - create_time.replace(tzinfo=None)
-    if (create_elapsed < datetime.timedelta(seconds=2 * config.segment_time_seconds)):
+    # gstreamer may still be writing to it, come back once it's old enough
+    ready_time = create_time + datetime.timedelta(seconds=2 * config.segment_time_seconds)
+    if not finalized and utcnow() < ready_time:
+        work_queue.defer(segment, to_timestamp(ready_time))
         return 0
 
     # move file to processed path
@@ -41,13 +69,29 @@ def process_video(config: Configuration,
     processed_path.mkdir(exist_ok=True, parents=True)
     processed_video = processed_path / "video.mp4"
     raw_video_path.replace(processed_video)
+    work_queue.advance(segment, STAGE_PROCESSED, processed_video, create_time)
+    SEGMENTS_PROCESSED.inc()
     return 1
 
 
 def get_create_time(videopath: pathlib.Path) -> datetime.datetime:
+    try:
+        with PROBE_SECONDS.time(method="mp4"):
+            creation_time = read_info(videopath).creation_time
+    except Mp4Error as e:
+        # unfinished or malformed, let ffmpeg try harder
+        _log().info("could not parse %s (%s), falling back to ffprobe", videopath, e)
+        with PROBE_SECONDS.time(method="ffprobe"):
+            return probe_create_time(videopath)
+    if creation_time is not None:
+        return creation_time
+    return datetime.datetime.fromtimestamp(videopath.stat().st_ctime, datetime.timezone.utc)
+
+
+def probe_create_time(videopath: pathlib.Path) -> datetime.datetime:
     probe = FFProbe(str(videopath))
     iso_str = probe.metadata.get("creation_time", None)
-    stat_ctime = datetime.datetime.fromtimestamp(videopath.stat().st_ctime)
+    stat_ctime = datetime.datetime.fromtimestamp(videopath.stat().st_ctime, datetime.timezone.utc)
     if iso_str is not None:
         return parser.isoparse(iso_str)  # type: ignore
     return stat_ctime
@@ -55,4 +99,4 @@ def get_create_time(videopath: pathlib.Path) -> datetime.datetime:
 
 if __name__ == "__main__":
     config = Configuration.from_file("beholder.ini")
-    process_all(config)
+    process_all(config, WorkQueue(config.work_queue_path))
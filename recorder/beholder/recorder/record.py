@@ -1,12 +1,19 @@
 import shutil
 import subprocess
 
-from typing import Optional
+from typing import Any, Callable, Optional, Union
 
+from . import gst_pipeline
 from .configuration import Configuration
+from .gst_pipeline import GstPipeline, PipelineEvent
 from .utils import _log
 
-def record(config: Configuration) -> Optional[subprocess.Popen]:
+RecordProcess = Union[subprocess.Popen, GstPipeline]
+
+def record(config: Configuration,
+           on_event: Optional[Callable[[PipelineEvent], None]] = None,
+           on_frame: Optional[Callable[[Any, float], None]] = None
+           ) -> Optional[RecordProcess]:
     if len(config.devices) == 0: return None
 
     for write_path in config.write_paths:
@@ -17,6 +24,21 @@ def record(config: Configuration) -> Optional[subprocess.Popen]:
         shutil.rmtree(config.hls_path)
         config.hls_path.mkdir(exist_ok=True, parents=True)
 
+    if config.cv_transport == "shm" and not config.gstreamer_in_process:
+        _log().warning("cv_transport = shm needs gstreamer_in_process, using the loopback device")
+
+    if config.gstreamer_in_process:
+        if gst_pipeline.available():
+            pipeline = config.gstreamer_pipeline()
+            _log().info("gstreamer (in process) %s", pipeline)
+            process = GstPipeline(pipeline, on_event)
+            if on_frame is not None and not process.connect_appsink("cv", on_frame):
+                _log().warning("no cv appsink in the pipeline, computer vision gets no frames")
+            return process.start()
+        _log().warning("gstreamer python bindings are missing, falling back to gst-launch")
+        if config.frame_ring_enabled:
+            _log().warning("computer vision gets no frames without the python bindings")
+
     gstreamer_flags = config.gstreamer_flags()
 
     _log().info("gstreamer %s", gstreamer_flags)
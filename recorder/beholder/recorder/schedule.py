@@ -0,0 +1,70 @@
+import datetime
+import threading
+
+from typing import Optional, Set
+
+from .interval import IntervalCollection, RecordTime
+
+# reasons the control loop was woken up
+WAKE_TIMEOUT = "timeout"
+WAKE_SCHEDULE_CHANGED = "schedule_changed"
+WAKE_CHILD_EXIT = "child_exit"
+WAKE_DEVICES_CHANGED = "devices_changed"
+WAKE_SHUTDOWN = "shutdown"
+
+
+class Schedule:
+    """When the user allows recording: not in a blackout and within a record time"""
+    def __init__(self,
+                 blackouts: Optional[IntervalCollection],
+                 record_times: Optional[RecordTime]):
+        self.blackouts = blackouts
+        self.record_times = record_times
+
+    def is_blackout(self, dt: datetime.datetime) -> bool:
+        if self.blackouts is None:
+            return False
+        return self.blackouts.point_overlaps(dt)
+
+    def is_record_time(self, dt: datetime.datetime) -> bool:
+        if self.record_times is None or len(self.record_times.intervals) == 0:
+            return True
+        return self.record_times.point_overlaps(dt.time())
+
+    def should_record(self, dt: datetime.datetime) -> bool:
+        return not self.is_blackout(dt) and self.is_record_time(dt)
+
+    def next_transition(self, dt: datetime.datetime) -> Optional[datetime.datetime]:
+        """The first moment after dt at which should_record might change"""
+        boundaries = []
+        if self.blackouts is not None:
+            boundaries.append(self.blackouts.next_boundary(dt))
+        if self.record_times is not None:
+            boundaries.append(self.record_times.next_boundary(dt))
+        return min((b for b in boundaries if b is not None), default=None)
+
+
+class Wakeup:
+    """What the control loop sleeps on. Anything can wake it early, saying why."""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.reasons: Set[str] = set()
+
+    def set(self, reason: str):
+        with self.condition:
+            self.reasons.add(reason)
+            self.condition.notify_all()
+
+    def wait(self, timeout: Optional[float]) -> Set[str]:
+        with self.condition:
+            if not self.reasons:
+                self.condition.wait(timeout)
+            reasons = self.reasons or {WAKE_TIMEOUT}
+            self.reasons = set()
+            return reasons
+
+
+def seconds_until(now: datetime.datetime, then: Optional[datetime.datetime]) -> Optional[float]:
+    if then is None:
+        return None
+    return max(0.0, (then - now).total_seconds())
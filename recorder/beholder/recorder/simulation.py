@@ -0,0 +1,484 @@
+"""Run the whole record -> process -> upload loop without any hardware.
+
+    python -m beholder.recorder.simulation /tmp/beholder-sim --speed 60 --hours 24
+
+A SegmentGenerator stands in for gstreamer and writes small but valid mp4s,
+fake cameras stand in for v4l2 and sounddevice, and uploads go to a directory
+through an uplink of fixed bandwidth instead of spaces. Everything else is the
+real Controller, work queue, processing and upload code.
+
+Time runs `speed` times faster than real time: segment length, polling and the
+uplink are scaled, files and the work queue keep real timestamps, and the
+report converts back to simulated seconds. mp4 creation times only have one
+second resolution and name the processed directories, so a segment has to last
+at least a real second: speed can be at most the segment length.
+"""
+import datetime
+import os
+import pathlib
+import signal
+import struct
+import threading
+import time
+
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+import click # type: ignore
+import numpy as np # type: ignore
+
+from .configuration import CameraDevice, Configuration, DeviceComplex, MicrophoneDevice
+from .controller import Controller, Credentials
+from .mp4 import MP4_EPOCH
+from .record import RecordProcess
+from .schedule import WAKE_SHUTDOWN
+from .spaces import MB, Spaces
+from .utils import _log, setup_logging
+
+# how process_recordings names a segment's directory after its creation time
+PROCESSED_FORMAT = "%Y_%m_%d_%H_%M_%S_%f"
+CHUNK_SIZE = MB
+MP4_TIMESCALE = 1000
+# 16.16 fixed point identity matrix of the movie and track headers
+IDENTITY_MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+class SimulationClock():
+    """Converts between real seconds and simulated seconds"""
+    def __init__(self, speed: float):
+        if speed <= 0:
+            raise ValueError(f"speed has to be positive, not {speed}")
+        self.speed = speed
+        self.start = time.time()
+
+    def real(self, simulated_seconds: float) -> float:
+        return simulated_seconds / self.speed
+
+    def simulated(self, real_seconds: float) -> float:
+        return real_seconds * self.speed
+
+    def elapsed(self) -> float:
+        """Simulated seconds since the clock started"""
+        return self.simulated(time.time() - self.start)
+
+    def sleep(self, simulated_seconds: float):
+        time.sleep(self.real(simulated_seconds))
+
+
+# ------------------------------------------------------------------------------
+# Segments: mp4 files with a proper movie header and no frames, enough for
+# process_recordings and anything else that only looks at the container
+# ------------------------------------------------------------------------------
+def box(box_type: bytes, body: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(body), box_type) + body
+
+
+def full_box(box_type: bytes, body: bytes, flags: int = 0) -> bytes:
+    return box(box_type, struct.pack(">I", flags) + body)
+
+
+def mp4_seconds(created: datetime.datetime) -> int:
+    return int((created - MP4_EPOCH).total_seconds())
+
+
+def movie_box(created: datetime.datetime, duration: float, width: int, height: int) -> bytes:
+    seconds = mp4_seconds(created)
+    ticks = round(duration * MP4_TIMESCALE)
+    mvhd = full_box(b"mvhd", struct.pack(">IIIIIH", seconds, seconds, MP4_TIMESCALE, ticks,
+                                         0x10000, 0x100)
+                    + bytes(10) + IDENTITY_MATRIX + bytes(24) + struct.pack(">I", 2))
+    # enabled and in the movie
+    tkhd = full_box(b"tkhd", struct.pack(">IIIII", seconds, seconds, 1, 0, ticks)
+                    + bytes(16) + IDENTITY_MATRIX + struct.pack(">II", width << 16, height << 16),
+                    flags=3)
+    mdhd = full_box(b"mdhd", struct.pack(">IIIIHH", seconds, seconds, MP4_TIMESCALE, ticks,
+                                         0x55c4, 0))
+    hdlr = full_box(b"hdlr", bytes(4) + b"vide" + bytes(12) + b"VideoHandler\x00")
+    return box(b"moov", mvhd + box(b"trak", tkhd + box(b"mdia", mdhd + hdlr)))
+
+
+def write_mp4(path: pathlib.Path, created: datetime.datetime, duration: float, size: int,
+              width: int, height: int):
+    """Write a `size` byte mp4 the way qtmux lays it out, media data first"""
+    ftyp = box(b"ftyp", b"isom" + struct.pack(">I", 0x200) + b"isomiso2avc1mp41")
+    moov = movie_box(created, duration, width, height)
+    remaining = max(0, size - len(ftyp) - len(moov) - 8)
+    with path.open("wb") as f:
+        f.write(ftyp)
+        f.write(struct.pack(">I4s", 8 + remaining, b"mdat"))
+        while remaining > 0:
+            chunk = min(remaining, CHUNK_SIZE)
+            f.write(bytes(chunk))
+            remaining -= chunk
+        f.write(moov)
+
+
+def processed_name(created: float) -> str:
+    return datetime.datetime.fromtimestamp(int(created), datetime.timezone.utc).strftime(
+        PROCESSED_FORMAT)
+
+
+SegmentCallback = Callable[[str, float], None]
+
+
+class SegmentGenerator():
+    """Stands in for gstreamer: a segment every `interval` seconds until `until`
+
+    Looks like a RecordProcess to the controller. Like gst-launch -e, an
+    interrupt finishes the segment being recorded before it exits.
+    """
+    def __init__(self, location: pathlib.Path, interval: float, size: int, width: int,
+                 height: int, until: Optional[float] = None,
+                 on_segment: Optional[SegmentCallback] = None):
+        self.location = location
+        self.interval = interval
+        self.size = size
+        self.width = width
+        self.height = height
+        self.until = until
+        self.on_segment = on_segment
+        self.stopping = threading.Event()
+        self.returncode: Optional[int] = None
+        self.exited = threading.Event()
+        self.thread = threading.Thread(target=self.generate, name="segment-generator",
+                                       daemon=True)
+
+    def start(self) -> "SegmentGenerator":
+        self.thread.start()
+        return self
+
+    def generate(self):
+        try:
+            created = time.time()
+            while not self.stopping.is_set():
+                if self.until is not None and created >= self.until:
+                    # done for the day, idle like a camera pointed at an empty room
+                    self.stopping.wait()
+                    break
+                self.stopping.wait(max(0.0, created + self.interval - time.time()))
+                closed = time.time()
+                self.write(created, closed - created)
+                created = closed
+            self.returncode = 0
+        except Exception:
+            _log().error("segment generator failed", exc_info=True)
+            self.returncode = 1
+        self.exited.set()
+
+    def write(self, created: float, duration: float):
+        number = 0
+        while pathlib.Path(str(self.location) % number).exists():
+            number += 1
+        path = pathlib.Path(str(self.location) % number)
+        write_mp4(path, datetime.datetime.fromtimestamp(created, datetime.timezone.utc),
+                  duration, self.size, self.width, self.height)
+        if self.on_segment is not None:
+            self.on_segment(processed_name(created), time.time())
+
+    def poll(self) -> Optional[int]:
+        return self.returncode if self.exited.is_set() else None
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[int]:
+        self.exited.wait(timeout)
+        return self.poll()
+
+    def send_signal(self, signum: int):
+        self.stopping.set()
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+# ------------------------------------------------------------------------------
+# Object store: the subset of a boto3 s3 client Spaces uses
+# ------------------------------------------------------------------------------
+class Uplink():
+    """A link of fixed bandwidth, shared by every transfer on it"""
+    def __init__(self, bytes_per_second: Optional[float]):
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        self.free_at = 0.0
+
+    def send(self, nbytes: int):
+        """Block until `nbytes` went through behind everything already queued"""
+        if not self.bytes_per_second:
+            return
+        with self.lock:
+            start = max(time.time(), self.free_at)
+            self.free_at = start + nbytes / self.bytes_per_second
+            done = self.free_at
+        time.sleep(max(0.0, done - time.time()))
+
+
+class LocalObjectStore():
+    """Keeps uploads under `directory`/bucket/key, or only counts them"""
+    def __init__(self, directory: pathlib.Path, uplink: Uplink, keep: bool = False):
+        self.directory = directory
+        self.uplink = uplink
+        self.keep = keep
+        self.lock = threading.Lock()
+        # (key, bytes, time.time() it finished)
+        self.uploads: List[Tuple[str, int, float]] = []
+
+    def upload_file(self, filename: str, bucket: str, key: str, Config=None, Callback=None):
+        with open(filename, "rb") as f:
+            self.upload_fileobj(f, bucket, key, Config=Config, Callback=Callback)
+
+    def upload_fileobj(self, fileobj: BinaryIO, bucket: str, key: str, Config=None,
+                       Callback=None):
+        path = self.directory / bucket / key
+        out: Optional[BinaryIO] = None
+        if self.keep:
+            path.parent.mkdir(exist_ok=True, parents=True)
+            out = path.with_name(path.name + ".part").open("wb")
+        nbytes = 0
+        try:
+            chunk = fileobj.read(CHUNK_SIZE)
+            while chunk:
+                self.uplink.send(len(chunk))
+                if out is not None:
+                    out.write(chunk)
+                if Callback is not None:
+                    Callback(len(chunk))
+                nbytes += len(chunk)
+                chunk = fileobj.read(CHUNK_SIZE)
+        finally:
+            if out is not None:
+                out.close()
+        if out is not None:
+            os.replace(out.name, path)
+        with self.lock:
+            self.uploads.append((key, nbytes, time.time()))
+
+    def snapshot(self) -> List[Tuple[str, int, float]]:
+        with self.lock:
+            return list(self.uploads)
+
+
+# ------------------------------------------------------------------------------
+# Controller
+# ------------------------------------------------------------------------------
+class SimulatedConfiguration(Configuration):
+    def refresh_devices(self):
+        # the fake devices never come and go
+        pass
+
+
+def fake_devices(cameras: int) -> List[DeviceComplex]:
+    return [
+        DeviceComplex(
+            CameraDevice(f"Simulated Camera {number}", f"/dev/video{number}", ""),
+            MicrophoneDevice(f"Simulated Microphone {number}", f"hw:{number}", 2),
+            False, False, number)
+        for number in range(cameras)]
+
+
+@dataclass
+class Simulation:
+    directory: pathlib.Path
+    clock: SimulationClock
+    # all in simulated time
+    hours: float = 24
+    segment_seconds: float = 60
+    poll_seconds: float = 10
+    segment_bytes: int = 2 * MB
+    uplink_bytes_per_second: Optional[float] = None
+    cameras: int = 2
+    keep_objects: bool = False
+    # processed directory name -> time.time() the segment was closed
+    segments: Dict[str, float] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __post_init__(self):
+        if self.clock.real(self.segment_seconds) < 1:
+            raise ValueError(
+                f"speed {self.clock.speed} is above the segment length of {self.segment_seconds}"
+                " seconds, mp4 creation times would collide")
+        self.recording_end = self.clock.start + self.clock.real(self.hours * 3600)
+        # a simulated second of uplink goes by in 1 / speed real seconds
+        rate = self.uplink_bytes_per_second
+        self.store = LocalObjectStore(
+            self.directory / "objects", Uplink(rate and rate * self.clock.speed),
+            keep=self.keep_objects)
+
+    def configuration(self) -> Configuration:
+        return SimulatedConfiguration(
+            user_config={"participant_id": "simulation"},
+            primary_device_name="Simulated Camera 0",
+            devices=fake_devices(self.cameras),
+            output_directory=self.directory / "beholder-data",
+            observation_id="simulation",
+            pipeline_profile="software",
+            segment_time_seconds=self.clock.real(self.segment_seconds),
+            restart_seconds=0,
+            poll_seconds=max(0.1, self.clock.real(self.poll_seconds)),
+            schedule_socket=self.directory / "schedule.sock",
+            metrics_path=self.directory / "metrics.prom")
+
+    def segment_closed(self, name: str, closed: float):
+        with self.lock:
+            self.segments[name] = closed
+
+    def closed(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(self.segments)
+
+    def video_uploads(self) -> Dict[str, float]:
+        """processed directory name -> time.time() its video finished uploading"""
+        return {
+            key.split("/")[-2]: finished
+            for key, _, finished in self.store.snapshot() if key.endswith(".mp4.enc")}
+
+
+class SimulatedController(Controller):
+    def __init__(self, simulation: Simulation, verbose=None):
+        self.simulation = simulation
+        self.stopped = False
+        super().__init__(simulation.directory, simulation.directory, verbose=verbose)
+        self.running = threading.Thread(target=self.run, name="controller", daemon=True)
+
+    def load_configuration(self, config_path: pathlib.Path) -> Configuration:
+        return self.simulation.configuration()
+
+    def load_credentials(self, credentials_path: pathlib.Path) -> Credentials:
+        return Credentials(None, Spaces(self.simulation.store, "simulation"))
+
+    def config_usb_listener(self):
+        pass
+
+    def spawn_record(self) -> Optional[RecordProcess]:
+        if self.stopped:
+            return None
+        width, height = self.config.layout().width, self.config.layout().height
+        _log().info("simulating gstreamer, a segment every %.2f seconds",
+                    self.config.segment_time_seconds)
+        return SegmentGenerator(  # type: ignore
+            self.config.out_location, self.config.segment_time_seconds,
+            self.simulation.segment_bytes, width, height, until=self.simulation.recording_end,
+            on_segment=self.simulation.segment_closed).start()
+
+    def start(self):
+        self.running.start()
+
+    def stop(self, timeout: float = 5):
+        """shutdown without killing the process"""
+        self.stopped = True
+        self.stop_record()
+        if self.record_process is not None:
+            self.record_process.wait(timeout)
+        # the last segment is not processed anymore
+        if self.segment_watcher is not None:
+            self.segment_watcher.stop()
+            self.segment_watcher.thread.join(timeout)
+        self.wakeup.set(WAKE_SHUTDOWN)
+        if self.running.is_alive():
+            self.running.join(timeout)
+        self.supervisor.stop()
+        self.stop_computer_vision()
+
+
+# ------------------------------------------------------------------------------
+# Running it
+# ------------------------------------------------------------------------------
+@dataclass
+class SimulationReport:
+    speed: float
+    real_seconds: float
+    segments: int
+    uploaded: int
+    uploaded_bytes: int
+    # simulated seconds from a segment being closed to its video being uploaded
+    latencies: List[float]
+    max_backlog: int
+    # simulated seconds from the end of recording to the last upload, None if it never drained
+    drain_seconds: Optional[float]
+
+    def display(self):
+        print(f"simulated {self.real_seconds * self.speed / 3600:.1f} hours"
+              f" in {self.real_seconds:.0f} seconds ({self.speed:g}x)")
+        print(f"  segments  {self.uploaded} of {self.segments} uploaded,"
+              f" {self.uploaded_bytes / MB:.1f} MB")
+        if self.latencies:
+            median, p95 = np.percentile(self.latencies, [50, 95])
+            print(f"  latency   median {median:.0f} s, p95 {p95:.0f} s,"
+                  f" max {max(self.latencies):.0f} s")
+        print(f"  backlog   at most {self.max_backlog} segments")
+        if self.drain_seconds is None:
+            print("  drained   no")
+        else:
+            print(f"  drained   {self.drain_seconds:.0f} s after recording stopped")
+
+
+def simulate(simulation: Simulation, drain_hours: float = 24,
+             sample_seconds: float = 60) -> SimulationReport:
+    """Record for `simulation.hours`, then wait up to `drain_hours` for the uploads to finish"""
+    clock = simulation.clock
+    controller = SimulatedController(simulation)
+    controller.start()
+    max_backlog = 0
+    deadline = simulation.recording_end + clock.real(drain_hours * 3600)
+    drained: Optional[float] = None
+    try:
+        while time.time() < deadline:
+            if not controller.running.is_alive():
+                _log().error("the controller stopped, ending the simulation")
+                break
+            closed, uploaded = simulation.closed(), simulation.video_uploads()
+            max_backlog = max(max_backlog, len(closed.keys() - uploaded.keys()))
+            # the last segment started before the end is closed after it
+            recorded = any(at >= simulation.recording_end for at in closed.values())
+            if recorded and closed.keys() <= uploaded.keys():
+                drained = max(uploaded.values(), default=simulation.recording_end)
+                break
+            clock.sleep(sample_seconds)
+    finally:
+        controller.stop()
+    closed, uploaded = simulation.closed(), simulation.video_uploads()
+    return SimulationReport(
+        speed=clock.speed,
+        real_seconds=time.time() - clock.start,
+        segments=len(closed),
+        uploaded=len(uploaded.keys() & closed.keys()),
+        uploaded_bytes=sum(nbytes for _, nbytes, _ in simulation.store.snapshot()),
+        latencies=[
+            clock.simulated(uploaded[name] - closed[name]) for name in uploaded if name in closed],
+        max_backlog=max_backlog,
+        drain_seconds=None if drained is None else clock.simulated(
+            max(0.0, drained - simulation.recording_end)))
+
+
+@click.command()
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--speed", default=60.0, help="simulated seconds per real second")
+@click.option("--hours", default=24.0, help="simulated hours of recording")
+@click.option("--drain-hours", default=24.0, help="how long to wait for the backlog after")
+@click.option("--segment-seconds", default=60.0)
+@click.option("--segment-mb", default=2.0, help="size of every segment")
+@click.option("--uplink-mbps", default=0.0, help="simulated upload bandwidth, 0 is unlimited")
+@click.option("--cameras", default=2)
+@click.option("--keep-objects/--discard-objects", default=False,
+              help="keep a copy of every upload under DIRECTORY/objects")
+def main(directory, speed, hours, drain_hours, segment_seconds, segment_mb, uplink_mbps,
+         cameras, keep_objects):
+    directory = pathlib.Path(directory).resolve()
+    directory.mkdir(exist_ok=True, parents=True)
+    # logs/ is relative, like on the device
+    os.chdir(directory)
+    pathlib.Path("logs").mkdir(exist_ok=True)
+    setup_logging("INFO", "logs/log", 0)
+    try:
+        simulation = Simulation(
+            directory, SimulationClock(speed), hours=hours, segment_seconds=segment_seconds,
+            segment_bytes=int(segment_mb * MB),
+            uplink_bytes_per_second=uplink_mbps * 1e6 / 8 if uplink_mbps else None,
+            cameras=cameras, keep_objects=keep_objects)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    simulate(simulation, drain_hours).display()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,191 @@
 import configparser
 import pathlib
+import threading
+import time
 
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor as Pool
+from concurrent.futures import as_completed
+from dataclasses import dataclass
+from typing import IO, Callable, Iterable, Iterator, Optional, Tuple, TypeVar, Union
 
 import boto3  # type: ignore
 import botocore # type: ignore
+from boto3.s3.transfer import TransferConfig  # type: ignore
+from botocore.config import Config as ClientConfig  # type: ignore
 
 from .utils import _log, pathify
 
+MB = 2**20
+
+T = TypeVar("T")
+
+@dataclass
+class TransferSettings:
+    # number of files in flight at once
+    parallel_uploads: int = 4
+    # files larger than this are uploaded as multipart uploads
+    multipart_threshold_mb: int = 8
+    multipart_chunksize_mb: int = 8
+    # number of parts of a single file in flight at once
+    part_concurrency: int = 4
+    max_pool_connections: int = 16
+
+    @property
+    def transfer_config(self) -> TransferConfig:
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold_mb * MB,
+            multipart_chunksize=self.multipart_chunksize_mb * MB,
+            max_concurrency=self.part_concurrency,
+            use_threads=self.part_concurrency > 1)
+
+    @property
+    def client_config(self) -> ClientConfig:
+        # every part of every parallel file needs its own connection, otherwise
+        # urllib3 discards connections and we pay for a new TLS handshake
+        pool_size = max(self.max_pool_connections,
+                        self.parallel_uploads * self.part_concurrency)
+        return ClientConfig(
+            max_pool_connections=pool_size,
+            retries={"max_attempts": 5, "mode": "standard"})
+
+    @staticmethod
+    def from_parser(parser: configparser.ConfigParser, section="spaces") -> "TransferSettings":
+        defaults = TransferSettings()
+        return TransferSettings(
+            parallel_uploads=parser.getint(
+                section, "parallel_uploads", fallback=defaults.parallel_uploads),
+            multipart_threshold_mb=parser.getint(
+                section, "multipart_threshold_mb", fallback=defaults.multipart_threshold_mb),
+            multipart_chunksize_mb=parser.getint(
+                section, "multipart_chunksize_mb", fallback=defaults.multipart_chunksize_mb),
+            part_concurrency=parser.getint(
+                section, "part_concurrency", fallback=defaults.part_concurrency),
+            max_pool_connections=parser.getint(
+                section, "max_pool_connections", fallback=defaults.max_pool_connections))
+
+
+class TransferStats:
+    """Running totals of everything pushed through a Spaces client"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def record(self, nbytes: int, seconds: float):
+        with self.lock:
+            self.files += 1
+            self.bytes += nbytes
+            self.seconds += seconds
+
+    def snapshot(self) -> Tuple[int, int, float]:
+        with self.lock:
+            return self.files, self.bytes, self.seconds
+
+
 class Spaces():
-    def __init__(self, client: botocore.client, bucket: str):
+    def __init__(self, client: botocore.client, bucket: str,
+                 settings: Optional[TransferSettings] = None):
         self.client = client
         self.bucket = bucket
+        if settings is None:
+            settings = TransferSettings()
+        self.settings = settings
+        self.transfer_config = settings.transfer_config
+        self.pool = Pool(max_workers=settings.parallel_uploads,
+                         thread_name_prefix="spaces-upload")
+        self.stats = TransferStats()
 
     def upload(self, path: pathlib.Path, key: str) -> bool:
         if path.exists():
             _log().debug("uploading %s to bucket=%s key=%s", path, self.bucket, key)
-            self.client.upload_file(str(path), self.bucket, key)
+            nbytes = path.stat().st_size
+            start = time.time()
+            self.client.upload_file(str(path), self.bucket, key, Config=self.transfer_config)
+            seconds = time.time() - start
+            self.stats.record(nbytes, seconds)
+            _log().debug("uploaded %s %.1f MB in %.2f seconds (%.2f MB/s)",
+                         key, nbytes / MB, seconds, throughput(nbytes, seconds))
             return True
         return False
 
+    def upload_stream(self, fileobj: IO[bytes], key: str) -> int:
+        """Upload a non-seekable stream as it is produced, returns the number of bytes sent"""
+        _log().debug("streaming to bucket=%s key=%s", self.bucket, key)
+        counter = ByteCounter()
+        start = time.time()
+        self.client.upload_fileobj(fileobj, self.bucket, key,
+                                   Config=self.transfer_config, Callback=counter)
+        seconds = time.time() - start
+        self.stats.record(counter.bytes, seconds)
+        _log().debug("streamed %s %.1f MB in %.2f seconds (%.2f MB/s)",
+                     key, counter.bytes / MB, seconds, throughput(counter.bytes, seconds))
+        return counter.bytes
+
+    def map(self, jobs: Iterable[Callable[[], T]]) -> Iterator[T]:
+        """Run jobs on the bounded upload pool, yielding results as they complete
+
+        A job that raises is logged and left out, the rest of the batch goes on.
+        """
+        futures = [self.pool.submit(job) for job in jobs]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception:
+                _log().error("upload job failed", exc_info=True)
+                continue
+            yield result
+
     @staticmethod
     def from_file(filename: Union[pathlib.Path, str], section="spaces") -> "Spaces":
-        client = spaces_connect(filename, section)
+        settings = get_transfer_settings(filename, section)
+        client = spaces_connect(filename, section, settings)
         bucket = get_spaces_bucket(filename, section)
-        return Spaces(client, bucket)
+        return Spaces(client, bucket, settings)
+
+
+class ByteCounter:
+    """boto3 progress callback, called from the transfer threads"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes = 0
+
+    def __call__(self, nbytes: int):
+        with self.lock:
+            self.bytes += nbytes
+
 
-def spaces_connect(filename: Union[pathlib.Path, str], section="spaces"):
+def throughput(nbytes: int, seconds: float) -> float:
+    """MB/s"""
+    return nbytes / MB / seconds if seconds > 0 else 0.0
+
+
+def spaces_connect(filename: Union[pathlib.Path, str], section="spaces",
+                   settings: Optional[TransferSettings] = None):
     _keys = {"region_name", "api_version", "use_ssl", "verify",
              "endpoint_url", "aws_access_key_id", "aws_secret_access_key",
-             "aws_session_token", "config"}
+             "aws_session_token"}
     parser = configparser.ConfigParser()
     parser.read(pathify(filename))
 
     session = boto3.session.Session()
     if parser.has_section(section):
         cfg = {k: v for k, v in parser.items(section) if k in _keys}
+        if settings is None:
+            settings = TransferSettings.from_parser(parser, section)
         _log().info("connected to spaces")
-        return session.client("s3", **cfg)
+        return session.client("s3", config=settings.client_config, **cfg)
     else:
         raise Exception(f"Section {section} not found in {str(filename)}")
 
 
+def get_transfer_settings(filename: Union[pathlib.Path, str],
+                          section="spaces") -> TransferSettings:
+    parser = configparser.ConfigParser()
+    parser.read(pathify(filename))
+    return TransferSettings.from_parser(parser, section)
+
+
 def get_spaces_bucket(filename: Union[pathlib.Path, str], section="spaces") -> str:
     parser = configparser.ConfigParser()
     parser.read(pathify(filename))
@@ -0,0 +1,166 @@
+import datetime
+import pathlib
+import shutil
+import threading
+
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import psutil # type: ignore
+
+from .interval import IntervalCollection
+from .metrics import EVICTED_BYTES
+from .utils import _log
+from .work_queue import (
+    STAGE_ENCRYPTED, STAGE_PROCESSED, STAGE_RECORDED, Segment, WorkQueue)
+
+# ------------------------------------------------------------------------------
+# Eviction policies
+#   oldest          -> delete the oldest local videos first
+#   blackout_first  -> delete videos inside a blackout first, their keys are
+#                      never released so the uploaded copy is unreadable anyway,
+#                      then fall back to the oldest
+# only videos that are not uploaded yet are evicted, uploaded segments are
+# just a tiny key waiting out purgatory
+# ------------------------------------------------------------------------------
+EVICT_OLDEST = "oldest"
+EVICT_BLACKOUT_FIRST = "blackout_first"
+EVICTION_POLICIES = [EVICT_OLDEST, EVICT_BLACKOUT_FIRST]
+EVICTION_BATCH = 64
+
+GB = 2**30
+
+
+@dataclass
+class DiskUsage:
+    total: int
+    used: int
+
+    @property
+    def fraction(self) -> float:
+        return self.used / self.total if self.total else 1.0
+
+
+def disk_usage(path: pathlib.Path) -> DiskUsage:
+    usage = psutil.disk_usage(str(path))
+    return DiskUsage(usage.total, usage.used)
+
+
+def directory_bytes(directory: pathlib.Path, pattern: str = "*") -> int:
+    total = 0
+    for path in directory.glob(pattern):
+        try:
+            total += path.stat().st_size
+        except OSError:
+            pass
+    return total
+
+
+class StorageManager:
+    """Keeps the disk between the low and high watermarks by evicting local videos
+
+    Bytes held by each segment stage come from the work queue, which updates them
+    as segments move. The flat recording, detection and log directories are
+    summed directly since they only ever hold a handful of files.
+    """
+    def __init__(self, work_queue: WorkQueue, observation_directory: pathlib.Path,
+                 log_directory: pathlib.Path, high_watermark: float = 0.90,
+                 low_watermark: float = 0.80, policy: str = EVICT_OLDEST,
+                 usage: Callable[[pathlib.Path], DiskUsage] = disk_usage):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"unknown eviction policy {policy}")
+        if not 0 < low_watermark <= high_watermark <= 1:
+            raise ValueError("watermarks must satisfy 0 < low <= high <= 1")
+        self.work_queue = work_queue
+        self.observation_directory = observation_directory
+        self.log_directory = log_directory
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policy = policy
+        self.usage = usage
+        self.lock = threading.Lock()
+        self.evicted_segments = 0
+        self.evicted_bytes = 0
+
+    def stage_bytes(self) -> Dict[str, int]:
+        stages = self.work_queue.stage_bytes()
+        # the queue only sees recordings once gstreamer closes them
+        stages[STAGE_RECORDED] = directory_bytes(
+            self.observation_directory / "recording", "*.mp4")
+        stages["detections"] = directory_bytes(self.observation_directory / "detections", "*/*")
+        stages["logs"] = directory_bytes(self.log_directory, "log*")
+        return stages
+
+    def headroom(self) -> int:
+        """Bytes left before the high watermark, negative once past it"""
+        usage = self.usage(self.observation_directory)
+        return int(self.high_watermark * usage.total) - usage.used
+
+    def enforce(self, interval_collection: Optional[IntervalCollection] = None) -> int:
+        """Evict down to the low watermark once past the high one, returns the headroom"""
+        with self.lock:
+            usage = self.usage(self.observation_directory)
+            if usage.fraction < self.high_watermark:
+                return int(self.high_watermark * usage.total) - usage.used
+            target = int(self.low_watermark * usage.total)
+            _log().warning("disk %.1f%% full, evicting down to %.0f%%",
+                           100 * usage.fraction, 100 * self.low_watermark)
+            freed = self.evict(usage.used - target, interval_collection)
+            used = usage.used - freed
+            _log().warning("evicted %.2f GB, %s", freed / GB, self.describe())
+            return int(self.high_watermark * usage.total) - used
+
+    def evict(self, nbytes: int,
+              interval_collection: Optional[IntervalCollection] = None) -> int:
+        freed = 0
+        while freed < nbytes:
+            candidates = self.candidates(interval_collection)
+            evicted = 0
+            for segment in candidates:
+                if freed + evicted >= nbytes:
+                    self.work_queue.release(segment)
+                else:
+                    evicted += self.evict_segment(segment)
+            freed += evicted
+            if evicted == 0:
+                _log().error("nothing left to evict, %.2f GB short", (nbytes - freed) / GB)
+                break
+        return freed
+
+    def candidates(self, interval_collection: Optional[IntervalCollection]) -> List[Segment]:
+        if self.policy == EVICT_BLACKOUT_FIRST and interval_collection is not None:
+            # every candidate at once, it is the only way to find the blacked out ones
+            segments = self.oldest(-1)
+            blacked_out = interval_collection.points_overlap(
+                [segment.created or datetime.datetime.min for segment in segments])
+            return (
+                [s for s, overlaps in zip(segments, blacked_out) if overlaps] +
+                [s for s, overlaps in zip(segments, blacked_out) if not overlaps])
+        return self.oldest(EVICTION_BATCH)
+
+    def oldest(self, limit: int) -> List[Segment]:
+        segments = (
+            self.work_queue.oldest(STAGE_PROCESSED, limit) +
+            self.work_queue.oldest(STAGE_ENCRYPTED, limit))
+        segments.sort(key=lambda segment: segment.created or datetime.datetime.min)
+        return segments
+
+    def evict_segment(self, segment: Segment) -> int:
+        directory = segment.directory
+        nbytes = directory_bytes(directory)
+        try:
+            shutil.rmtree(directory)
+        except OSError:
+            _log().error("could not evict %s", directory, exc_info=True)
+            self.work_queue.release(segment)
+            return 0
+        self.work_queue.finish(segment)
+        self.evicted_segments += 1
+        self.evicted_bytes += nbytes
+        EVICTED_BYTES.inc(nbytes)
+        _log().info("evicted %s (%.1f MB)", directory, nbytes / 2**20)
+        return nbytes
+
+    def describe(self) -> str:
+        stages = self.stage_bytes()
+        return ", ".join(f"{stage} {nbytes / GB:.2f} GB" for stage, nbytes in stages.items())
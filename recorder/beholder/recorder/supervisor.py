@@ -0,0 +1,127 @@
+import threading
+import time
+
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import JOB_FAILURES, JOB_QUEUE_DEPTH, JOB_SECONDS
+from .utils import _log
+
+# ------------------------------------------------------------------------------
+# Background jobs of the controller (processing, uploading, computer vision).
+# Every job has one worker thread of its own, so a job never runs twice at
+# once. Kicking a job while it runs queues exactly one more run: work that
+# showed up meanwhile gets picked up, and kicks never pile up. A job that
+# raises runs again after a backoff that doubles with every failure in a row.
+# ------------------------------------------------------------------------------
+MIN_BACKOFF_SECONDS = 1
+MAX_BACKOFF_SECONDS = 300
+
+
+class Job():
+    def __init__(self, name: str, target: Callable[[], Any],
+                 on_result: Optional[Callable[[Any], None]] = None,
+                 min_backoff: float = MIN_BACKOFF_SECONDS,
+                 max_backoff: float = MAX_BACKOFF_SECONDS):
+        self.name = name
+        self.target = target
+        self.on_result = on_result
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.condition = threading.Condition()
+        self.pending = False
+        self.running = False
+        self.stopped = False
+        # failures in a row, and time.monotonic() before which it may not run again
+        self.failures = 0
+        self.not_before = 0.0
+        self.thread = threading.Thread(target=self.work, name=f"{name}-worker", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def kick(self):
+        with self.condition:
+            self.pending = True
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def depth(self) -> int:
+        """Runs in flight and queued, never more than two"""
+        with self.condition:
+            return int(self.running) + int(self.pending)
+
+    def backoff(self) -> float:
+        return min(self.max_backoff, self.min_backoff * 2**(self.failures - 1))
+
+    def next_run(self) -> bool:
+        """Wait for a kick and the end of any backoff, False once stopped"""
+        with self.condition:
+            while not self.stopped:
+                wait = self.not_before - time.monotonic()
+                if self.pending and wait <= 0:
+                    self.pending = False
+                    self.running = True
+                    return True
+                self.condition.wait(wait if self.pending else None)
+            return False
+
+    def work(self):
+        while self.next_run():
+            start = time.monotonic()
+            try:
+                result = self.target()
+            except Exception:
+                JOB_FAILURES.inc(job=self.name)
+                with self.condition:
+                    self.failures += 1
+                    backoff = self.backoff()
+                    self.not_before = time.monotonic() + backoff
+                    # the crashed run's work is still there
+                    self.pending = True
+                _log().error("%s job failed, running it again in %.0f seconds", self.name,
+                             backoff, exc_info=True)
+            else:
+                self.failures = 0
+                self.report(result)
+            finally:
+                JOB_SECONDS.observe(time.monotonic() - start, job=self.name)
+                with self.condition:
+                    self.running = False
+
+    def report(self, result: Any):
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(result)
+        except Exception:
+            _log().error("%s job result callback failed", self.name, exc_info=True)
+
+
+class Supervisor():
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+
+    def add(self, name: str, target: Callable[[], Any],
+            on_result: Optional[Callable[[Any], None]] = None, **backoff: float) -> Job:
+        job = Job(name, target, on_result, **backoff)
+        self.jobs[name] = job
+        job.start()
+        return job
+
+    def kick(self, name: str):
+        self.jobs[name].kick()
+
+    def depth(self, name: str) -> int:
+        return self.jobs[name].depth()
+
+    def stop(self):
+        for job in self.jobs.values():
+            job.stop()
+
+    def collect_metrics(self):
+        for name, job in self.jobs.items():
+            JOB_QUEUE_DEPTH.set(job.depth(), job=name)
@@ -1,15 +1,24 @@
 import datetime
+import functools
 import pathlib
 import shutil
 import time
 
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 from .configuration import Configuration
-from .crypto import generate_random_key, encrypt_file
+from .crypto import EncryptingReader, generate_random_key
 from .interval import IntervalCollection
-from .spaces import Spaces
+from .metrics import ENCRYPT_BYTES, ENCRYPT_SECONDS, UPLOAD_BYTES, UPLOAD_FAILURES, UPLOAD_SECONDS
+from .spaces import MB, Spaces, throughput
 from .utils import _log
+from .work_queue import (
+    STAGE_ENCRYPTED, STAGE_PROCESSED, STAGE_UPLOADED, Segment, WorkQueue, to_timestamp, utcnow)
+
+UPLOAD_OLDEST = "oldest"
+UPLOAD_MOST_ACTIVE = "most_active"
+UPLOAD_THRESHOLD = "threshold"
+UPLOAD_POLICIES = [UPLOAD_OLDEST, UPLOAD_MOST_ACTIVE, UPLOAD_THRESHOLD]
 
 def get_raw_video_path_parts(raw_video_path: pathlib.Path) -> Dict[str, str]:
     parts = raw_video_path.parts
@@ -21,79 +30,222 @@ def get_raw_video_path_parts(raw_video_path: pathlib.Path) -> Dict[str, str]:
     }
 
 
-def upload_all(config: Configuration, spaces_client: Spaces,
+def upload_all(config: Configuration, spaces_client: Optional[Spaces], work_queue: WorkQueue,
                interval_collection: Optional[IntervalCollection] = None):
-    _log().info("starting upload")
     uploads = {
         "videos": 0,
         "keys": 0,
         "detections": 0,
         "logs": 0,
     }
-    for key_path in config.observation_directory.glob("**/processed/**/*.key"):
-        uploads["keys"] += upload_key(config, key_path, spaces_client, interval_collection)
-    for video_path in config.observation_directory.glob("**/processed/**/*.mp4"):
-        uploads["videos"] += upload_video(config, video_path, spaces_client)
-    for det_path in config.observation_directory.glob("**/detections/**/log.*"):
-        uploads["detections"] += upload_detections(config, det_path, spaces_client)
+    if spaces_client is None:
+        # before claiming anything, the segments stay queued for when credentials are back
+        _log().warning("no spaces credentials, not uploading")
+        return uploads
+    # a bad policy would only show once every segment is claimed
+    check_upload_policy(config.upload_policy)
+    _log().info("starting upload")
+    jobs: List[Tuple[str, Callable[[], int]]] = []
+    keys = dated(work_queue, take_all(work_queue, STAGE_UPLOADED))
+    for segment, overlaps in zip(keys, blackout_overlaps(interval_collection, keys)):
+        jobs.append(("keys", claimed(work_queue, segment, functools.partial(
+            upload_key, config, work_queue, segment, spaces_client, overlaps))))
+    # the pool starts jobs in order, so the policy decides which videos get out first
+    for segment in prioritize(config, work_queue, take_all(work_queue, STAGE_ENCRYPTED)):
+        jobs.append(("videos", claimed(work_queue, segment, functools.partial(
+            upload_encrypted_video, config, work_queue, segment, spaces_client))))
+    for segment in prioritize(config, work_queue, take_all(work_queue, STAGE_PROCESSED)):
+        jobs.append(("videos", claimed(work_queue, segment, functools.partial(
+            upload_video, config, work_queue, segment, spaces_client))))
+    for det_path in (config.observation_directory / "detections").glob("*/*.npz"):
+        jobs.append(("detections", functools.partial(
+            upload_detections, config, det_path, spaces_client)))
     for logs in pathlib.Path(".").glob("logs/log.*"):
-        uploads["logs"] += upload_logs(config, logs, spaces_client)
-    for processed in config.observation_directory.glob("**/processed/*"):
-        clean_directories(processed)
+        jobs.append(("logs", functools.partial(
+            upload_logs, config, logs, spaces_client)))
+
+    # transfers are io bound, so run them side by side on the client's bounded pool
+    start = time.time()
+    files_before, bytes_before, _ = spaces_client.stats.snapshot()
+    for kind, count in spaces_client.map(tagged(kind, job) for kind, job in jobs):
+        uploads[kind] += count
+    files_after, bytes_after, _ = spaces_client.stats.snapshot()
+    seconds = time.time() - start
+    nbytes = bytes_after - bytes_before
+    _log().info("uploaded %d files %.1f MB in %.1f seconds (%.2f MB/s aggregate)",
+                files_after - files_before, nbytes / MB, seconds, throughput(nbytes, seconds))
     return uploads
 
-def upload_video(config: Configuration, video_path: pathlib.Path, spaces_client: Spaces) -> int:
+
+def take_all(work_queue: WorkQueue, stage: str) -> List[Segment]:
+    segments = []
+    segment = work_queue.take(stage)
+    while segment is not None:
+        segments.append(segment)
+        segment = work_queue.take(stage)
+    return segments
+
+
+def check_upload_policy(policy: str):
+    if policy not in UPLOAD_POLICIES:
+        raise ValueError(f"unknown upload policy {policy}, expected one of {UPLOAD_POLICIES}")
+
+
+def prioritize(config: Configuration, work_queue: WorkQueue, segments: List[Segment],
+               now: Optional[float] = None) -> List[Segment]:
+    """Videos in upload order, without the ones the upload policy holds back for now"""
+    check_upload_policy(config.upload_policy)
+    now = time.time() if now is None else now
+    segments = sorted(segments, key=lambda segment: (
+        segment.created or datetime.datetime.min, segment.id))
+    if config.upload_policy == UPLOAD_OLDEST:
+        return segments
+    scores = {
+        segment.id: work_queue.score(segment, config.segment_time_seconds)
+        for segment in segments}
+    if config.upload_policy == UPLOAD_MOST_ACTIVE:
+        # segments without a score yet go after the scored ones
+        return sorted(segments, key=lambda segment: (
+            scores[segment.id] is None, -(scores[segment.id] or 0)))
+    ready = []
+    delay = config.quiet_delay_hours * 3600
+    for segment in segments:
+        score = scores[segment.id]
+        if score is not None and score < config.activity_threshold and segment.created:
+            until = to_timestamp(segment.created) + delay
+            if until > now:
+                work_queue.defer(segment, until)
+                continue
+        ready.append(segment)
+    return ready
+
+
+def tagged(kind: str, job: Callable[[], int]) -> Callable[[], Tuple[str, int]]:
+    return lambda: (kind, job())
+
+
+def claimed(work_queue: WorkQueue, segment: Segment,
+            job: Callable[[], int]) -> Callable[[], int]:
+    """A job on a claimed segment that gives the segment back if it raises"""
+    def run() -> int:
+        try:
+            return job()
+        except Exception:
+            work_queue.retry_later(segment)
+            raise
+    return run
+
+
+def segment_key_suffix(path: pathlib.Path) -> str:
+    return (
+        f"{path.parent.parent.parent.name}/"        # observation_id
+        f"{path.parent.parent.name}/"               # processed
+        f"{path.parent.name}/"                      # time
+        f"{path.name}")                             # file
+
+
+def upload_video(config: Configuration, work_queue: WorkQueue, segment: Segment,
+                 spaces_client: Spaces) -> int:
+    video_path = segment.path
+    if not video_path.exists():
+        work_queue.finish(segment)
+        return 0
     # generate key
     key_name = f"{video_path.name}.key"
     key_path = video_path.parent / key_name
-    if (generate_random_key(key_path) != 0): return 0
-    # encrypt file
-    output_video_path = video_path.parent / f"{video_path.name}.enc"
-    if (encrypt_file(video_path, key_path, output_video_path) == 0):
-        # upload if was able to encrypt...otherwise, just delete
-        key_suffix = (
-            f"{output_video_path.parent.parent.parent.name}/"        # observation_id
-            f"{output_video_path.parent.parent.name}/"               # processed
-            f"{output_video_path.parent.name}/"                      # time
-            f"{output_video_path.name}")                             # file
-        try:
-            upload(config, spaces_client, output_video_path, key_suffix)
-            output_video_path.unlink(missing_ok=True)
-            video_path.unlink(missing_ok=True)
-        except Exception:
-            pass
-    # delete
-    else:
+    if (generate_random_key(key_path) != 0):
+        work_queue.retry_later(segment)
+        return 0
+    # encrypt while uploading, so the plaintext is read once and nothing is written
+    output_key_suffix = segment_key_suffix(video_path.parent / f"{video_path.name}.enc")
+    with EncryptingReader(video_path, key_path) as encrypted:
+        uploaded = upload_stream(config, spaces_client, encrypted, output_key_suffix)
+    ENCRYPT_SECONDS.observe(encrypted.seconds)
+    ENCRYPT_BYTES.inc(encrypted.bytes_in)
+    if uploaded:
+        video_path.unlink(missing_ok=True)
+        work_queue.advance(segment, STAGE_UPLOADED, key_path,
+                           not_before=purgatory_end(config, segment, 1))
+        return 1
+    work_queue.retry_later(segment)
+    return 0
+
+
+def upload_encrypted_video(config: Configuration, work_queue: WorkQueue, segment: Segment,
+                           spaces_client: Spaces) -> int:
+    # left behind by the openssl based encryption, upload as is
+    output_video_path = segment.path
+    video_path = output_video_path.with_suffix("")
+    key_path = video_path.parent / f"{video_path.name}.key"
+    if upload(config, spaces_client, output_video_path, segment_key_suffix(output_video_path),
+              "videos"):
         output_video_path.unlink(missing_ok=True)
         video_path.unlink(missing_ok=True)
-    return 1
+        work_queue.advance(segment, STAGE_UPLOADED, key_path,
+                           not_before=purgatory_end(config, segment, 1))
+        return 1
+    work_queue.retry_later(segment)
+    return 0
 
 
-def upload_key(config: Configuration, key_path: pathlib.Path, spaces_client: Spaces,
-               interval_collection: Optional[IntervalCollection]) -> int:
-    key_suffix = (
-        f"{key_path.parent.parent.parent.name}/"        # observation_id
-        f"{key_path.parent.parent.name}/"               # processed
-        f"{key_path.parent.name}/"                      # time
-        f"{key_path.name}")                             # file
-    file_create_time = datetime.datetime.strptime(key_path.parent.name, "%Y_%m_%d_%H_%M_%S_%f")
+def purgatory_end(config: Configuration, segment: Segment, multiple: float) -> float:
+    if segment.created is None:
+        return 0
+    end = segment.created + datetime.timedelta(hours=multiple * config.purgatory_hours)
+    return to_timestamp(end)
+
+
+def segment_create_time(path: pathlib.Path) -> datetime.datetime:
+    return datetime.datetime.strptime(path.parent.name, "%Y_%m_%d_%H_%M_%S_%f")
+
+
+def dated(work_queue: WorkQueue, segments: List[Segment]) -> List[Segment]:
+    """The segments whose directory name says when they were recorded, the others go back"""
+    parsed = []
+    for segment in segments:
+        try:
+            segment_create_time(segment.path)
+        except ValueError:
+            _log().error("can't tell when %s was recorded", segment.path, exc_info=True)
+            work_queue.retry_later(segment)
+            continue
+        parsed.append(segment)
+    return parsed
 
-    overlaps = interval_collection is not None and\
-        interval_collection.point_overlaps(file_create_time)
 
-    now = datetime.datetime.now()
+def blackout_overlaps(interval_collection: Optional[IntervalCollection],
+                      segments: List[Segment]) -> List[bool]:
+    if interval_collection is None:
+        return [False] * len(segments)
+    return interval_collection.points_overlap(
+        [segment_create_time(segment.path) for segment in segments])
+
+
+def upload_key(config: Configuration, work_queue: WorkQueue, segment: Segment,
+               spaces_client: Spaces, overlaps: bool) -> int:
+    key_path = segment.path
+    file_create_time = segment_create_time(key_path)
+
+    now = utcnow()
     diff = (now - file_create_time).total_seconds() / 60 / 60
     if overlaps:
         if 2 * config.purgatory_hours < diff:
-            shutil.rmtree(key_path)
+            key_path.unlink(missing_ok=True)
+            clean_directories(key_path.parent)
+            work_queue.finish(segment)
+        else:
+            work_queue.defer(segment, purgatory_end(config, segment, 2))
     else:
         if config.purgatory_hours < diff:
-            try:
-                upload(config, spaces_client, key_path, key_suffix)
+            if upload(config, spaces_client, key_path, segment_key_suffix(key_path), "keys"):
                 key_path.unlink()
+                clean_directories(key_path.parent)
+                work_queue.finish(segment)
                 return 1
-            except Exception:
-                _log.error("Fatal error in main loop", exc_info=True)
+            work_queue.retry_later(segment)
+        else:
+            # a blackout may still be added during purgatory, so check again then
+            work_queue.defer(segment, purgatory_end(config, segment, 1))
     return 0
 
 
@@ -103,7 +255,9 @@ def upload_detections(config: Configuration, det_path: pathlib.Path, spaces_clie
         f"{det_path.parent.parent.name}/"               # detections
         f"{det_path.parent.name}/"                      # detection type
         f"{det_path.name}")                             # name
-    upload(config, spaces_client, det_path, key_suffix)
+    # the only copy, keep it for the next upload if this one fails
+    if not upload(config, spaces_client, det_path, key_suffix, "detections"):
+        return 0
     det_path.unlink(missing_ok=True)
     return 1
 
@@ -113,7 +267,9 @@ def upload_logs(config: Configuration, log_path: pathlib.Path, spaces_client: Sp
         f"{config.observation_directory.name}/"  # observation_id
         "logs/"                                  # logs
         f"{log_path.name}")                      # name
-    upload(config, spaces_client, log_path, key_suffix)
+    # the only copy, keep it for the next upload if this one fails
+    if not upload(config, spaces_client, log_path, key_suffix, "logs"):
+        return 0
     log_path.unlink(missing_ok=True)
     return 1
 
@@ -121,19 +277,48 @@ def upload_logs(config: Configuration, log_path: pathlib.Path, spaces_client: Sp
 def upload(config: Configuration,
            spaces_client: Spaces,
            upload_path: pathlib.Path,
-           key_suffix: str):
+           key_suffix: str,
+           kind: str = "videos") -> bool:
     key = f"{config.spaces_root_key}/{key_suffix}"
     try:
+        nbytes = upload_path.stat().st_size
         start = time.time()
         spaces_client.upload(upload_path, key)
         end = time.time()
         seconds = end - start
-        _log().info("uploaded %s->%s in %d seconds", upload_path, key_suffix, seconds)
+        UPLOAD_SECONDS.observe(seconds, kind=kind)
+        UPLOAD_BYTES.inc(nbytes, kind=kind)
+        _log().info("uploaded %s->%s in %d seconds (%.2f MB/s)",
+                    upload_path, key_suffix, seconds, throughput(nbytes, seconds))
+        return True
     except Exception:
+        UPLOAD_FAILURES.inc(kind=kind)
         _log().error("failed to uploaded %s->%s", upload_path, key_suffix, exc_info=True)
+        return False
+
+
+def upload_stream(config: Configuration,
+                  spaces_client: Spaces,
+                  stream: EncryptingReader,
+                  key_suffix: str) -> bool:
+    key = f"{config.spaces_root_key}/{key_suffix}"
+    try:
+        start = time.time()
+        nbytes = spaces_client.upload_stream(stream, key)
+        end = time.time()
+        seconds = end - start
+        UPLOAD_SECONDS.observe(seconds, kind="videos")
+        UPLOAD_BYTES.inc(nbytes, kind="videos")
+        _log().info("uploaded %s->%s in %d seconds (%.2f MB/s)",
+                    stream.source.name, key_suffix, seconds, throughput(nbytes, seconds))
+        return True
+    except Exception:
+        UPLOAD_FAILURES.inc(kind="videos")
+        _log().error("failed to uploaded %s->%s", stream.source.name, key_suffix, exc_info=True)
+        return False
 
 
 def clean_directories(path):
     _log().info("%s", list(path.glob("./*")))
-    if len(list(path.glob("./*"))) == 0:
+    if path.exists() and len(list(path.glob("./*"))) == 0:
         shutil.rmtree(path)
@@ -1,7 +1,14 @@
+import atexit
 import configparser
+import gzip
 import logging
 import logging.handlers
+import os
 import pathlib
+import queue
+import shutil
+import sys
+import threading
 
 from typing import Callable, Optional, Union
 
@@ -10,35 +17,107 @@ import psycopg2 # type: ignore
 from beholder.recorder import _log  # type: ignore
 
 
-class BackcallerTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
-    def __init__(self, filename, when='h', interval=1, backupCount=0,
-                 encoding=None, delay=False, utc=False, atTime=None, callback=Callable[[], None]):
-        super(BackcallerTimedRotatingFileHandler, self).__init__(
-            filename, when, interval, backupCount,
-            encoding, delay, utc, atTime
-        )
+# ------------------------------------------------------------------------------
+# Logging: callers only ever put records on a queue. A listener thread writes
+# them to an hourly rotated file, and rotation only renames the old hour out of
+# the way. LogShipper compresses it on a thread of its own and then tells the
+# callback, the controller's upload, which sends everything in logs/log.*
+# ------------------------------------------------------------------------------
+# rotated, not yet compressed, hidden from the uploader's logs/log.* glob
+STAGING_PREFIX = "."
+
+
+class LogShipper:
+    """Compresses rotated log files and hands them on, off the logging path"""
+    def __init__(self, directory: pathlib.Path, callback: Optional[Callable[[], None]] = None):
+        self.directory = directory
         self.callback = callback
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self.rotated: "queue.SimpleQueue[Optional[pathlib.Path]]" = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name="log-shipper", daemon=True)
+
+    def start(self):
+        # whatever was rotated but not compressed before a restart
+        for path in sorted(self.directory.glob(f"{STAGING_PREFIX}*")):
+            if not path.name.endswith(".tmp"):
+                self.rotated.put(path)
+        self.thread.start()
+
+    def stop(self):
+        if self.listener is not None:
+            # writes out everything still queued
+            self.listener.stop()
+            self.listener = None
+        self.rotated.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            path = self.rotated.get()
+            if path is None:
+                return
+            try:
+                compress(path, path.with_name(path.name[len(STAGING_PREFIX):] + ".gz"))
+            except OSError as e:
+                # logging about logging would end up right back here
+                print(f"could not compress {path}: {e}", file=sys.stderr)
+                continue
+            if self.callback is not None:
+                try:
+                    self.callback()
+                except Exception as e:
+                    print(f"log shipping callback failed: {e!r}", file=sys.stderr)
+
+
+def compress(source: pathlib.Path, destination: pathlib.Path):
+    tmp = destination.with_name(f"{STAGING_PREFIX}{destination.name}.tmp")
+    with source.open("rb") as f, gzip.open(tmp, "wb") as out:
+        shutil.copyfileobj(f, out)
+    os.replace(tmp, destination)
+    source.unlink()
+
+
+class ShippingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Rotates by renaming to a staging name and leaves the rest to a LogShipper"""
+    def __init__(self, filename, shipper: LogShipper, when="h", interval=1, backupCount=0,
+                 encoding=None, delay=False, utc=False, atTime=None):
+        super().__init__(filename, when, interval, backupCount, encoding, delay, utc, atTime)
+        self.shipper = shipper
+        self.namer = self.staging_name
+        self.rotator = self.rotate
+
+    @staticmethod
+    def staging_name(default_name: str) -> str:
+        path = pathlib.Path(default_name)
+        return str(path.with_name(f"{STAGING_PREFIX}{path.name}"))
 
-    def doRollover(self):
-        # invoke the superclass' actual rotation implementation
-        super(BackcallerTimedRotatingFileHandler, self).doRollover()
-        self.callback()
+    def rotate(self, source: str, dest: str):
+        if os.path.exists(source):
+            os.rename(source, dest)
+            self.shipper.rotated.put(pathlib.Path(dest))
 
 
-def setup_logging(log_level, log_path, log_backup) -> BackcallerTimedRotatingFileHandler:
+def setup_logging(log_level, log_path, log_backup) -> LogShipper:
     root = _log()
     formatter = logging.Formatter(
         "[%(asctime)s %(process)d] [%(name)s] [%(levelname)s] %(message)s"
     )
-    handler = BackcallerTimedRotatingFileHandler(
-        log_path, when="h", interval=1, backupCount=log_backup
+    shipper = LogShipper(pathlib.Path(log_path).parent)
+    handler = ShippingFileHandler(
+        log_path, shipper, when="h", interval=1, backupCount=log_backup
     )
     handler.setFormatter(formatter)
-    root.addHandler(handler)
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    shipper.listener = logging.handlers.QueueListener(
+        log_queue, handler, respect_handler_level=True)
+    shipper.listener.start()
+    shipper.start()
+    atexit.register(shipper.stop)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
     root.propagate = True
     root.setLevel(log_level)
 
-    return handler
+    return shipper
 
 
 def pathify(str_or_path: Union[str, pathlib.Path]) -> pathlib.Path:
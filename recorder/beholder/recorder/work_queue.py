@@ -0,0 +1,318 @@
+import datetime
+import pathlib
+import shutil
+import sqlite3
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Union
+
+from .utils import _log
+
+# ------------------------------------------------------------------------------
+# Segment lifecycle
+#   recorded  -> recording/outputNNNNNNN.mp4, still owned by gstreamer
+#   processed -> processed/<create time>/video.mp4
+#   encrypted -> processed/<create time>/video.mp4.enc, only written by the
+#                openssl based crypto.encrypt_file, uploads normally stream
+#                the ciphertext and go straight to uploaded
+#   uploaded  -> processed/<create time>/video.mp4.key, waiting out purgatory
+# once the key is released (or deleted because of a blackout) the segment is
+# removed from the queue.
+#
+# Next to the segments sits the activity index: computer vision reports the
+# share of analysed frames with motion per window of wall time, and a segment's
+# activity score is the share over the windows its recording overlaps.
+# ------------------------------------------------------------------------------
+STAGE_RECORDED = "recorded"
+STAGE_PROCESSED = "processed"
+STAGE_ENCRYPTED = "encrypted"
+STAGE_UPLOADED = "uploaded"
+STAGES = [STAGE_RECORDED, STAGE_PROCESSED, STAGE_ENCRYPTED, STAGE_UPLOADED]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segment (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    stage TEXT NOT NULL,
+    created REAL,
+    not_before REAL NOT NULL DEFAULT 0,
+    claimed INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    activity REAL
+);
+CREATE INDEX IF NOT EXISTS segment_ready ON segment (stage, claimed, not_before, id);
+CREATE INDEX IF NOT EXISTS segment_created ON segment (stage, created);
+CREATE TABLE IF NOT EXISTS activity (
+    window REAL NOT NULL,
+    seconds REAL NOT NULL,
+    frames INTEGER NOT NULL,
+    motion_frames INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS activity_window ON activity (window);
+"""
+SEGMENT_COLUMNS = "id, path, stage, created, attempts, size, activity"
+# long enough for any backlog to drain
+ACTIVITY_RETENTION_SECONDS = 30 * 24 * 3600
+# a failed segment waits a minute, twice as long with every failure after, up to ~an hour
+RETRY_SECONDS = 60
+MAX_RETRY_DOUBLINGS = 6
+
+@dataclass
+class Segment:
+    id: int
+    path: pathlib.Path
+    stage: str
+    created: Optional[datetime.datetime]
+    attempts: int
+    size: int = 0
+    # share of frames with motion, None until scored
+    activity: Optional[float] = None
+
+    @property
+    def directory(self) -> pathlib.Path:
+        return self.path.parent
+
+
+class WorkQueue:
+    """Durable queue of segments, one row per segment, keyed by its current file.
+
+    Workers `take` the oldest ready segment of a stage, which claims it until it
+    is advanced, deferred, or finished. Claims do not survive a restart.
+    The bytes held by each stage are kept up to date as segments move.
+    """
+    def __init__(self, path: Union[str, pathlib.Path]):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(segment)")]
+        if columns and "size" not in columns:
+            self.conn.execute("ALTER TABLE segment ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+        if columns and "activity" not in columns:
+            self.conn.execute("ALTER TABLE segment ADD COLUMN activity REAL")
+        self.conn.executescript(SCHEMA)
+        self.bytes = {stage: 0 for stage in STAGES}
+        for stage, size in self.conn.execute(
+                "SELECT stage, TOTAL(size) FROM segment GROUP BY stage"):
+            self.bytes[stage] = int(size)
+
+    def add(self, path: pathlib.Path, stage: str = STAGE_RECORDED,
+            created: Optional[datetime.datetime] = None, not_before: float = 0,
+            size: Optional[int] = None) -> bool:
+        size = file_size(path) if size is None else size
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO segment (path, stage, created, not_before, size)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (str(path), stage, to_timestamp(created), not_before, size))
+            if cur.rowcount > 0:
+                self.bytes[stage] += size
+            return cur.rowcount > 0
+
+    def take(self, stage: str, now: Optional[float] = None) -> Optional[Segment]:
+        now = time.time() if now is None else now
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                f"SELECT {SEGMENT_COLUMNS} FROM segment"
+                " WHERE stage = ? AND claimed = 0 AND not_before <= ?"
+                " ORDER BY not_before, id LIMIT 1",
+                (stage, now)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE segment SET claimed = 1 WHERE id = ?", (row[0],))
+        return to_segment(row)
+
+    def advance(self, segment: Segment, stage: str, path: Optional[pathlib.Path] = None,
+                created: Optional[datetime.datetime] = None, not_before: float = 0,
+                size: Optional[int] = None):
+        path = segment.path if path is None else path
+        created = segment.created if created is None else created
+        size = file_size(path) if size is None else size
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE segment SET stage = ?, path = ?, created = ?, not_before = ?,"
+                " claimed = 0, attempts = 0, size = ? WHERE id = ?",
+                (stage, str(path), to_timestamp(created), not_before, size, segment.id))
+            self.bytes[segment.stage] -= segment.size
+            self.bytes[stage] += size
+        segment.stage, segment.path, segment.created, segment.size = stage, path, created, size
+
+    def defer(self, segment: Segment, until: float, failed: bool = False):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE segment SET not_before = ?, claimed = 0, attempts = attempts + ?"
+                " WHERE id = ?",
+                (until, int(failed), segment.id))
+
+    def retry_later(self, segment: Segment, now: Optional[float] = None):
+        """Give a claimed segment back after a failure, to be taken again after a backoff"""
+        now = time.time() if now is None else now
+        backoff = RETRY_SECONDS * 2**min(segment.attempts, MAX_RETRY_DOUBLINGS)
+        self.defer(segment, now + backoff, failed=True)
+
+    def finish(self, segment: Segment):
+        with self.lock, self.conn:
+            cur = self.conn.execute("DELETE FROM segment WHERE id = ?", (segment.id,))
+            if cur.rowcount > 0:
+                self.bytes[segment.stage] -= segment.size
+
+    def oldest(self, stage: str, limit: int) -> List[Segment]:
+        """Unclaimed segments of a stage, oldest recording first. Claims them."""
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                f"SELECT {SEGMENT_COLUMNS} FROM segment"
+                " WHERE stage = ? AND claimed = 0 ORDER BY created LIMIT ?",
+                (stage, limit)).fetchall()
+            self.conn.executemany(
+                "UPDATE segment SET claimed = 1 WHERE id = ?", [(row[0],) for row in rows])
+        return [to_segment(row) for row in rows]
+
+    def release(self, segment: Segment):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE segment SET claimed = 0 WHERE id = ?", (segment.id,))
+
+    def stage_bytes(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.bytes)
+
+    # --------------------------------------------------------------------------
+    # Activity
+    # --------------------------------------------------------------------------
+    def record_activity(self, window: float, seconds: float, frames: int, motion_frames: int):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO activity (window, seconds, frames, motion_frames)"
+                " VALUES (?, ?, ?, ?)", (window, seconds, frames, motion_frames))
+            self.conn.execute(
+                "DELETE FROM activity WHERE window < ?", (window - ACTIVITY_RETENTION_SECONDS,))
+
+    def score(self, segment: Segment, duration: float) -> Optional[float]:
+        """The segment's activity, once computer vision has moved past its end
+
+        Stored with the segment the first time it can be worked out. None while
+        the windows it overlaps are still open, or when nothing was analysed.
+        """
+        if segment.activity is not None or segment.created is None:
+            return segment.activity
+        start = to_timestamp(segment.created)
+        end = start + duration
+        with self.lock, self.conn:
+            settled = self.conn.execute(
+                "SELECT 1 FROM activity WHERE window >= ? LIMIT 1", (end,)).fetchone()
+            if settled is None:
+                return None
+            rows = self.conn.execute(
+                "SELECT window, seconds, frames, motion_frames FROM activity"
+                " WHERE window < ? AND window + seconds > ?", (end, start)).fetchall()
+            # weigh each window by how much of it the segment covers
+            frames = motion_frames = 0.0
+            for window, seconds, window_frames, window_motion in rows:
+                overlap = (min(end, window + seconds) - max(start, window)) / seconds
+                frames += overlap * window_frames
+                motion_frames += overlap * window_motion
+            if not frames:
+                return None
+            activity = motion_frames / frames
+            self.conn.execute(
+                "UPDATE segment SET activity = ? WHERE id = ?", (activity, segment.id))
+        segment.activity = activity
+        return activity
+
+    def depth(self) -> Dict[str, int]:
+        depths = {stage: 0 for stage in STAGES}
+        with self.lock:
+            for stage, count in self.conn.execute(
+                    "SELECT stage, COUNT(*) FROM segment GROUP BY stage"):
+                depths[stage] = count
+        return depths
+
+    # --------------------------------------------------------------------------
+    # Crash Recovery: only ever run at startup
+    # --------------------------------------------------------------------------
+    def recover(self, observation_directory: pathlib.Path) -> int:
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE segment SET claimed = 0")
+            rows = self.conn.execute("SELECT id, path FROM segment").fetchall()
+            missing = [(_id,) for _id, path in rows if not pathlib.Path(path).exists()]
+            self.conn.executemany("DELETE FROM segment WHERE id = ?", missing)
+            for stage, size in self.conn.execute(
+                    "SELECT stage, TOTAL(size) FROM segment GROUP BY stage"):
+                self.bytes[stage] = int(size)
+        tracked: Set[pathlib.Path] = {
+            pathlib.Path(path) for _id, path in rows if pathlib.Path(path).exists()}
+        tracked_directories = {path.parent for path in tracked}
+
+        added = 0
+        for video_path in (observation_directory / "recording").glob("*.mp4"):
+            if video_path not in tracked:
+                added += self.add(video_path, STAGE_RECORDED)
+
+        for directory in (observation_directory / "processed").glob("*"):
+            if not directory.is_dir() or directory in tracked_directories:
+                continue
+            created = parse_directory_time(directory)
+            video = directory / "video.mp4"
+            encrypted = directory / "video.mp4.enc"
+            key = directory / "video.mp4.key"
+            if video.exists():
+                # an unfinished encryption, start over
+                encrypted.unlink(missing_ok=True)
+                added += self.add(video, STAGE_PROCESSED, created)
+            elif encrypted.exists():
+                added += self.add(encrypted, STAGE_ENCRYPTED, created)
+            elif key.exists():
+                added += self.add(key, STAGE_UPLOADED, created)
+            elif len(list(directory.iterdir())) == 0:
+                shutil.rmtree(directory)
+        _log().info("recovered %d segments (dropped %d missing)", added, len(missing))
+        return added
+
+
+def to_segment(row) -> Segment:
+    return Segment(
+        row[0], pathlib.Path(row[1]), row[2], from_timestamp(row[3]), row[4], row[5], row[6])
+
+
+def file_size(path: pathlib.Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def parse_directory_time(directory: pathlib.Path) -> Optional[datetime.datetime]:
+    try:
+        return datetime.datetime.strptime(directory.name, "%Y_%m_%d_%H_%M_%S_%f")
+    except ValueError:
+        return None
+
+
+# Segment.created is naive UTC, like the mp4 creation times and the processed
+# directory names. datetime treats naive values as local time, so convert explicitly.
+
+def to_utc(dt: datetime.datetime) -> datetime.datetime:
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def to_timestamp(dt: Optional[datetime.datetime]) -> Optional[float]:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+def from_timestamp(ts: Optional[float]) -> Optional[datetime.datetime]:
+    if ts is None:
+        return None
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(tzinfo=None)
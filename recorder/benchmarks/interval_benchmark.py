@@ -0,0 +1,70 @@
+"""Compare the bisecting IntervalCollection against the old linear scan.
+
+    python benchmarks/interval_benchmark.py --intervals 1000 --points 10000
+"""
+import datetime
+import random
+import timeit
+
+import click # type: ignore
+
+from beholder.recorder.interval import Interval, IntervalCollection
+
+class LinearIntervalCollection:
+    """The scan IntervalCollection used to do"""
+    def __init__(self, intervals):
+        self.intervals = intervals
+
+    def point_overlaps(self, date):
+        return any(interval.point_overlaps(date) for interval in self.intervals)
+
+
+def sqlite_rows(rng: random.Random, n: int):
+    base = datetime.datetime(2021, 9, 1)
+    rows = []
+    for _ in range(n):
+        start = base + datetime.timedelta(minutes=rng.randrange(0, 60 * 24 * 180))
+        end = start + datetime.timedelta(minutes=rng.randrange(5, 60 * 8))
+        rows.append((start.strftime("%Y-%m-%d %H:%M:%S.%f"), end.strftime("%Y-%m-%d %H:%M:%S.%f")))
+    return rows
+
+
+def strptime_interval(start: str, end: str) -> Interval:
+    fmt = "%Y-%m-%d %H:%M:%S.%f"
+    return Interval(datetime.datetime.strptime(start, fmt), datetime.datetime.strptime(end, fmt))
+
+
+@click.command()
+@click.option("--intervals", default=1000, type=int)
+@click.option("--points", default=10000, type=int)
+@click.option("--repeat", default=5, type=int)
+def main(intervals, points, repeat):
+    rng = random.Random(0)
+    rows = sqlite_rows(rng, intervals)
+    base = datetime.datetime(2021, 9, 1)
+    queries = [base + datetime.timedelta(minutes=rng.randrange(0, 60 * 24 * 180))
+               for _ in range(points)]
+
+    def best(stmt) -> float:
+        return min(timeit.repeat(stmt, number=1, repeat=repeat))
+
+    parsed = [Interval(*row) for row in rows]
+    linear = LinearIntervalCollection(parsed)
+    indexed = IntervalCollection(parsed)
+    assert [linear.point_overlaps(q) for q in queries] == indexed.points_overlap(queries)
+
+    results = [
+        ("parse (strptime)", best(lambda: [strptime_interval(*row) for row in rows])),
+        ("parse (fromisoformat)", best(lambda: [Interval(*row) for row in rows])),
+        ("build index", best(lambda: IntervalCollection(parsed))),
+        ("linear point_overlaps", best(lambda: [linear.point_overlaps(q) for q in queries])),
+        ("indexed point_overlaps", best(lambda: [indexed.point_overlaps(q) for q in queries])),
+        ("indexed points_overlap", best(lambda: indexed.points_overlap(queries))),
+    ]
+    print(f"{intervals} intervals, {points} points, best of {repeat}")
+    for name, seconds in results:
+        print(f"  {name:<24} {seconds * 1e3:10.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
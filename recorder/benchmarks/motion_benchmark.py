@@ -0,0 +1,104 @@
+"""Replay recordings through every motion detector backend, headless.
+
+    python benchmarks/motion_benchmark.py recordings/output0000001.mp4 ... --fps 5
+
+Frames are sampled at --fps and scaled to --resolution, the way the loopback
+branch of the pipeline hands them to computer vision. Reports detection speed
+per backend and how well it agrees with mog2, the reference: the fraction of
+frames where both agree on whether anything moved, and the mean overlap
+(intersection over union) of the boxes on frames where either saw motion.
+"""
+import time
+
+from typing import Dict, List, Sequence
+
+import click # type: ignore
+import cv2 # type: ignore
+import numpy as np # type: ignore
+
+from beholder.recorder.configuration import parse_resolution
+from beholder.recorder.motion import DETECTORS, BBox, Mog2Detector, get_detector
+
+REFERENCE = Mog2Detector.name
+# boxes are compared on a coarse grid, exact pixels do not matter
+MASK_SCALE = 8
+
+
+def box_mask(boxes: Sequence[BBox], height: int, width: int) -> np.ndarray:
+    mask = np.zeros((height // MASK_SCALE + 1, width // MASK_SCALE + 1), bool)
+    for x, y, w, h in boxes:
+        rows = slice(y // MASK_SCALE, (y + h) // MASK_SCALE + 1)
+        columns = slice(x // MASK_SCALE, (x + w) // MASK_SCALE + 1)
+        mask[rows, columns] = True
+    return mask
+
+
+class Tally():
+    def __init__(self):
+        self.seconds = 0.0
+        self.frames = 0
+        self.motion = 0
+        self.agree = 0
+        self.overlaps: List[float] = []
+
+    def add(self, seconds: float, boxes: Sequence[BBox], reference: Sequence[BBox],
+            height: int, width: int):
+        self.seconds += seconds
+        self.frames += 1
+        self.motion += bool(boxes)
+        self.agree += bool(boxes) == bool(reference)
+        if boxes or reference:
+            mine, theirs = box_mask(boxes, height, width), box_mask(reference, height, width)
+            self.overlaps.append((mine & theirs).sum() / (mine | theirs).sum())
+
+
+def sampled_frames(path: str, fps: float, width: int, height: int):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise click.ClickException(f"could not open {path}")
+    step = max(1, round((cap.get(cv2.CAP_PROP_FPS) or fps) / fps))
+    idx = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if idx % step == 0:
+            yield cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        idx += 1
+    cap.release()
+
+
+@click.command()
+@click.argument("videos", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--fps", default=5, type=float)
+@click.option("--resolution", default="640x480")
+@click.option("--detector", "names", multiple=True, type=click.Choice(list(DETECTORS)),
+              help="backends to run, all of them by default")
+def main(videos, fps, resolution, names):
+    width, height = parse_resolution(resolution)
+    names = [REFERENCE] + [name for name in names or DETECTORS if name != REFERENCE]
+    tallies: Dict[str, Tally] = {name: Tally() for name in names}
+
+    for video in videos:
+        # one background model per recording, as after a pipeline restart
+        detectors = {name: get_detector(name, height, width) for name in names}
+        for frame in sampled_frames(video, fps, width, height):
+            results = {}
+            for name, detector in detectors.items():
+                start = time.perf_counter()
+                results[name] = detector.motion_bboxes(frame)
+                seconds = time.perf_counter() - start
+                tallies[name].add(seconds, results[name], results[REFERENCE], height, width)
+
+    frames = tallies[REFERENCE].frames
+    print(f"{len(videos)} recordings, {frames} frames at {resolution} sampled at {fps} fps")
+    print(f"  {'detector':12} {'fps':>9} {'motion':>8} {'agree':>7} {'overlap':>8}")
+    for name, tally in tallies.items():
+        detect_fps = tally.frames / tally.seconds if tally.seconds else 0
+        agree = tally.agree / tally.frames if tally.frames else 0
+        overlap = float(np.mean(tally.overlaps)) if tally.overlaps else 1
+        print(f"  {name:12} {detect_fps:9.1f} {tally.motion:8d} {agree:7.1%} {overlap:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
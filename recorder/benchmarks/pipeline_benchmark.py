@@ -0,0 +1,102 @@
+"""Encode throughput of the recording pipeline with synthetic sources, no cameras needed.
+
+    python benchmarks/pipeline_benchmark.py --cameras 3 --resolution 1280x720 --fps 30 --seconds 60
+
+Reports encode fps, cpu per camera stream, segment write latency (how long
+after its last frame's running time a segment is closed) and dropped buffers.
+Needs the gstreamer python bindings (python3-gi) and the base/good/ugly plugins.
+"""
+import pathlib
+import signal
+import statistics
+import tempfile
+import time
+
+from typing import List
+
+import click # type: ignore
+import psutil # type: ignore
+
+from beholder.recorder import gst_pipeline
+from beholder.recorder.configuration import (
+    CameraDevice, Configuration, DeviceComplex, MicrophoneDevice)
+from beholder.recorder.gst_pipeline import (
+    EVENT_FRAGMENT_CLOSED, EVENT_FRAGMENT_OPENED, GstPipeline, PipelineEvent)
+from beholder.recorder.metrics import GST_DROPPED
+
+def devices(cameras: int) -> List[DeviceComplex]:
+    return [
+        DeviceComplex(
+            CameraDevice(f"test camera {idx}", f"test{idx}", ""),
+            MicrophoneDevice(f"test microphone {idx}", f"test{idx}", 1),
+            primary=idx == 0, loopback=False, number=idx)
+        for idx in range(cameras)]
+
+
+def dropped() -> float:
+    return sum(value for _name, _labels, value in GST_DROPPED.samples())
+
+
+@click.command()
+@click.option("--cameras", default=3, type=click.IntRange(1, 8))
+@click.option("--resolution", default="1280x720")
+@click.option("--fps", default=30, type=int)
+@click.option("--seconds", default=60, type=int)
+@click.option("--segment-seconds", default=10, type=int)
+@click.option("--profile", default="software")
+def main(cameras, resolution, fps, seconds, segment_seconds, profile):
+    if not gst_pipeline.available():
+        raise click.ClickException("gstreamer python bindings are not installed")
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        config = Configuration(
+            user_config={}, primary_device_name="test camera 0", devices=devices(cameras),
+            output_directory=pathlib.Path(tmpdirname), observation_id="benchmark",
+            record_fps=fps, output_fps=fps, primary_resolution=resolution,
+            secondary_resolution=resolution, segment_time_seconds=segment_seconds,
+            pipeline_profile=profile)
+        config.out_path.mkdir(parents=True)
+
+        latencies: List[float] = []
+        started = {}
+
+        def on_event(event: PipelineEvent):
+            running_time = event.details.get("running_time", 0) / 1e9
+            if event.kind == EVENT_FRAGMENT_OPENED and not started:
+                started["wall"] = time.monotonic() - running_time
+            elif event.kind == EVENT_FRAGMENT_CLOSED and started:
+                latencies.append(time.monotonic() - started["wall"] - running_time)
+
+        pipeline = GstPipeline(config.gstreamer_pipeline(), on_event)
+        frames = [0]
+
+        def count(pad, info):
+            frames[0] += 1
+            return gst_pipeline.Gst.PadProbeReturn.OK
+        encoder = pipeline.pipeline.get_by_name("enc")
+        encoder.get_static_pad("src").add_probe(gst_pipeline.Gst.PadProbeType.BUFFER, count)
+
+        process = psutil.Process()
+        dropped_before = dropped()
+        cpu_before = sum(process.cpu_times()[:2])
+        start = time.monotonic()
+        pipeline.start()
+        time.sleep(seconds)
+        pipeline.send_signal(signal.SIGINT)
+        pipeline.wait(30)
+        wall = time.monotonic() - start
+        cpu = sum(process.cpu_times()[:2]) - cpu_before
+        segments = len(list(config.out_path.glob("*.mp4")))
+
+    print(f"{profile} profile, {cameras} x {resolution} @ {fps} fps for {wall:.1f} seconds")
+    print(f"  encode fps        {frames[0] / wall:8.1f} (target {fps})")
+    print(f"  cpu per stream    {100 * cpu / wall / cameras:8.1f} %")
+    if latencies:
+        print(f"  segment latency   {statistics.median(latencies):8.3f} s median,"
+              f" {max(latencies):.3f} s max over {len(latencies)} segments")
+    print(f"  segments written  {segments:8d}")
+    print(f"  dropped buffers   {dropped() - dropped_before:8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Segments per second reading creation_time with ffprobe vs the in-process mp4 parser.
+
+    DATA=/srv/beholder_configuration/beholder-data
+    python benchmarks/probe_benchmark.py $DATA/*/processed/*/video.mp4
+"""
+import pathlib
+import time
+
+from typing import Callable, List
+
+import click # type: ignore
+
+from beholder.recorder.mp4 import read_info
+from beholder.recorder.process_recordings import get_create_time, probe_create_time
+
+def rate(paths: List[pathlib.Path], probe: Callable, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            probe(path)
+    return repeat * len(paths) / (time.perf_counter() - start)
+
+
+@click.command()
+@click.argument("videos", nargs=-1, type=click.Path(exists=True))
+@click.option("--repeat", default=3, type=int)
+def main(videos, repeat):
+    paths = [pathlib.Path(video) for video in videos]
+    mismatched = [
+        path for path in paths
+        if probe_create_time(path) != read_info(path).creation_time]
+    for path in mismatched:
+        print(f"creation_time differs for {path}")
+
+    ffprobe = rate(paths, probe_create_time, repeat)
+    parser = rate(paths, get_create_time, repeat)
+    print(f"{len(paths)} segments, {repeat} passes")
+    print(f"  ffprobe      {ffprobe:10.1f} segments/s")
+    print(f"  mp4 parser   {parser:10.1f} segments/s ({parser / ffprobe:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
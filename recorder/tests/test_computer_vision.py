@@ -0,0 +1,41 @@
+import uuid
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from beholder.recorder.computer_vision import CvStats, RingSource # noqa: E402
+from beholder.recorder.frame_ring import FrameRing # noqa: E402
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing.create(4, 6, 4, slots=4, name=f"beholder_test_{uuid.uuid4().hex[:8]}")
+    yield ring
+    ring.close()
+
+
+def test_ring_source_hands_out_the_newest_frame(ring):
+    source = RingSource(ring.name)
+    try:
+        assert source.next(0, timeout=0.01) is None
+        for value in range(1, 4):
+            ring.write(bytes([value]) * (4 * 6 * 4), timestamp=value)
+        frame = source.next(0, timeout=0.01)
+        assert frame.seq == 3 and frame.timestamp == 3
+        # BGRx comes out as BGR, copied out of the ring
+        assert frame.image.shape == (4, 6, 3) and frame.image.flags.owndata
+        assert (frame.image == 3).all()
+        assert source.next(3, timeout=0.01) is None
+    finally:
+        source.close()
+
+
+def test_stats():
+    stats = CvStats()
+    stats.frame(skipped=0, lag=0.1)
+    stats.frame(skipped=2, lag=0.2, tiles_skipped=1)
+    stats.fps(4.5)
+    assert stats.read() == {
+        "frames": 2, "skipped": 2, "fps": 4.5, "lag": 0.2, "tiles_skipped": 1}
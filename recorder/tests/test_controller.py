@@ -0,0 +1,232 @@
+import logging
+import signal
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+from beholder.recorder import controller as controller_module
+from beholder.recorder.configuration import Configuration
+from beholder.recorder.controller import (
+    JOB_COMPUTER_VISION, REPLUG_ADD, REPLUG_REMOVE, RESTART_RESPAWN, RESTART_SPLIT)
+from beholder.recorder.gst_pipeline import GstPipeline
+from beholder.recorder.metrics import REPLUG_RECOVERY, RESTART_GAP, RESTARTS
+from beholder.recorder.simulation import (
+    SegmentGenerator, SimulatedController, Simulation, SimulationClock, fake_devices)
+
+
+@pytest.fixture
+def controller(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    controller = SimulatedController(Simulation(tmp_path, SimulationClock(1), cameras=3))
+    controller.config.device_settle_seconds = 0.05
+    yield controller
+    controller.stop()
+
+
+def plug(controller, monkeypatch, cameras: int):
+    monkeypatch.setattr(controller.config, "refresh_devices",
+                        lambda: setattr(controller.config, "devices", fake_devices(cameras)))
+
+
+def udev(action: str, node: str):
+    return SimpleNamespace(action=action, subsystem="video4linux", device_node=node,
+                           device_path=f"/devices/usb{node}")
+
+
+def settle(controller):
+    time.sleep(controller.config.device_settle_seconds)
+    assert controller.devices_settled()
+    controller.replug()
+
+
+def test_unplugged_camera_is_left_out(controller, monkeypatch):
+    controller.record()
+    assert controller.is_recording()
+    plug(controller, monkeypatch, 2)
+    # a burst of events for one camera is handled once
+    controller.handle_usb(udev("remove", "/dev/video2"))
+    controller.handle_usb(udev("remove", "/dev/video3"))
+    assert not controller.devices_settled()
+    # and nothing starts on half enumerated devices
+    assert controller.apply_schedule(controller.last_restart)
+    settle(controller)
+    assert controller.replug_requested[0] == REPLUG_REMOVE
+    assert controller.record_process.wait(1) == 0
+
+    recoveries = REPLUG_RECOVERY.count(action=REPLUG_REMOVE)
+    controller.apply_schedule(controller.last_restart)
+    assert controller.is_recording()
+    assert len(controller.config.cameras) == 2
+    assert controller.replug_requested is None
+    assert REPLUG_RECOVERY.count(action=REPLUG_REMOVE) == recoveries + 1
+
+
+def test_returning_camera_is_added(controller, monkeypatch):
+    plug(controller, monkeypatch, 2)
+    controller.config.refresh_devices()
+    controller.record()
+    plug(controller, monkeypatch, 3)
+    controller.handle_usb(udev("add", "/dev/video2"))
+    settle(controller)
+    assert controller.replug_requested[0] == REPLUG_ADD
+    assert controller.record_stopping
+
+
+def test_replug_restarts_computer_vision(controller, monkeypatch):
+    kicks = []
+    process = SimpleNamespace(is_alive=lambda: True, terminate=lambda: kicks.append("terminate"),
+                              join=lambda timeout: None)
+    controller.config.loopback_enabled = True
+    controller.computer_vision_process = process
+    monkeypatch.setattr(controller.supervisor, "kick", kicks.append)
+    controller.record()
+    plug(controller, monkeypatch, 2)
+    controller.handle_usb(udev("remove", "/dev/video2"))
+    settle(controller)
+    # the detector's tiles were laid out for three cameras
+    assert kicks == ["terminate", JOB_COMPUTER_VISION]
+    assert controller.computer_vision_restarting
+
+
+def test_running_computer_vision_is_not_kicked_again(controller, monkeypatch):
+    kicks = []
+    monkeypatch.setattr(controller.supervisor, "kick", kicks.append)
+    controller.config.loopback_enabled = True
+    controller.start_computer_vision()
+    assert kicks == [JOB_COMPUTER_VISION]
+    # every poll of the control loop while the long-lived run is going
+    controller.computer_vision_job.running = True
+    controller.start_computer_vision()
+    controller.start_computer_vision()
+    assert kicks == [JOB_COMPUTER_VISION]
+    assert controller.computer_vision_job.depth() == 1
+
+
+def test_unrelated_events(controller, monkeypatch):
+    controller.record()
+    plug(controller, monkeypatch, 3)
+    controller.handle_usb(udev("add", "/dev/video9"))
+    settle(controller)
+    assert controller.replug_requested is None
+    assert controller.is_recording()
+
+
+def wait_for(condition, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_pipeline_dying_at_start_backs_off(controller, monkeypatch):
+    monkeypatch.setattr(controller_module, "RESPAWN_MIN_BACKOFF_SECONDS", 0.2)
+    monkeypatch.setattr(controller_module, "RESPAWN_QUICK_SECONDS", 0.5)
+    launches = []
+    dies = [True]
+
+    def spawn_record():
+        launches.append(time.monotonic())
+        generator = SegmentGenerator(controller.config.out_location, 60, 1024, 640, 480).start()
+        if dies[0]:
+            generator.send_signal(signal.SIGINT)
+        return generator
+
+    monkeypatch.setattr(controller, "spawn_record", spawn_record)
+    controller.apply_schedule(controller.last_restart)
+    wait_for(lambda: controller.quick_exits == 1)
+    # no tight loop of relaunches
+    controller.apply_schedule(controller.last_restart)
+    assert len(launches) == 1
+    assert 0 < controller.seconds_until_respawn() <= 0.2
+
+    wait_for(lambda: controller.seconds_until_respawn() is None)
+    controller.apply_schedule(controller.last_restart)
+    assert len(launches) == 2
+    wait_for(lambda: controller.quick_exits == 2)
+    assert 0.2 < controller.seconds_until_respawn() <= 0.4
+
+    # a pipeline that keeps running for a while resets the backoff
+    dies[0] = False
+    wait_for(lambda: controller.seconds_until_respawn() is None)
+    controller.apply_schedule(controller.last_restart)
+    assert controller.is_recording()
+    time.sleep(0.5)
+    controller.record_process.send_signal(signal.SIGINT)
+    wait_for(lambda: controller.quick_exits == 0)
+
+
+class SplittingPipeline(GstPipeline):
+    """An in-process pipeline that only knows how to split"""
+    def __init__(self, splits: bool):
+        self.splits = splits
+        self.split_calls = 0
+        self.signals = []
+
+    def split(self, name: str = "mux") -> bool:
+        self.split_calls += 1
+        return self.splits
+
+    def poll(self):
+        return None
+
+    def send_signal(self, sig):
+        self.signals.append(sig)
+
+    def wait(self, timeout=None):
+        return 0
+
+
+def test_split_restart_keeps_the_pipeline(controller):
+    controller.config.restart_mode = RESTART_SPLIT
+    pipeline = SplittingPipeline(splits=True)
+    controller.record_process = pipeline
+    splits = RESTARTS.value(mode=RESTART_SPLIT)
+    controller.restart_record()
+    assert pipeline.split_calls == 1
+    assert RESTARTS.value(mode=RESTART_SPLIT) == splits + 1
+    # nothing stopped, the next segment reports when the split is done
+    assert pipeline.signals == []
+    assert not controller.record_stopping
+    assert controller.restart_requested[0] == RESTART_SPLIT
+
+
+def test_split_restart_without_splitmuxsink_respawns(controller):
+    controller.config.restart_mode = RESTART_SPLIT
+    pipeline = SplittingPipeline(splits=False)
+    controller.record_process = pipeline
+    controller.restart_record()
+    assert pipeline.split_calls == 1
+    assert pipeline.signals == [signal.SIGINT]
+    assert controller.restart_requested[0] == RESTART_RESPAWN
+
+
+def test_split_restart_respawns_gst_launch(controller, caplog):
+    caplog.set_level(logging.DEBUG)
+    controller.config.restart_mode = RESTART_SPLIT
+    controller.record()
+    first = controller.record_process
+    assert controller.is_recording()
+    respawns = RESTARTS.value(mode=RESTART_RESPAWN)
+    gaps = RESTART_GAP.count(mode=RESTART_RESPAWN)
+
+    controller.restart_record()
+    assert "split restarts need gstreamer_in_process" in caplog.text
+    assert RESTARTS.value(mode=RESTART_RESPAWN) == respawns + 1
+    wait_for(lambda: first.poll() is not None)
+    controller.apply_schedule(controller.last_restart)
+    assert controller.record_process is not first
+    assert controller.is_recording()
+    # the gap is measured once the new gst-launch is up
+    assert RESTART_GAP.count(mode=RESTART_RESPAWN) == gaps + 1
+
+
+def test_split_without_in_process_pipeline_warns(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(Configuration, "refresh_devices", lambda self: None)
+    (tmp_path / "config.json").write_text('{"participant_id": "test"}')
+    ini = tmp_path / "beholder.ini"
+    ini.write_text(f"[beholder]\nprimary_device_name = C920\nuser_config = {tmp_path}\n"
+                   "restart_mode = split\ngstreamer_in_process = 0\n")
+    Configuration.from_file(ini)
+    assert "restart_mode = split needs gstreamer_in_process" in caplog.text
@@ -0,0 +1,69 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from beholder.recorder.detection_log import ( # noqa: E402
+    DetectionWriter, detection_chunks, load_chunk, read_detections)
+
+
+def test_chunks_follow_segment_windows(tmp_path):
+    windows = []
+    writer = DetectionWriter(
+        tmp_path, segment_seconds=60, capacity=2,
+        on_window=lambda *window: windows.append(window), writer="w")
+    writer.add(100.0, [(0, (1, 2, 3, 4)), (2, (5, 6, 7, 8))])
+    writer.add(110.5, [(1, (9, 10, 11, 12))])
+    writer.add(115.0, [])
+    assert list(tmp_path.iterdir()) == []
+    # crossing into the next window writes the previous one
+    writer.add(120.0, [(0, (0, 0, 10, 10))])
+    assert [path.name for path in tmp_path.iterdir()] == ["0000000060.w.npz"]
+    writer.tick(200.0)
+    writer.close()
+    # (window, seconds, frames, frames with motion)
+    assert windows == [(60, 60, 3, 2), (120, 60, 1, 1)]
+    assert [path.name for path in detection_chunks(tmp_path)] == [
+        "0000000060.w.npz", "0000000120.w.npz"]
+
+    rows = load_chunk(tmp_path / "0000000060.w.npz")
+    assert rows["timestamp"].tolist() == [100.0, 100.0, 110.5]
+    assert rows["camera"].tolist() == [0, 2, 1]
+    assert rows[1][["x", "y", "w", "h"]].tolist() == (5, 6, 7, 8)
+
+
+def test_same_window_after_restart(tmp_path):
+    names = []
+    for writer_id in ["100_7", "130_8"]:
+        writer = DetectionWriter(tmp_path, segment_seconds=60, writer=writer_id)
+        writer.add(61.0, [(0, (1, 1, 1, 1))])
+        writer.close()
+        assert len(read_detections(detection_chunks(tmp_path))) == 1
+        # uploaded and deleted, the next one still has to get a key of its own
+        [chunk] = tmp_path.iterdir()
+        names.append(chunk.name)
+        chunk.unlink()
+    assert names == ["0000000060.100_7.npz", "0000000060.130_8.npz"]
+
+
+def test_same_window_from_one_writer(tmp_path):
+    writer = DetectionWriter(tmp_path, segment_seconds=60)
+    for _ in range(2):
+        writer.add(61.0, [(0, (1, 1, 1, 1))])
+        writer.flush()
+    assert len(read_detections(detection_chunks(tmp_path))) == 2
+
+
+def test_read_detections(tmp_path):
+    writer = DetectionWriter(tmp_path, segment_seconds=10, writer="w")
+    for second in range(0, 40, 5):
+        writer.add(float(second), [(second % 2, (second, 0, 1, 1))])
+    writer.close()
+
+    chunks = detection_chunks(tmp_path, start=12, end=30)
+    assert [path.name for path in chunks] == [
+        "0000000010.w.npz", "0000000020.w.npz"]
+    rows = read_detections(chunks, start=12, end=30)
+    assert rows["timestamp"].tolist() == [15.0, 20.0, 25.0]
+    rows = read_detections(detection_chunks(tmp_path), camera=1)
+    assert rows["x"].tolist() == [5, 15, 25, 35]
+    assert len(read_detections([])) == 0
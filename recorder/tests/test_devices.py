@@ -0,0 +1,123 @@
+import pickle
+
+from types import SimpleNamespace
+
+import pytest
+
+from beholder.recorder import devices
+from beholder.recorder.configuration import Configuration
+from beholder.recorder.devices import (
+    KIND_CAMERA, KIND_LOOPBACK, CameraDevice, DeviceRegistry, pair_microphones)
+
+
+def microphone(name: str, card: int):
+    return {"name": f"{name}: USB Audio (hw:{card},0)", "max_input_channels": 1, "hostapi": 0}
+
+
+@pytest.fixture
+def hardware(monkeypatch):
+    """Two cameras with microphones and a loopback, counting every probe"""
+    state = SimpleNamespace(
+        nodes={
+            "/dev/video0": (KIND_CAMERA, CameraDevice("C920: C920", "/dev/video0", "")),
+            "/dev/video1": None,
+            "/dev/video2": (KIND_CAMERA, CameraDevice("C922: C922", "/dev/video2", "")),
+            "/dev/video10": (KIND_LOOPBACK, CameraDevice("loopback", "/dev/video10", "")),
+        },
+        microphones=[microphone("C922", 2), microphone("C920", 1)],
+        probes=[], queries=0)
+
+    def probe_node(node):
+        state.probes.append(node)
+        return state.nodes[node]
+
+    def get_microphones():
+        state.queries += 1
+        return list(state.microphones)
+
+    monkeypatch.setattr(devices, "video_nodes", lambda: list(state.nodes))
+    monkeypatch.setattr(devices, "probe_node", probe_node)
+    monkeypatch.setattr(devices, "get_microphones", get_microphones)
+    return state
+
+
+def event(action: str, subsystem: str, node=None):
+    return SimpleNamespace(action=action, subsystem=subsystem, device_node=node)
+
+
+def test_probes_once(hardware):
+    registry = DeviceRegistry()
+    joined = registry.devices()
+    assert [(device.camera.device, device.microphone and device.microphone.device)
+            for device in joined] == [
+        ("/dev/video0", "hw:1"), ("/dev/video2", "hw:2"), ("/dev/video10", None)]
+    assert [device.number for device in joined] == [0, 2, 10]
+    assert registry.devices() == joined
+    assert len(hardware.probes) == 4
+    assert hardware.queries == 1
+
+
+def test_only_the_changed_node_is_probed(hardware):
+    registry = DeviceRegistry()
+    registry.devices()
+    hardware.probes.clear()
+    del hardware.nodes["/dev/video2"]
+    registry.handle_event(event("remove", "video4linux", "/dev/video2"))
+    assert [device.camera.device for device in registry.devices()] == [
+        "/dev/video0", "/dev/video10"]
+    assert hardware.probes == []
+
+    hardware.nodes["/dev/video2"] = (KIND_CAMERA, CameraDevice("C922: C922", "/dev/video2", ""))
+    registry.handle_event(event("add", "video4linux", "/dev/video2"))
+    assert len(registry.devices()) == 3
+    assert hardware.probes == ["/dev/video2"]
+    assert hardware.queries == 1
+
+
+def test_numbers_survive_unplugging(hardware):
+    registry = DeviceRegistry()
+    registry.devices()
+    del hardware.nodes["/dev/video0"]
+    registry.handle_event(event("remove", "video4linux", "/dev/video0"))
+    # the camera that stays keeps its detection camera id and directory
+    assert [(device.camera.device, device.number) for device in registry.devices()] == [
+        ("/dev/video2", 2), ("/dev/video10", 10)]
+
+
+def test_sound_events_requery_microphones(hardware):
+    registry = DeviceRegistry()
+    registry.devices()
+    hardware.microphones = [microphone("C920", 1)]
+    registry.handle_event(event("remove", "sound"))
+    # the camera without its microphone is left out
+    assert [device.camera.device for device in registry.devices()] == [
+        "/dev/video0", "/dev/video10"]
+    assert hardware.queries == 2
+    assert len(hardware.probes) == 4
+
+
+def test_pair_microphones_by_card():
+    cameras = [CameraDevice(f"cam{idx}: cam{idx}", f"/dev/video{idx}", "") for idx in range(3)]
+    mics = [microphone("cam2", 2), microphone("USB cam0", 0)]
+    pairs = pair_microphones(cameras, mics)
+    assert [(camera.device, mic["name"]) for camera, mic in pairs] == [
+        ("/dev/video0", mics[1]["name"]), ("/dev/video2", mics[0]["name"])]
+
+
+def write_config(directory, extra: str = "") -> Configuration:
+    (directory / "config.json").write_text('{"participant_id": "test"}')
+    ini = directory / "beholder.ini"
+    ini.write_text(
+        f"[beholder]\nprimary_device_name = C920\nuser_config = {directory}\n{extra}")
+    return Configuration.from_file(ini)
+
+
+def test_configuration_pickles_without_registry(hardware, tmp_path):
+    config = write_config(tmp_path)
+    assert config.device_registry is not None
+    # computer vision is spawned with the configuration
+    copy = pickle.loads(pickle.dumps(config))
+    assert copy.device_registry is None
+    assert [device.camera.device for device in copy.devices] == [
+        device.camera.device for device in config.devices]
+    assert copy.primary_device.camera.device == "/dev/video0"
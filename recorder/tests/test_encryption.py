@@ -1,10 +1,13 @@
 import pytest
 
+import os
 import subprocess
 import pathlib
 import tempfile
 
-from beholder.recorder.crypto import decrypt_file, encrypt_file, generate_random_key
+from beholder.recorder.crypto import (
+    EncryptingReader, decrypt_file, encrypt_file, generate_random_key
+)
 
 def test_encryption(vpath: pathlib.Path):
     with tempfile.TemporaryDirectory() as tmpdirname:
@@ -16,3 +19,21 @@ def test_encryption(vpath: pathlib.Path):
         assert 0 == encrypt_file(vpath, key, enc)
         assert 0 == decrypt_file(enc, key, dec)
         assert subprocess.run(["cmp", "--silent", str(dec), str(vpath)])
+
+
+@pytest.mark.parametrize("size", [0, 15, 16, 4097])
+def test_streaming_encryption(size: int):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        key = tmpdirname / pathlib.Path("key")
+        plain = tmpdirname / pathlib.Path("plain")
+        enc = tmpdirname / pathlib.Path("test_enc")
+        dec = tmpdirname / pathlib.Path("test_dec")
+        plain.write_bytes(os.urandom(size))
+        assert 0 == generate_random_key(key)
+        with EncryptingReader(plain, key, chunk_size=1000) as reader, enc.open("wb") as f:
+            chunk = reader.read(100)
+            while chunk:
+                f.write(chunk)
+                chunk = reader.read(100)
+        assert 0 == decrypt_file(enc, key, dec)
+        assert dec.read_bytes() == plain.read_bytes()
@@ -0,0 +1,70 @@
+import threading
+import uuid
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from beholder.recorder.frame_ring import FrameRing # noqa: E402
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing.create(4, 6, 3, slots=4, name=f"beholder_test_{uuid.uuid4().hex[:8]}")
+    yield ring
+    ring.close()
+
+
+def image(value: int) -> bytes:
+    return bytes([value]) * (4 * 6 * 3)
+
+
+def test_empty(ring):
+    assert ring.latest() is None
+    assert ring.wait(0, timeout=0.01) is None
+
+
+def test_write_and_read_latest(ring):
+    reader = FrameRing.attach(ring.name)
+    try:
+        assert reader.shape == (4, 6, 3) and reader.slots == 4
+        for value in range(1, 7):
+            ring.write(image(value), timestamp=value)
+        frame = reader.latest()
+        assert frame.seq == 6 and frame.timestamp == 6
+        assert frame.image.shape == (4, 6, 3)
+        assert (frame.image == 6).all()
+        # a view into the ring, not a copy
+        assert not frame.image.flags.owndata
+    finally:
+        reader.close()
+
+
+def test_overwritten_frame_is_invalid(ring):
+    ring.write(image(1))
+    frame = ring.latest()
+    assert ring.valid(frame)
+    for value in range(2, 6):
+        ring.write(image(value))
+    # frame 5 reused frame 1's slot
+    assert not ring.valid(frame)
+
+
+def test_wait_for_next_frame(ring):
+    ring.write(image(1))
+    writer = threading.Timer(0.05, ring.write, args=(image(2),))
+    writer.start()
+    frame = ring.wait(1, timeout=2)
+    writer.join()
+    assert frame.seq == 2 and (frame.image == 2).all()
+
+
+def test_not_a_frame_ring():
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(create=True, size=128)
+    try:
+        with pytest.raises(ValueError):
+            FrameRing(shm, owner=False)
+    finally:
+        shm.close()
+        shm.unlink()
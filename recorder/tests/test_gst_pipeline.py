@@ -0,0 +1,31 @@
+import pathlib
+import signal
+import tempfile
+
+import pytest
+
+from beholder.recorder import gst_pipeline
+from beholder.recorder.gst_pipeline import EVENT_EOS, EVENT_FRAGMENT_CLOSED, GstPipeline
+
+pytestmark = pytest.mark.skipif(
+    not gst_pipeline.available(), reason="gstreamer python bindings are not installed")
+
+def test_eos_and_fragments():
+    events = []
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        location = pathlib.Path(tmpdirname) / "output%07d.mp4"
+        pipeline = GstPipeline(
+            "videotestsrc num-buffers=90 ! video/x-raw,framerate=30/1 ! x264enc ! h264parse"
+            f" ! splitmuxsink max-size-time=1000000000 location={location}",
+            events.append).start()
+        assert pipeline.wait(30) == 0
+    closed = [event.location.name for event in events if event.kind == EVENT_FRAGMENT_CLOSED]
+    assert closed == ["output0000000.mp4", "output0000001.mp4", "output0000002.mp4"]
+    assert events[-1].kind == EVENT_EOS
+
+
+def test_sigint_sends_eos():
+    pipeline = GstPipeline("videotestsrc is-live=true ! fakesink").start()
+    assert pipeline.poll() is None
+    pipeline.send_signal(signal.SIGINT)
+    assert pipeline.wait(10) == 0
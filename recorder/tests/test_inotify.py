@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from beholder.recorder.inotify import IN_CLOSE_WRITE, IN_Q_OVERFLOW, SegmentWatcher
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    closed = []
+    try:
+        watcher = SegmentWatcher(tmp_path, closed.append)
+    except (OSError, AttributeError):
+        pytest.skip("no inotify")
+    watcher.closed = closed
+    yield watcher
+    os.close(watcher.fd)
+
+
+def segment(directory, name: str, modified: int):
+    path = directory / name
+    path.touch()
+    os.utime(path, (modified, modified))
+    return path
+
+
+def test_overflow_rescans(watcher, tmp_path):
+    first = segment(tmp_path, "output0000001.mp4", 100)
+    second = segment(tmp_path, "output0000002.mp4", 200)
+    (tmp_path / "notes.txt").touch()
+    # the events for both were lost, the newest one may still be recorded to
+    watcher.handle(IN_Q_OVERFLOW, "")
+    assert watcher.closed == [first]
+    # the next segment closing means the writer is done with it
+    third = segment(tmp_path, "output0000003.mp4", 300)
+    watcher.handle(IN_CLOSE_WRITE, third.name)
+    assert watcher.closed == [first, second, third]
+    watcher.handle(IN_CLOSE_WRITE, "output0000004.mp4")
+    assert len(watcher.closed) == 4
+
+
+def test_overflow_while_the_newest_closes(watcher, tmp_path):
+    newest = segment(tmp_path, "output0000001.mp4", 100)
+    watcher.handle(IN_Q_OVERFLOW, "")
+    assert watcher.closed == []
+    watcher.handle(IN_CLOSE_WRITE, newest.name)
+    assert watcher.closed == [newest]
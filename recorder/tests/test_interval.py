@@ -0,0 +1,39 @@
+import datetime
+import random
+
+from beholder.recorder.interval import Interval, IntervalCollection, RecordTime, TimeInterval
+
+def random_intervals(rng: random.Random, n: int):
+    base = datetime.datetime(2021, 9, 1)
+    intervals = []
+    for _ in range(n):
+        start = base + datetime.timedelta(minutes=rng.randrange(0, 60 * 24 * 30))
+        end = start + datetime.timedelta(minutes=rng.randrange(0, 60 * 12))
+        intervals.append(Interval(start, end))
+    return intervals
+
+
+def test_index_matches_linear_scan():
+    rng = random.Random(0)
+    intervals = random_intervals(rng, 200)
+    collection = IntervalCollection(intervals)
+    base = datetime.datetime(2021, 9, 1)
+    points = [base + datetime.timedelta(minutes=rng.randrange(-60, 60 * 24 * 31))
+              for _ in range(2000)]
+    expected = [any(i.point_overlaps(p) for i in intervals) for p in points]
+    assert [collection.point_overlaps(p) for p in points] == expected
+    assert collection.points_overlap(points) == expected
+
+    for start, end in zip(points[::2], points[1::2]):
+        start, end = min(start, end), max(start, end)
+        assert collection.range_overlaps(start, end) == any(
+            i.start <= end and start <= i.end for i in intervals)
+
+
+def test_parses_sqlite_strings():
+    interval = Interval("2021-09-01 10:00:00.000000", "2021-09-01 11:30:00.500000")
+    assert interval.end == datetime.datetime(2021, 9, 1, 11, 30, 0, 500000)
+    night = TimeInterval("22:00:00.000000", "06:00:00.000000")
+    record_time = RecordTime([night])
+    times = [datetime.time(h) for h in range(24)]
+    assert record_time.points_overlap(times) == [night.point_overlaps(t) for t in times]
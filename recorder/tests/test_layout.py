@@ -0,0 +1,46 @@
+import pytest
+
+from beholder.recorder.layout import compute_layout
+
+def positions(layout):
+    return [(tile.x, tile.y, tile.width, tile.height) for tile in layout.tiles]
+
+
+def test_same_size_cameras():
+    two = compute_layout([(1280, 720)] * 2)
+    assert (two.width, two.height) == (1280, 1440)
+    assert two.unused == 0
+    four = compute_layout([(1280, 720)] * 4)
+    assert (four.width, four.height) == (2560, 1440)
+    # a single row would be 5120 wide
+    assert positions(four)[3] == (1280, 720, 1280, 720)
+
+
+def test_primary_and_secondary():
+    layout = compute_layout([(1920, 1080), (1280, 720), (1280, 720)])
+    assert (layout.width, layout.height) == (2560, 1800)
+    assert positions(layout) == [
+        (0, 0, 1920, 1080), (0, 1080, 1280, 720), (1280, 1080, 1280, 720)]
+    # the old fixed canvas for the same cameras
+    assert layout.area < 2 * 1920 * 2 * 1080
+
+
+def test_tiles_do_not_overlap():
+    sizes = [(1920, 1080), (640, 480), (1280, 720), (800, 600), (1280, 720)]
+    layout = compute_layout(sizes)
+    assert layout.width % 2 == 0 and layout.height % 2 == 0
+    for tile in layout.tiles:
+        assert (tile.width, tile.height) == sizes[tile.sink]
+        assert tile.x + tile.width <= layout.width and tile.y + tile.height <= layout.height
+    for a in layout.tiles:
+        for b in layout.tiles:
+            if a.sink < b.sink:
+                assert (a.x + a.width <= b.x or b.x + b.width <= a.x or
+                        a.y + a.height <= b.y or b.y + b.height <= a.y)
+
+
+def test_too_big():
+    with pytest.raises(ValueError):
+        compute_layout([(3840, 2160)] * 4)
+    with pytest.raises(ValueError):
+        compute_layout([])
@@ -0,0 +1,54 @@
+import gzip
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+from beholder.recorder.utils import LogShipper, ShippingFileHandler
+
+
+def test_rotated_logs_are_compressed_and_shipped(tmp_path):
+    shipped = threading.Event()
+    shipper = LogShipper(tmp_path, shipped.set)
+    handler = ShippingFileHandler(tmp_path / "log", shipper)
+    shipper.start()
+    logger = logging.getLogger("test_rotated_logs")
+    logger.addHandler(handler)
+    logger.warning("before the hour")
+    handler.doRollover()
+    logger.warning("after the hour")
+    assert shipped.wait(2)
+    shipper.stop()
+    handler.close()
+
+    [rotated] = tmp_path.glob("log.*")
+    assert rotated.name.endswith(".gz")
+    assert gzip.decompress(rotated.read_bytes()) == b"before the hour\n"
+    assert (tmp_path / "log").read_text() == "after the hour\n"
+    # nothing left half done
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["log", rotated.name]
+
+
+def test_logging_does_not_wait_for_shipping(tmp_path):
+    release = threading.Event()
+    shipper = LogShipper(tmp_path, release.wait)
+    handler = ShippingFileHandler(tmp_path / "log", shipper)
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    shipper.listener = logging.handlers.QueueListener(log_queue, handler)
+    shipper.listener.start()
+    shipper.start()
+    logger = logging.getLogger("test_logging_does_not_wait")
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    logger.warning("first hour")
+    handler.rolloverAt = 0
+    start = time.monotonic()
+    for idx in range(100):
+        logger.warning("message %d", idx)
+    assert time.monotonic() - start < 0.5
+    release.set()
+    shipper.stop()
+    handler.close()
+    assert len(list(tmp_path.glob("log.*.gz"))) == 1
+    assert (tmp_path / "log").read_text().count("message") == 100
@@ -0,0 +1,65 @@
+import pathlib
+import tempfile
+
+import pytest
+
+from beholder.recorder.metrics import Counter, Metric, MetricsWriter, Registry
+
+def test_render():
+    registry = Registry()
+    segments = registry.counter("segments_total", "Segments")
+    uploads = registry.counter("upload_bytes_total", "Bytes", ["kind"])
+    depth = registry.gauge("queue_depth", "Depth", ["stage"])
+    probe = registry.histogram("probe_seconds", "Probe time", buckets=[0.1, 1])
+    segments.inc()
+    segments.inc(2)
+    uploads.inc(10, kind="videos")
+    uploads.inc(5, kind="keys")
+    registry.add_collector(lambda: depth.set(3, stage="processed"))
+    probe.observe(0.05)
+    probe.observe(0.5)
+    probe.observe(2)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE segments_total counter" in lines
+    assert "segments_total 3" in lines
+    assert 'upload_bytes_total{kind="keys"} 5' in lines
+    assert 'upload_bytes_total{kind="videos"} 10' in lines
+    assert 'queue_depth{stage="processed"} 3' in lines
+    assert 'probe_seconds_bucket{le="0.1"} 1' in lines
+    assert 'probe_seconds_bucket{le="1"} 2' in lines
+    assert 'probe_seconds_bucket{le="+Inf"} 3' in lines
+    assert "probe_seconds_sum 2.55" in lines
+    assert "probe_seconds_count 3" in lines
+
+
+def test_labels_and_counters_checked():
+    registry = Registry()
+    uploads = registry.counter("upload_bytes_total", "Bytes", ["kind"])
+    with pytest.raises(ValueError):
+        uploads.inc(1)
+    with pytest.raises(ValueError):
+        uploads.inc(-1, kind="videos")
+    with pytest.raises(ValueError):
+        registry.counter("upload_bytes_total", "Bytes")
+
+
+def test_gauges_go_both_ways():
+    registry = Registry()
+    depth = registry.gauge("queue_depth", "Depth")
+    depth.inc(3)
+    depth.inc(-2)
+    assert depth.value() == 1
+    assert not isinstance(depth, Counter)
+    with pytest.raises(TypeError):
+        Metric("untyped", "Has no samples")  # type: ignore
+
+
+def test_writer():
+    registry = Registry()
+    registry.counter("segments_total", "Segments").inc()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = pathlib.Path(tmpdirname) / "metrics.prom"
+        MetricsWriter(registry, path, 15).write()
+        assert "segments_total 1" in path.read_text().splitlines()
+        assert [p.name for p in path.parent.iterdir()] == ["metrics.prom"]
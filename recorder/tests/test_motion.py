@@ -0,0 +1,74 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from beholder.recorder.motion import DETECTORS, get_detector # noqa: E402
+
+HEIGHT, WIDTH = 240, 320
+
+
+def frames(count: int):
+    """A still, slightly noisy room, then a bright square walking across it"""
+    rng = np.random.default_rng(0)
+    background = rng.integers(40, 60, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    for idx in range(count):
+        frame = background.copy()
+        if idx >= count - 5:
+            x = 40 + 20 * (idx - count + 5)
+            frame[100:160, x:x + 60] = 250
+        yield idx, frame
+
+
+@pytest.mark.parametrize("name", list(DETECTORS))
+def test_detects_a_moving_square(name):
+    detector = get_detector(name, HEIGHT, WIDTH)
+    results = [detector.motion_bboxes(frame) for _, frame in frames(40)]
+    # nothing moves until the square shows up
+    assert not any(results[5:35])
+    boxes = results[-1]
+    assert 1 <= len(boxes) <= 3
+    # every box is in frame coordinates and touches the square
+    for x, y, w, h in boxes:
+        assert x < 180 and x + w > 120 and y < 160 and y + h > 100
+
+
+def test_unknown_detector():
+    with pytest.raises(ValueError):
+        get_detector("yolo", HEIGHT, WIDTH)
+
+
+def test_tiles_report_per_camera_coordinates():
+    from beholder.recorder.layout import compute_layout
+    from beholder.recorder.motion import TiledDetector
+
+    # two 640x480 cameras stacked, squeezed into a 320x480 frame
+    layout = compute_layout([(640, 480), (640, 480)])
+    assert (layout.width, layout.height) == (640, 960)
+    detector = TiledDetector("mog2", layout, [7, 3], 480, 320)
+    assert [(tile.camera, tile.y, tile.height) for tile in detector.tiles] == [
+        (7, 0, 240), (3, 240, 240)]
+
+    rng = np.random.default_rng(0)
+    background = rng.integers(40, 60, (480, 320, 3), dtype=np.uint8)
+    for idx in range(30):
+        frame = background.copy()
+        if idx == 29:
+            # something shows up in the middle of the second camera
+            frame[340:380, 140:180] = 250
+        boxes = detector.motion_bboxes(frame)
+    assert boxes and {camera for camera, _ in boxes} == {3}
+    for _, (x, y, w, h) in boxes:
+        # (140, 100) in the tile is (280, 200) on the camera
+        assert abs(x - 280) <= 4 and abs(y - 200) <= 4 and abs(w - 80) <= 8 and abs(h - 80) <= 8
+    # after the first frame the unchanged tiles were skipped
+    assert detector.skipped >= 2 * 28 + 1
+
+
+def test_black_tiles_are_skipped():
+    from beholder.recorder.layout import compute_layout
+    from beholder.recorder.motion import TiledDetector
+
+    detector = TiledDetector("diff", compute_layout([(640, 480)]), [0], 480, 640)
+    detector.motion_bboxes(np.zeros((480, 640, 3), np.uint8))
+    assert detector.skipped == 1
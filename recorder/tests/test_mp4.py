@@ -0,0 +1,66 @@
+import datetime
+import pathlib
+import struct
+import tempfile
+
+import pytest
+
+from beholder.recorder.mp4 import MP4_EPOCH, Mp4Error, read_info
+
+def box(box_type: bytes, body: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(body), box_type) + body
+
+
+def full_box(box_type: bytes, version: int, body: bytes) -> bytes:
+    return box(box_type, bytes([version, 0, 0, 0]) + body)
+
+
+def movie(creation: int, timescale: int = 1000, duration: int = 60000) -> bytes:
+    mvhd = full_box(b"mvhd", 0, struct.pack(">IIII", creation, creation, timescale, duration)
+                    + bytes(80))
+    tkhd = full_box(b"tkhd", 0, struct.pack(">IIIII", creation, creation, 1, 0, duration)
+                    + bytes(52) + struct.pack(">II", 1280 << 16, 720 << 16))
+    mdhd = full_box(b"mdhd", 0, struct.pack(">IIII", creation, creation, 90000, 90000 * 60)
+                    + bytes(4))
+    hdlr = full_box(b"hdlr", 0, bytes(4) + b"vide" + bytes(12) + b"\x00")
+    trak = box(b"trak", tkhd + box(b"mdia", mdhd + hdlr))
+    # qtmux writes the moov after the media data
+    return box(b"ftyp", b"qt  " + bytes(4)) + box(b"mdat", bytes(1000)) + box(b"moov", mvhd + trak)
+
+
+def test_read_info():
+    created = datetime.datetime(2021, 9, 1, 12, 30, tzinfo=datetime.timezone.utc)
+    seconds = int((created - MP4_EPOCH).total_seconds())
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = pathlib.Path(tmpdirname) / "output0000000.mp4"
+        path.write_bytes(movie(seconds))
+        info = read_info(path)
+    assert info.creation_time == created
+    assert info.duration == 60
+    assert len(info.tracks) == 1
+    track = info.tracks[0]
+    assert (track.track_id, track.handler, track.width, track.height) == (1, "vide", 1280, 720)
+    assert track.duration == 60
+
+
+def test_unfinished_recording():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = pathlib.Path(tmpdirname) / "output0000000.mp4"
+        path.write_bytes(box(b"ftyp", b"qt  " + bytes(4)) + box(b"mdat", bytes(1000))[:500])
+        with pytest.raises(Mp4Error):
+            read_info(path)
+
+
+@pytest.mark.parametrize("moov", [
+    box(b"mvhd", b""),
+    full_box(b"mvhd", 0, bytes(8)),
+    full_box(b"mvhd", 0, bytes(96)) + box(b"trak", box(b"mdia", box(b"mdhd", b""))),
+    full_box(b"mvhd", 0, bytes(96)) + box(b"trak", box(b"tkhd", b"")),
+])
+def test_truncated_boxes(moov):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = pathlib.Path(tmpdirname) / "output0000000.mp4"
+        path.write_bytes(box(b"ftyp", b"qt  " + bytes(4)) + box(b"moov", moov))
+        # an Mp4Error, so get_create_time falls back to ffprobe
+        with pytest.raises(Mp4Error):
+            read_info(path)
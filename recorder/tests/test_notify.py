@@ -0,0 +1,57 @@
+import socket
+import sqlite3
+
+import pytest
+
+from beholder.recorder.controller import Credentials
+from beholder.recorder.notify import BLACKOUT_TABLE, RECORDTIME_TABLE
+from beholder.recorder.schedule import WAKE_SCHEDULE_CHANGED
+from beholder.recorder.simulation import SimulatedController, Simulation, SimulationClock
+
+
+@pytest.fixture
+def controller(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    controller = SimulatedController(Simulation(tmp_path, SimulationClock(1), cameras=1))
+    yield controller
+    controller.stop()
+
+
+def send(path, message: bytes):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.sendto(message, str(path))
+
+
+def test_notification_wakes_the_controller(controller):
+    assert controller.schedule_listener is not None
+    send(controller.config.schedule_socket, b"not_a_table")
+    send(controller.config.schedule_socket, RECORDTIME_TABLE.encode())
+    assert controller.wakeup.wait(5) == {WAKE_SCHEDULE_CHANGED}
+    # only the table the webapp named gets reloaded
+    assert controller.pop_changed_tables() == {RECORDTIME_TABLE}
+    assert controller.pop_changed_tables() == set()
+
+    send(controller.config.schedule_socket, BLACKOUT_TABLE.encode())
+    assert controller.wakeup.wait(5) == {WAKE_SCHEDULE_CHANGED}
+    assert controller.pop_changed_tables() == {BLACKOUT_TABLE}
+
+
+def test_schedule_polls_data_version(controller, tmp_path):
+    database = tmp_path / "beholder.sqlite3"
+    webapp = sqlite3.connect(database)
+    webapp.execute("CREATE TABLE blackout_interval (start TEXT, end TEXT)")
+    webapp.execute("CREATE TABLE recordtime (start TEXT, end TEXT, activated INTEGER)")
+    webapp.commit()
+    controller.credentials = Credentials(sqlite3.connect(database), None)
+
+    controller.schedule = controller.refresh_schedule()
+    assert controller.schedule.record_times.intervals == []
+    # nothing committed since: no queries, same schedule
+    assert controller.refresh_schedule() is controller.schedule
+
+    # a change nobody notified about is still picked up
+    webapp.execute("INSERT INTO recordtime VALUES ('08:00:00', '17:00:00', 1)")
+    webapp.commit()
+    schedule = controller.refresh_schedule()
+    assert schedule is not controller.schedule
+    assert len(schedule.record_times.intervals) == 1
@@ -0,0 +1,76 @@
+import pathlib
+
+import pytest
+
+from beholder.recorder.configuration import (
+    CameraDevice, Configuration, DeviceComplex, MicrophoneDevice
+)
+from beholder.recorder.pipeline import PROFILES, SoftwareProfile, get_profile
+
+def configuration(profile: str) -> Configuration:
+    devices = [
+        DeviceComplex(
+            CameraDevice(f"camera {idx}", f"/dev/video{idx}", ""),
+            MicrophoneDevice(f"microphone {idx}", f"hw:{idx}", 1),
+            primary=False, loopback=False, number=idx)
+        for idx in range(3)]
+    return Configuration(
+        user_config={}, primary_device_name="camera 1", devices=devices,
+        output_directory=pathlib.Path("/tmp/beholder-data"), observation_id="test",
+        primary_resolution="640x480", secondary_resolution="1280x720",
+        pipeline_profile=profile)
+
+
+def test_software_profile():
+    pipeline = configuration("software").gstreamer_pipeline()
+    assert "nvcompositor" not in pipeline and "memory:NVMM" not in pipeline
+    assert pipeline.count("videotestsrc") == 3
+    assert "compositor name=comp sink_0::xpos=0 sink_0::ypos=0" in pipeline
+    # every camera keeps its own resolution, side by side is the smallest canvas
+    assert "sink_2::xpos=1920 sink_2::ypos=0 sink_2::width=1280 sink_2::height=720" in pipeline
+    assert "video/x-raw,width=3200,height=720,framerate=15/1,format=I420" in pipeline
+    # only the primary microphone is recorded by default
+    assert pipeline.count("audiotestsrc") == 1
+    assert "! mux.audio_0" in pipeline
+
+
+def test_jetson_profile():
+    flags = configuration("jetson").gstreamer_flags()
+    assert flags[:3] == ["gst-launch-1.0", "-e", "nvcompositor"]
+    assert flags.count("v4l2src") == 3
+    # the primary camera is sink 0 whatever order the devices come in
+    assert flags[flags.index("device=/dev/video1") - 1:flags.index("comp.sink_0") + 1][1:4] == [
+        "device=/dev/video1", "!", "image/jpeg,width=640,height=480,framerate=30/1,"
+        "pixel-aspect-ratio=1/1"]
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        get_profile("raspberry")
+
+
+def test_shm_frames_for_computer_vision():
+    config = configuration("jetson")
+    config.loopback_enabled = True
+    config.cv_transport = "shm"
+    config.gstreamer_in_process = True
+    pipeline = config.gstreamer_pipeline()
+    assert "v4l2sink" not in pipeline
+    assert "queue leaky=downstream" in pipeline
+    assert "video/x-raw,width=640,height=480,framerate=15/1,format=BGRx" in pipeline
+    assert "appsink name=cv" in pipeline
+    assert config.frame_channels == 4
+
+
+def test_frame_channels(monkeypatch):
+    assert configuration("software").frame_channels == 3
+    assert configuration("jetson").frame_channels == 4
+
+    class RgbProfile(SoftwareProfile):
+        name = "rgb"
+        # three letters, but computer vision wants opencv's channel order
+        cv_format = "RGB"
+
+    monkeypatch.setitem(PROFILES, RgbProfile.name, RgbProfile)
+    with pytest.raises(ValueError):
+        configuration("rgb").frame_channels
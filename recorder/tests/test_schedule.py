@@ -0,0 +1,34 @@
+import datetime
+
+from beholder.recorder.interval import Interval, IntervalCollection, RecordTime, TimeInterval
+from beholder.recorder.schedule import Schedule
+
+def dt(hour: int, minute: int = 0, day: int = 1) -> datetime.datetime:
+    return datetime.datetime(2021, 9, day, hour, minute)
+
+
+def test_next_transition_blackout():
+    schedule = Schedule(IntervalCollection([Interval(dt(10), dt(11))]), None)
+    assert schedule.should_record(dt(9))
+    assert schedule.next_transition(dt(9)) == dt(10)
+    assert not schedule.should_record(dt(10))
+    end = schedule.next_transition(dt(10))
+    assert end is not None and end > dt(11)
+    assert schedule.should_record(end)
+    assert schedule.next_transition(end) is None
+
+
+def test_next_transition_record_time_wraps_midnight():
+    night = TimeInterval(dt(22), dt(6))
+    schedule = Schedule(None, RecordTime([night]))
+    assert not schedule.should_record(dt(12))
+    assert schedule.next_transition(dt(12)) == dt(22)
+    assert schedule.should_record(dt(23))
+    end = schedule.next_transition(dt(23))
+    assert end is not None and dt(6, day=2) < end < dt(6, 1, day=2)
+
+
+def test_empty_schedule_always_records():
+    schedule = Schedule(IntervalCollection([]), RecordTime([]))
+    assert schedule.should_record(dt(3))
+    assert schedule.next_transition(dt(3)) is None
@@ -0,0 +1,62 @@
+import datetime
+import io
+import signal
+import time
+
+import pytest
+
+from beholder.recorder.mp4 import read_info
+from beholder.recorder.simulation import (
+    LocalObjectStore, SegmentGenerator, Simulation, SimulationClock, Uplink, simulate, write_mp4)
+
+
+def test_write_mp4(tmp_path):
+    created = datetime.datetime(2021, 9, 1, 12, 30, tzinfo=datetime.timezone.utc)
+    path = tmp_path / "output0000000.mp4"
+    write_mp4(path, created, 1.5, 10000, 1280, 720)
+    assert path.stat().st_size == 10000
+    info = read_info(path)
+    assert info.creation_time == created
+    assert info.duration == 1.5
+    [track] = info.tracks
+    assert (track.handler, track.width, track.height) == ("vide", 1280, 720)
+
+
+def test_segment_generator(tmp_path):
+    closed = []
+    generator = SegmentGenerator(
+        tmp_path / "output%07d.mp4", 0.1, 1000, 640, 480,
+        on_segment=lambda name, at: closed.append(name)).start()
+    time.sleep(0.35)
+    assert generator.poll() is None
+    generator.send_signal(signal.SIGINT)
+    assert generator.wait(1) == 0
+    # the segment being recorded is finished on the way out
+    assert len(closed) == 4
+    assert sorted(path.name for path in tmp_path.iterdir())[0] == "output0000000.mp4"
+
+
+def test_uplink_is_shared(tmp_path):
+    store = LocalObjectStore(tmp_path, Uplink(100000), keep=True)
+    start = time.time()
+    store.upload_fileobj(io.BytesIO(bytes(10000)), "bucket", "a/b")
+    store.upload_fileobj(io.BytesIO(bytes(10000)), "bucket", "a/c")
+    assert time.time() - start == pytest.approx(0.2, abs=0.05)
+    assert (tmp_path / "bucket" / "a" / "c").stat().st_size == 10000
+    assert [(key, nbytes) for key, nbytes, _ in store.snapshot()] == [
+        ("a/b", 10000), ("a/c", 10000)]
+
+
+def test_speed_above_segment_length(tmp_path):
+    with pytest.raises(ValueError):
+        Simulation(tmp_path, SimulationClock(120), segment_seconds=60)
+
+
+def test_simulate(tmp_path, monkeypatch):
+    # the controller keeps its logs relative to where it runs
+    monkeypatch.chdir(tmp_path)
+    simulation = Simulation(tmp_path, SimulationClock(60), hours=2 / 60, segment_bytes=10000)
+    report = simulate(simulation, drain_hours=1 / 60, sample_seconds=10)
+    assert report.segments >= 2
+    assert report.uploaded == report.segments
+    assert report.drain_seconds is not None
@@ -0,0 +1,85 @@
+import datetime
+import pathlib
+import tempfile
+
+from beholder.recorder.interval import Interval, IntervalCollection
+from beholder.recorder.storage import (
+    EVICT_BLACKOUT_FIRST, EVICT_OLDEST, DiskUsage, StorageManager, directory_bytes
+)
+from beholder.recorder.work_queue import STAGE_PROCESSED, STAGE_UPLOADED, WorkQueue
+
+TOTAL = 10000
+
+def add_segments(dir: pathlib.Path, queue: WorkQueue):
+    for hour in range(4):
+        created = datetime.datetime(2021, 9, 1, hour)
+        directory = dir / "processed" / created.strftime("%Y_%m_%d_%H_%M_%S_%f")
+        directory.mkdir(parents=True)
+        (directory / "video.mp4").write_bytes(bytes(1000))
+        queue.add(directory / "video.mp4", STAGE_PROCESSED, created)
+    key = dir / "processed" / "2021_09_01_04_00_00_000000" / "video.mp4.key"
+    key.parent.mkdir()
+    key.write_bytes(bytes(10))
+    queue.add(key, STAGE_UPLOADED, datetime.datetime(2021, 9, 1, 4))
+
+
+def remaining(dir: pathlib.Path):
+    return sorted(path.name[11:13] for path in (dir / "processed").iterdir())
+
+
+def manager(dir: pathlib.Path, queue: WorkQueue, policy: str,
+            other: int = 6000) -> StorageManager:
+    # everything but the segments takes up `other` bytes
+    def usage(path):
+        return DiskUsage(TOTAL, other + directory_bytes(dir / "processed", "*/*"))
+    return StorageManager(queue, dir, dir / "logs", 0.95, 0.75, policy, usage)
+
+
+def test_stage_bytes():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        dir = pathlib.Path(tmpdirname)
+        queue = WorkQueue(dir / "queue.sqlite3")
+        add_segments(dir, queue)
+        storage = manager(dir, queue, EVICT_OLDEST)
+        assert storage.stage_bytes()[STAGE_PROCESSED] == 4000
+        assert storage.stage_bytes()[STAGE_UPLOADED] == 10
+        segment = queue.take(STAGE_PROCESSED)
+        queue.finish(segment)
+        assert storage.stage_bytes()[STAGE_PROCESSED] == 3000
+        assert WorkQueue(dir / "queue.sqlite3").stage_bytes()[STAGE_PROCESSED] == 3000
+
+
+def test_below_high_watermark():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        dir = pathlib.Path(tmpdirname)
+        queue = WorkQueue(dir / "queue.sqlite3")
+        add_segments(dir, queue)
+        storage = manager(dir, queue, EVICT_OLDEST, other=4000)
+        assert storage.enforce() == 9500 - 8010
+        assert storage.headroom() == 9500 - 8010
+        assert remaining(dir) == ["00", "01", "02", "03", "04"]
+
+
+def test_evict_oldest():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        dir = pathlib.Path(tmpdirname)
+        queue = WorkQueue(dir / "queue.sqlite3")
+        add_segments(dir, queue)
+        storage = manager(dir, queue, EVICT_OLDEST)
+        assert storage.enforce() == 9500 - 7010
+        # the key waiting out purgatory is never evicted
+        assert remaining(dir) == ["03", "04"]
+        assert queue.depth()[STAGE_PROCESSED] == 1
+        assert queue.take(STAGE_PROCESSED) is not None
+
+
+def test_evict_blackout_first():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        dir = pathlib.Path(tmpdirname)
+        queue = WorkQueue(dir / "queue.sqlite3")
+        add_segments(dir, queue)
+        storage = manager(dir, queue, EVICT_BLACKOUT_FIRST)
+        blackouts = IntervalCollection(
+            [Interval(datetime.datetime(2021, 9, 1, 1, 30), datetime.datetime(2021, 9, 1, 3))])
+        storage.enforce(blackouts)
+        assert remaining(dir) == ["01", "04"]
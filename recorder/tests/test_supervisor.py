@@ -0,0 +1,68 @@
+import threading
+import time
+
+from beholder.recorder.metrics import JOB_FAILURES
+from beholder.recorder.supervisor import Supervisor
+
+
+def wait_for(condition, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_single_flight():
+    supervisor = Supervisor()
+    release = threading.Event()
+    runs = []
+    results = []
+
+    def work():
+        runs.append(time.monotonic())
+        release.wait()
+        return len(runs)
+
+    supervisor.add("single", work, results.append)
+    supervisor.kick("single")
+    wait_for(lambda: len(runs) == 1)
+    for _ in range(100):
+        supervisor.kick("single")
+    # one run in flight, the hundred kicks are one more run
+    assert supervisor.depth("single") == 2
+    release.set()
+    wait_for(lambda: supervisor.depth("single") == 0)
+    assert results == [1, 2]
+    supervisor.stop()
+
+
+def test_failures_back_off():
+    supervisor = Supervisor()
+    runs = []
+
+    def flaky():
+        runs.append(time.monotonic())
+        if len(runs) < 3:
+            raise OSError("network is down")
+        return "done"
+
+    failures = JOB_FAILURES.value(job="flaky")
+    supervisor.add("flaky", flaky, min_backoff=0.05)
+    supervisor.kick("flaky")
+    wait_for(lambda: len(runs) == 3)
+    assert JOB_FAILURES.value(job="flaky") == failures + 2
+    # 0.05 then 0.1 seconds
+    assert runs[1] - runs[0] >= 0.05
+    assert runs[2] - runs[1] >= 0.1
+    wait_for(lambda: supervisor.depth("flaky") == 0)
+    supervisor.stop()
+
+
+def test_stopped_jobs_do_not_run():
+    supervisor = Supervisor()
+    runs = []
+    supervisor.add("stopped", lambda: runs.append(1))
+    supervisor.stop()
+    supervisor.kick("stopped")
+    time.sleep(0.05)
+    assert runs == []
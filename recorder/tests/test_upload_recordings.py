@@ -0,0 +1,119 @@
+import pathlib
+import time
+
+import pytest
+
+from beholder.recorder.configuration import Configuration
+from beholder.recorder import upload_recordings
+from beholder.recorder.spaces import Spaces
+from beholder.recorder.upload_recordings import prioritize, upload_all
+from beholder.recorder.work_queue import STAGE_PROCESSED, WorkQueue, from_timestamp
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.sqlite3")
+    # three one minute segments: quiet, busy, and one computer vision has not finished
+    for minute, motion in [(0, 1), (1, 60)]:
+        queue.record_activity(minute * 60, 60, 100, motion)
+    for minute in range(3):
+        queue.add(tmp_path / f"{minute}" / "video.mp4", STAGE_PROCESSED,
+                  from_timestamp(minute * 60))
+    queue.record_activity(120, 60, 100, 0)
+    return queue
+
+
+def configuration(policy: str) -> Configuration:
+    return Configuration(
+        user_config={}, primary_device_name="camera", devices=[],
+        output_directory=pathlib.Path("/tmp/beholder-data"), observation_id="test",
+        upload_policy=policy, activity_threshold=0.05, quiet_delay_hours=1)
+
+
+def names(segments):
+    return [segment.path.parent.name for segment in segments]
+
+
+def test_oldest(queue):
+    segments = [queue.take(STAGE_PROCESSED) for _ in range(3)][::-1]
+    assert names(prioritize(configuration("oldest"), queue, segments)) == ["0", "1", "2"]
+
+
+def test_most_active(queue):
+    segments = [queue.take(STAGE_PROCESSED) for _ in range(3)]
+    assert names(prioritize(configuration("most_active"), queue, segments)) == ["1", "0", "2"]
+
+
+def test_threshold(queue):
+    config = configuration("threshold")
+    segments = [queue.take(STAGE_PROCESSED) for _ in range(3)]
+    # the quiet segment waits an hour after it was recorded
+    assert names(prioritize(config, queue, segments, now=600)) == ["1", "2"]
+    assert queue.take(STAGE_PROCESSED, now=3599) is None
+    quiet = queue.take(STAGE_PROCESSED, now=3600)
+    assert names(prioritize(config, queue, [quiet], now=3600)) == ["0"]
+
+
+def test_unknown_policy(queue):
+    with pytest.raises(ValueError):
+        prioritize(configuration("loudest"), queue, [])
+    with pytest.raises(ValueError):
+        upload_all(configuration("loudest"), Spaces(None, "bucket"), queue)
+    # found out before claiming anything
+    assert queue.take(STAGE_PROCESSED) is not None
+
+
+def test_no_client_claims_nothing(queue):
+    assert upload_all(configuration("oldest"), None, queue)["videos"] == 0
+    assert queue.take(STAGE_PROCESSED) is not None
+
+
+def test_failed_job_does_not_abort_the_batch():
+    spaces = Spaces(None, "bucket")
+
+    def vanished():
+        raise FileNotFoundError("video.mp4")
+
+    assert sorted(spaces.map([lambda: 1, vanished, lambda: 2])) == [1, 2]
+
+
+def test_raising_job_gives_its_segment_back(queue, monkeypatch):
+    def crash(config, work_queue, segment, spaces_client):
+        raise RuntimeError("encryption blew up")
+
+    monkeypatch.setattr(upload_recordings, "upload_video", crash)
+    assert upload_all(configuration("oldest"), Spaces(None, "bucket"), queue)["videos"] == 0
+    # not stranded: every segment is taken again after the retry backoff
+    assert queue.take(STAGE_PROCESSED) is None
+    retried = [queue.take(STAGE_PROCESSED, now=time.time() + 3600) for _ in range(3)]
+    assert all(segment is not None and segment.attempts == 1 for segment in retried)
+
+
+class FailingClient:
+    def upload_file(self, filename, bucket, key, Config=None):
+        raise ConnectionError("spaces unreachable")
+
+
+class RecordingClient:
+    def __init__(self):
+        self.keys = []
+
+    def upload_file(self, filename, bucket, key, Config=None):
+        self.keys.append(key)
+
+
+def test_failed_detection_upload_keeps_the_chunk(tmp_path):
+    chunk = tmp_path / "test" / "detections" / "motion" / "0000000060.parquet"
+    chunk.parent.mkdir(parents=True)
+    chunk.write_bytes(b"rows")
+    config = configuration("oldest")
+
+    failing = Spaces(FailingClient(), "bucket")
+    assert upload_recordings.upload_detections(config, chunk, failing) == 0
+    # the only copy of those detections, still there for the next upload
+    assert chunk.exists()
+
+    client = RecordingClient()
+    assert upload_recordings.upload_detections(config, chunk, Spaces(client, "bucket")) == 1
+    assert client.keys == [f"{config.spaces_root_key}/test/detections/motion/0000000060.parquet"]
+    assert not chunk.exists()
@@ -0,0 +1,106 @@
+import datetime
+import pathlib
+import tempfile
+import time
+
+import pytest
+
+from beholder.recorder.work_queue import (
+    STAGE_PROCESSED, STAGE_RECORDED, STAGE_UPLOADED, WorkQueue, to_timestamp
+)
+
+def test_take_advance_defer():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        dir = pathlib.Path(tmpdirname)
+        queue = WorkQueue(dir / "queue.sqlite3")
+        assert queue.add(dir / "recording" / "output0000000.mp4")
+        assert not queue.add(dir / "recording" / "output0000000.mp4")
+        assert queue.add(dir / "recording" / "output0000001.mp4")
+
+        first = queue.take(STAGE_RECORDED)
+        second = queue.take(STAGE_RECORDED)
+        assert first is not None and second is not None
+        assert first.path.name == "output0000000.mp4"
+        assert queue.take(STAGE_RECORDED) is None
+
+        created = datetime.datetime(2021, 9, 1, 12, 0, 0)
+        queue.advance(first, STAGE_PROCESSED, dir / "processed" / "video.mp4", created)
+        queue.defer(second, until=100.0)
+        assert queue.take(STAGE_RECORDED, now=99.0) is None
+        assert queue.take(STAGE_RECORDED, now=100.0) is not None
+
+        processed = queue.take(STAGE_PROCESSED)
+        assert processed is not None
+        assert processed.created == created
+        queue.finish(processed)
+        assert queue.depth()[STAGE_PROCESSED] == 0
+        assert queue.depth()[STAGE_RECORDED] == 1
+
+
+def test_recover():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        dir = pathlib.Path(tmpdirname)
+        (dir / "recording").mkdir()
+        (dir / "recording" / "output0000003.mp4").touch()
+        uploaded = dir / "processed" / "2021_09_01_12_00_00_000000"
+        uploaded.mkdir(parents=True)
+        (uploaded / "video.mp4.key").touch()
+        empty = dir / "processed" / "2021_09_01_12_01_00_000000"
+        empty.mkdir()
+
+        queue = WorkQueue(dir / "queue.sqlite3")
+        queue.add(dir / "recording" / "gone.mp4")
+        queue.take(STAGE_RECORDED)
+        assert queue.recover(dir) == 2
+        assert not empty.exists()
+
+        depth = queue.depth()
+        assert depth[STAGE_RECORDED] == 1
+        assert depth[STAGE_UPLOADED] == 1
+        assert queue.take(STAGE_RECORDED) is not None
+
+
+@pytest.fixture(params=["UTC", "America/New_York", "Asia/Kolkata"])
+def local_timezone(request, monkeypatch):
+    monkeypatch.setenv("TZ", request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_activity_score(local_timezone):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        dir = pathlib.Path(tmpdirname)
+        queue = WorkQueue(dir / "queue.sqlite3")
+        # created is naive UTC, as read from the mp4
+        created = datetime.datetime(1970, 1, 1, 0, 17, 10)
+        assert to_timestamp(created) == 1030
+        queue.add(dir / "processed" / "video.mp4", STAGE_PROCESSED, created)
+        segment = queue.take(STAGE_PROCESSED)
+        assert segment.activity is None
+
+        # segment covers [1030, 1090): half of window 1000 and half of window 1060
+        queue.record_activity(1000, 60, 100, 50)
+        queue.record_activity(1060, 60, 100, 10)
+        # computer vision has not moved past the segment yet
+        assert queue.score(segment, 60) is None
+        queue.record_activity(1120, 60, 100, 0)
+        assert queue.score(segment, 60) == 0.3
+        queue.release(segment)
+        assert queue.take(STAGE_PROCESSED).activity == 0.3
+
+
+def test_retry_later_backs_off():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        dir = pathlib.Path(tmpdirname)
+        queue = WorkQueue(dir / "queue.sqlite3")
+        queue.add(dir / "recording" / "output0000000.mp4")
+        segment = queue.take(STAGE_RECORDED, now=0)
+        queue.retry_later(segment, now=0)
+        assert queue.take(STAGE_RECORDED, now=59) is None
+        segment = queue.take(STAGE_RECORDED, now=60)
+        assert segment.attempts == 1
+        queue.retry_later(segment, now=60)
+        assert queue.take(STAGE_RECORDED, now=179) is None
+        assert queue.take(STAGE_RECORDED, now=180).attempts == 2
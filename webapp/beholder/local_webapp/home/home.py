@@ -13,6 +13,9 @@ from flask_login import current_user
 
 from beholder.local_webapp.models import BlackoutInterval, RecordTime
 from beholder.local_webapp.db import db
+from beholder.local_webapp.notify import (
+    BLACKOUT_TABLE, RECORDTIME_TABLE, notify_schedule_change
+)
 
 # Blueprint Configuration
 home_bp = Blueprint(
@@ -44,10 +47,12 @@ def event(id):
         bi.end = parse(row["end"])
         bi.title = row["title"]
         db.session.commit()
+        notify_schedule_change(BLACKOUT_TABLE)
         return jsonify(sucsess=True)
     elif request.method == 'DELETE':
         db.session.delete(bi)
         db.session.commit()
+        notify_schedule_change(BLACKOUT_TABLE)
         return jsonify(sucsess=True)
 
 @home_bp.route('/events', methods=['GET', 'POST'])
@@ -62,6 +67,7 @@ def events():
         )
         db.session.add(bi)
         db.session.commit()
+        notify_schedule_change(BLACKOUT_TABLE)
         return jsonify(success=True, id=bi.id)
     elif request.method == 'GET':
         events = get_events()
@@ -112,6 +118,7 @@ def settings_recordtime():
             )
             db.session.add(time)
             db.session.commit()
+            notify_schedule_change(RECORDTIME_TABLE)
             return jsonify(success=True, id=time.id)
         else:
             offset = datetime.timedelta(minutes=int(row["offset"]))
@@ -119,6 +126,7 @@ def settings_recordtime():
             _time.end = (parse(row["end"]) + offset).time()
             _time.activated = row["activated"]
             db.session.commit()
+            notify_schedule_change(RECORDTIME_TABLE)
             return jsonify(success=True, id=_time.id)
     elif request.method == 'GET':
         if _time is not None:
@@ -0,0 +1,19 @@
+"""Tell the recorder the recording schedule changed."""
+import socket
+
+from flask import current_app as app
+
+BLACKOUT_TABLE = "blackout_interval"
+RECORDTIME_TABLE = "recordtime"
+
+def notify_schedule_change(table):
+    """Fire and forget, the recorder also picks up changes on its own eventually."""
+    path = app.config.get("SCHEDULE_SOCKET")
+    if not path:
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.sendto(table.encode(), path)
+    except OSError:
+        app.logger.warning("recorder not listening on %s", path, exc_info=True)
@@ -29,6 +29,9 @@ class Config:
     # Special Directory
     LIVESTREAM_PATH = environ.get("LIVESTREAM_PATH")
 
+    # Recorder
+    SCHEDULE_SOCKET = environ.get("SCHEDULE_SOCKET", "/tmp/beholder/schedule.sock")
+
     # Security
     SECURITY_PASSWORD_SALT = environ.get('SECRET_KEY')
     SECURITY_RECOVERABLE = True
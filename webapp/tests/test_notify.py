@@ -0,0 +1,29 @@
+import socket
+
+import pytest
+
+flask = pytest.importorskip("flask")
+
+from beholder.local_webapp.notify import RECORDTIME_TABLE, notify_schedule_change  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = flask.Flask(__name__)
+    app.config["SCHEDULE_SOCKET"] = str(tmp_path / "schedule.sock")
+    with app.app_context():
+        yield app
+
+
+def test_notifies_the_recorder(app):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as recorder:
+        recorder.bind(app.config["SCHEDULE_SOCKET"])
+        notify_schedule_change(RECORDTIME_TABLE)
+        assert recorder.recv(256) == RECORDTIME_TABLE.encode()
+
+
+def test_recorder_not_listening(app):
+    # the change is committed either way, the recorder polls for it eventually
+    notify_schedule_change(RECORDTIME_TABLE)
+    app.config["SCHEDULE_SOCKET"] = None
+    notify_schedule_change(RECORDTIME_TABLE)